@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 
 THIRD_PARTY_APPS = [
     'rest_framework',
+    'fairyspace',
     'corsheaders',
     'django_extensions',
 ]
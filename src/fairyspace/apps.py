@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+
+
+class FairySpaceConfig(AppConfig):
+    name = 'fairyspace'
+    verbose_name = 'FairySpace'
+
+    def ready(self):
+        # 全部模型加载完成后，预先构建模型元数据索引，避免第一次请求时再构建
+        from fairyspace.rest.count import track_cached_count_models
+        from fairyspace.utils.meta import build_model_indexes
+
+        build_model_indexes()
+        # 声明了 cached 计数策略的模型，监听模型的写入信号使计数缓存失效
+        track_cached_count_models()
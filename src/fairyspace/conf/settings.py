@@ -4,6 +4,55 @@ from django.utils.module_loading import import_string
 DEFAULTS = {
     # 视图端点配置
     "ENDPOINTS": None,
+    # 动态序列化类缓存的最大数量，为 None 时不限制
+    "SERIALIZER_CACHE_SIZE": 256,
+    # 是否使用编译后的执行计划进行序列化
+    "COMPILED_SERIALIZER": True,
+    # 展示字段都是真实的列时，是否直接通过 values_list 查询
+    "VALUES_FAST_PATH": True,
+    # 流式列表每次从数据库读取并序列化的数据条数
+    "STREAM_CHUNK_SIZE": 2000,
+    # 不分页并且不使用流式列表时，最多允许返回的数据条数，为 None 时不限制
+    "LIST_MAX_ROWS": None,
+    # 过滤条件执行计划缓存的最大数量
+    "FILTER_PLAN_CACHE_SIZE": 256,
+    # 展开字段查询计划缓存的最大数量
+    "QUERY_PLAN_CACHE_SIZE": 256,
+    # 页码分页默认的总数计算策略：exact, cached, estimated, none
+    "COUNT_STRATEGY": "exact",
+    # cached 策略的缓存时间，单位秒
+    "COUNT_CACHE_TTL": 60,
+    # estimated 策略估算值小于此阈值时，使用精确计数
+    "COUNT_ESTIMATE_THRESHOLD": 10000,
+    # 是否记录每个请求执行的 SQL，统计数量并检测 N+1 查询，为 None 时跟随 DEBUG
+    "QUERY_INSTRUMENTATION": None,
+    # 同一个 SQL 指纹执行次数不小于此值时，认为可能是 N+1 查询，为 None 时不检测
+    "N_PLUS_ONE_THRESHOLD": 5,
+    # 查询数量超过预算时的处理方式：log 记录日志，raise 抛出异常
+    "QUERY_BUDGET_ACTION": "log",
+    # 批量创建和批量更新每一块写入的数据条数
+    "BULK_CHUNK_SIZE": 500,
+    # 批量写入的事务方式：atomic 全部成功或者全部失败，savepoint 每一块使用一个保存点
+    "BULK_TRANSACTION": "atomic",
+    # 导出时每次从数据库读取并序列化的数据条数
+    "EXPORT_CHUNK_SIZE": 2000,
+    # 导出 CSV 时是否输出 UTF-8 BOM，方便 Excel 识别编码
+    "EXPORT_CSV_BOM": True,
+    # 分片导出每个分片的数据条数
+    "EXPORT_SHARD_SIZE": 100000,
+    # 分片导出的进程数量，为 None 时使用 CPU 数量，为 0 时在当前进程中依次导出
+    "EXPORT_MAX_WORKERS": None,
+    # 分片导出的文件目录，为 None 时使用临时目录下的 fairyspace/exports，不要配置为对外访问的目录
+    "EXPORT_SHARD_DIR": None,
+    # 导入文件时错误报告中最多返回的错误行数
+    "IMPORT_MAX_ERRORS": 100,
+    # 删除时是否使用快速级联删除，没有删除信号时级联的数据直接在数据库中删除，不加载到内存
+    "DELETE_FAST": True,
+    # 批量删除每一块删除的数据条数
+    "DELETE_CHUNK_SIZE": 1000,
+    # 批量删除的数据条数超过此值时交给后台任务，为 None 时只有调用端指定时才使用后台任务，
+    # 后台任务的进度保存在 Django 缓存中，多进程部署时需要配置共享的缓存
+    "DELETE_BACKGROUND_THRESHOLD": None,
 }
 
 IMPORT_STRINGS = [
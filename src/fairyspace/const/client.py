@@ -36,6 +36,11 @@ FAIRY_CALLER_NAMESPACE = 'fairyspace'
 
 示例
     ['id', 'name', {'user': ['nick_name']}]
+
+展开一对多或者多对多关系时，可以使用字典的写法，限制每个父对象最多返回的条数，
+并返回每个父对象关联数据的总数（输出的键为 关系名称_total）
+
+    ['id', {'students': {'fields': ['id', 'name'], 'limit': 5, 'ordering': ['-id'], 'total': True}}]
 """
 FAIRY_CALLER_DISPLAY_FIELD_LIST = 'fields'
 
@@ -58,6 +63,13 @@ FAIRY_CALLER_DISPLAY_FIELD_LIST = 'fields'
         },
         ...
     ]
+
+字段名支持点号连接的关系路径，例如 school.name，多个条件之间是并且的关系
+
+支持的运算符：=, !=, >, >=, <, <=, in, not_in, iexact, contains, icontains,
+startswith, istartswith, endswith, iendswith, isnull, range
+
+经过一对多或者多对多关系的路径使用 EXISTS 子查询，取反的运算符表示没有任何关联数据满足条件
 """
 FAIRY_CALLER_QUERY_FILTER_LIST = 'filters'
 
@@ -76,5 +88,180 @@ FAIRY_CALLER_CLOUD_FUNC_NAME = 'func'
 
 """
 访问端传入使用导出配置中的哪个索引 Key
+
+数据格式 <str>
+
+例如：
+
+    {
+        'export': 'default'
+    }
 """
 FAIRY_CALLER_EXPORT_DATA_KEY = 'export'
+
+"""
+导出的文件格式，不传时使用导出配置中的 format，默认为 csv
+
+支持的格式：csv, ndjson, arrow（Arrow IPC 流）, parquet，arrow 和 parquet 需要安装 pyarrow，
+并且只支持真实存在的列（包括经过外键和一对一关系的列）
+
+数据格式 <str>
+
+例如：
+
+    {
+        'export': 'default',
+        'format': 'ndjson'
+    }
+"""
+FAIRY_CALLER_EXPORT_FORMAT = 'format'
+
+"""
+导入的文件格式，不传时根据文件扩展名判断（.csv、.ndjson、.jsonl）
+
+支持的格式：csv, ndjson
+
+数据格式 <str>
+
+例如：
+
+    {
+        'format': 'csv'
+    }
+"""
+FAIRY_CALLER_IMPORT_FORMAT = 'format'
+
+"""
+冲突更新（upsert）和导入时的唯一键，唯一键已经存在的数据更新为传入的值，导入时不传则直接创建
+
+数据格式 <list>
+
+例如：
+
+    {
+        'unique_fields': ['code']
+    }
+"""
+FAIRY_CALLER_UNIQUE_FIELDS = 'unique_fields'
+
+"""
+多对多关系批量关联、取消关联和替换时的多对多字段名称，支持反向多对多的 accessor name
+
+数据格式 <str>
+
+例如：
+
+    {
+        'fairyspace': {'relation': 'teachers'},
+        'data': [[1, 10], [1, 11], [2, 10]]
+    }
+"""
+FAIRY_CALLER_RELATION = 'relation'
+
+"""
+批量删除时是否交给后台任务，返回任务 id，通过 destroy_many/status 查询进度
+
+数据格式 <bool>
+
+例如：
+
+    {
+        'fairyspace': {'background': true},
+        'data': [1, 2, 3]
+    }
+"""
+FAIRY_CALLER_BACKGROUND = 'background'
+
+"""
+查询后台任务进度时的任务 id
+
+数据格式 <str>
+
+例如：
+
+    {
+        'job': '7f0c1d2e...'
+    }
+"""
+FAIRY_CALLER_JOB = 'job'
+
+"""
+不分页的列表查询时，是否使用流式返回
+
+数据格式 <bool>
+
+例如：
+
+    {
+        'stream': True
+    }
+"""
+FAIRY_CALLER_STREAM = 'stream'
+
+"""
+列表查询的分页方式
+
+- page 页码分页（默认），通过 ?page=1&size=20 翻页
+- keyset 游标分页，通过 ?cursor=xxx&size=20 翻页，不查询总数，深度翻页不会变慢
+
+数据格式 <str>
+
+例如：
+
+    {
+        'pagination': 'keyset'
+    }
+"""
+FAIRY_CALLER_PAGINATION = 'pagination'
+
+# 页码分页
+FAIRY_CALLER_PAGINATION_PAGE = 'page'
+# 游标分页
+FAIRY_CALLER_PAGINATION_KEYSET = 'keyset'
+
+"""
+游标分页的排序字段，字段必须建立了索引，并且不能为空，排序的最后会自动补充主键
+
+分组统计时为统计结果的键，- 开头为倒序
+
+数据格式 <list>
+
+例如：
+
+    {
+        'pagination': 'keyset',
+        'ordering': ['-created_at']
+    }
+"""
+FAIRY_CALLER_ORDERING = 'ordering'
+
+"""
+分组统计的分组字段，字段名支持点号连接的关系路径，日期和时间字段可以截断后分组
+
+截断的精度：year, quarter, month, week, day, hour
+
+数据格式 <list>
+
+例如：
+
+    {
+        'group_by': ['school.name', {'field': 'created_at', 'trunc': 'month', 'alias': 'month'}]
+    }
+"""
+FAIRY_CALLER_GROUP_BY = 'group_by'
+
+"""
+分组统计的统计指标，不传时统计数量，返回数据的键默认为 字段名_统计函数，没有字段时为统计函数
+
+统计函数：count, sum, avg, min, max, count_distinct
+
+数据格式 <list>
+
+例如：
+
+    {
+        'metrics': [{'func': 'count'}, {'func': 'sum', 'field': 'score', 'alias': 'total'}],
+        'ordering': ['-count']
+    }
+"""
+FAIRY_CALLER_METRICS = 'metrics'
@@ -46,3 +46,183 @@ user_filter_config = {
 用户进行过滤，
 """
 FAIRY_STATEMENT_USER_FILTER_CONFIG = 'user_filter_config'
+
+"""
+不分页并且不使用流式返回时，列表最多允许返回的数据条数，超过时直接报错，
+提示调用端使用分页或者流式返回，优先级高于全局配置 LIST_MAX_ROWS
+
+数据类型：int
+
+声明位置：命名空间下的对应模型指定端的 Statements 下
+
+示例：
+
+list_max_rows = 10000
+"""
+FAIRY_STATEMENT_LIST_MAX_ROWS = 'list_max_rows'
+
+"""
+允许调用端过滤的字段路径，未声明时，只允许过滤当前模型自身的列（包括外键的值），不能使用关系路径
+
+数据类型：list
+
+声明位置：命名空间下的对应模型指定端的 Statements 下
+
+示例：
+
+filter_fields = ['name', 'school.name', 'teachers.name']
+"""
+FAIRY_STATEMENT_FILTER_FIELDS = 'filter_fields'
+
+"""
+列表查询默认的分页方式，调用端可以在命名空间中通过 pagination 覆盖
+
+数据类型：str，page 或者 keyset
+
+声明位置：命名空间下的对应模型指定端的 Statements 下
+
+示例：
+
+pagination = 'keyset'
+"""
+FAIRY_STATEMENT_PAGINATION = 'pagination'
+
+"""
+游标分页默认的排序字段，字段必须建立了索引，并且不能为空，排序的最后会自动补充主键
+
+数据类型：list
+
+声明位置：命名空间下的对应模型指定端的 Statements 下
+
+示例：
+
+keyset_ordering = ['-created_at']
+"""
+FAIRY_STATEMENT_KEYSET_ORDERING = 'keyset_ordering'
+
+"""
+页码分页的总数计算策略，未声明时使用全局配置 COUNT_STRATEGY
+
+- exact 精确计数
+- cached 精确计数的结果缓存 count_cache_ttl 秒（默认使用全局配置 COUNT_CACHE_TTL），模型数据写入时缓存失效
+- estimated 使用数据库执行计划估算，估算值小于全局配置 COUNT_ESTIMATE_THRESHOLD 时使用精确计数
+- none 不计算总数，返回的 count 为 None
+
+分页返回的数据中，count_strategy 为实际使用的策略
+
+数据类型：str
+
+声明位置：命名空间下的对应模型指定端的 Statements 下
+
+示例：
+
+count_strategy = 'cached'
+count_cache_ttl = 300
+"""
+FAIRY_STATEMENT_COUNT_STRATEGY = 'count_strategy'
+FAIRY_STATEMENT_COUNT_CACHE_TTL = 'count_cache_ttl'
+
+"""
+单个请求允许执行的查询数量，超过时根据全局配置 QUERY_BUDGET_ACTION 记录日志或者抛出异常，
+也可以通过 fairyaction(query_budget=10) 针对单个动作处理器声明，动作处理器的声明优先
+
+声明了预算的动作总是会记录 SQL，不依赖全局配置 QUERY_INSTRUMENTATION，没有开启 QUERY_INSTRUMENTATION 时，
+认证和权限检查的查询不计入预算
+
+数据类型：int 或者 dict，dict 时键为动作名称
+
+声明位置：命名空间下的对应模型指定端的 Statements 下
+
+示例：
+
+query_budget = 10
+
+query_budget = {
+    'list': 5,
+    'retrieve': 3,
+}
+"""
+FAIRY_STATEMENT_QUERY_BUDGET = 'query_budget'
+
+"""
+允许分组统计的字段路径，不声明时只允许当前模型自身的非关系列，不能使用关系路径
+
+数据类型：list
+
+声明位置：命名空间下的对应模型指定端的 Statements 下
+
+示例：
+
+aggregate_fields = ['school.name', 'created_at']
+"""
+FAIRY_STATEMENT_AGGREGATE_FIELDS = 'aggregate_fields'
+
+"""
+允许原子增减的数值字段，不声明时不允许增减
+
+数据类型：list
+
+声明位置：命名空间下的对应模型指定端的 Statements 下
+
+示例：
+
+increment_fields = ['stock', 'view_count']
+"""
+FAIRY_STATEMENT_INCREMENT_FIELDS = 'increment_fields'
+
+"""
+允许创建和更新时嵌套写入的关系字段路径，嵌套的关联数据中的关系使用点号连接的路径，不声明时不允许嵌套写入
+
+关联数据使用关联模型默认的表单校验，不经过关联模型接口的权限、自定义表单和用户字段处理
+
+数据类型：list
+
+声明位置：命名空间下的对应模型指定端的 Statements 下
+
+示例：
+
+nested_fields = ['card', 'teachers', 'classroom', 'classroom.teacher']
+"""
+FAIRY_STATEMENT_NESTED_FIELDS = 'nested_fields'
+
+"""
+批量创建和批量更新的配置，不声明时使用全局配置 BULK_CHUNK_SIZE 和 BULK_TRANSACTION
+
+- bulk_chunk_size 每一块写入的数据条数
+- bulk_transaction 事务方式，atomic 只要有一条数据失败，所有数据都不写入，
+  savepoint 每一块使用一个保存点，失败的数据单独返回错误，其他数据正常写入
+
+声明位置：命名空间下的对应模型指定端的 Statements 下
+
+示例：
+
+bulk_chunk_size = 1000
+bulk_transaction = 'savepoint'
+"""
+FAIRY_STATEMENT_BULK_CHUNK_SIZE = 'bulk_chunk_size'
+FAIRY_STATEMENT_BULK_TRANSACTION = 'bulk_transaction'
+
+"""
+导出配置，调用端通过命名空间中的 export 指定使用哪个配置
+
+- fields 导出的字段，格式和展示字段一致，不声明时使用调用端传入的展示字段
+- format 默认的导出格式
+- filename 导出的文件名称，不包含扩展名
+- headers CSV 的列名映射，键为点号连接的字段路径
+
+数据类型：dict
+
+声明位置：命名空间下的对应模型指定端的 Statements 下
+
+示例：
+
+export_config = {
+    'default': {
+        'fields': ['id', 'name', {'school': ['name']}],
+        'format': 'csv',
+        'filename': '学生',
+        'headers': {'name': '姓名', 'school.name': '学校'},
+    },
+}
+"""
+FAIRY_STATEMENT_EXPORT_CONFIG = 'export_config'
@@ -13,6 +13,10 @@ FAIRY_INNER_ACTION_RETRIEVE_MINE = 'retrieve_mine'
 
 # 删除动作
 FAIRY_INNER_ACTION_DESTROY = 'destroy'
+# 批量删除
+FAIRY_INNER_ACTION_DESTROY_MANY = 'destroy_many'
+# 后台删除任务的进度
+FAIRY_INNER_ACTION_DESTROY_MANY_STATUS = 'destroy_many_status'
 
 # 列表
 FAIRY_INNER_ACTION_LIST = 'list'
@@ -21,9 +25,30 @@ FAIRY_INNER_ACTION_LIST_ENHANCE = 'list_enhance'
 # 检索我的列表动作
 FAIRY_INNER_ACTION_LIST_MINE = 'list_mine'
 
+# 分组统计
+FAIRY_INNER_ACTION_AGGREGATE = 'aggregate'
+
 # 创建动作
 FAIRY_INNER_ACTION_CREATE = 'create'
 
+# 批量创建
+FAIRY_INNER_ACTION_BULK_CREATE = 'bulk_create'
+# 批量更新
+FAIRY_INNER_ACTION_BULK_UPDATE = 'bulk_update'
+# 批量冲突更新
+FAIRY_INNER_ACTION_UPSERT = 'upsert'
+# 原子增减
+FAIRY_INNER_ACTION_INCREMENT = 'increment'
+# 批量原子增减
+FAIRY_INNER_ACTION_INCREMENT_MANY = 'increment_many'
+# 从文件导入
+FAIRY_INNER_ACTION_IMPORT = 'import_data'
+
+# 多对多关系的批量关联、取消关联和替换
+FAIRY_INNER_ACTION_M2M_ADD = 'm2m_add'
+FAIRY_INNER_ACTION_M2M_REMOVE = 'm2m_remove'
+FAIRY_INNER_ACTION_M2M_SET = 'm2m_set'
+
 # 更新动作
 FAIRY_INNER_ACTION_UPDATE = 'update'
 # 部分更新
@@ -40,6 +65,17 @@ FAIRY_INNER_ACTION_BATCH_HANDLE = 'batch'
 # 导出文件的动作
 FAIRY_INNER_ACTION_EXPORT_FILE = 'export'
 
+# 只读的动作，这些动作读取数据时会根据展示字段裁剪查询的列
+FAIRY_INNER_READ_ACTIONS = (
+    FAIRY_INNER_ACTION_RETRIEVE,
+    FAIRY_INNER_ACTION_RETRIEVE_ENHANCE,
+    FAIRY_INNER_ACTION_RETRIEVE_MINE,
+    FAIRY_INNER_ACTION_LIST,
+    FAIRY_INNER_ACTION_LIST_ENHANCE,
+    FAIRY_INNER_ACTION_LIST_MINE,
+    FAIRY_INNER_ACTION_EXPORT_FILE,
+)
+
 # 配置文件夹和配置文件名称
 
 # 放全局的文件夹名称
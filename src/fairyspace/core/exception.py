@@ -14,6 +14,7 @@ FAIRY_MODEL_SLUG_IS_INVALID = 10007
 FAIRY_CANT_NOT_FIND_MODEL = 10008
 FAIRY_BATCH_ACTION_HAND_ERROR = 10009
 FAIRY_FUNCTION_NOT_FOUNT = 10010
+FAIRY_QUERY_BUDGET_EXCEEDED = 10011
 
 # 默认的错误消息
 FAIRY_GLOBAL_ERROR_MESSAGE = '系统内部处理异常'
@@ -31,6 +32,7 @@ ERROR_PHRASES = {
     FAIRY_CANT_NOT_FIND_MODEL: '找不到指定的模型',
     FAIRY_BATCH_ACTION_HAND_ERROR: '批量操作执行异常',
     FAIRY_FUNCTION_NOT_FOUNT: '找不到对应的函数处理器',
+    FAIRY_QUERY_BUDGET_EXCEEDED: '请求执行的查询数量超过预算',
 }
 
 
@@ -0,0 +1,70 @@
+import json
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from fairyspace.core import exception
+from fairyspace.rest.export import COLUMNAR_EXPORT_FORMATS, EXPORT_FORMAT_CSV, EXPORT_FORMATS
+from fairyspace.rest.filters import apply_filters
+from fairyspace.rest.shard import export_sharded
+
+
+def load_json(value, name):
+    """解析 JSON 格式的参数"""
+    if value is None:
+        return
+    try:
+        return json.loads(value)
+    except ValueError:
+        raise CommandError(f'--{name} must be valid JSON')
+
+
+class Command(BaseCommand):
+    """
+    分片并行导出
+
+    分片导出会启动进程池并写入服务器的导出目录，只通过命令或者后台任务执行，不由接口的调用端触发
+    """
+
+    help = 'Exports a model in parallel shards to the export directory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='Model label, e.g. school.Student')
+        parser.add_argument('--fields', required=True, help='Display fields as JSON, e.g. ["id", {"school": ["name"]}]')
+        parser.add_argument('--format', default=EXPORT_FORMAT_CSV, choices=list(EXPORT_FORMATS), help='Export format')
+        parser.add_argument('--filters', help='Filters as JSON, same as the list endpoint')
+        parser.add_argument('--headers', help='CSV header mapping as JSON')
+        parser.add_argument('--filename', help='File name without extension')
+        parser.add_argument('--no-merge', action='store_true', help='Keep shard files instead of merging them')
+        parser.add_argument('--shard-size', type=int, help='Rows per shard')
+        parser.add_argument('--workers', type=int, help='Worker processes, 0 exports in the current process')
+        parser.add_argument('--directory', help='Output directory')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+
+        export_format = options['format']
+        filters = load_json(options['filters'], 'filters')
+        queryset = model._default_manager.all()
+        try:
+            if filters:
+                # 命令由运维执行，传入的过滤字段都允许
+                allowed_fields = [item.get('field') for item in filters if isinstance(item, dict)]
+                queryset = apply_filters(queryset, filters, allowed_fields)
+            result = export_sharded(
+                queryset,
+                load_json(options['fields'], 'fields'),
+                export_format,
+                headers=load_json(options['headers'], 'headers'),
+                filename=options['filename'],
+                merge=not options['no_merge'] and export_format not in COLUMNAR_EXPORT_FORMATS,
+                shard_size=options['shard_size'],
+                max_workers=options['workers'],
+                directory=options['directory'],
+            )
+        except exception.FairySpaceException as e:
+            raise CommandError(e.error_data or e.error_message)
+        self.stdout.write(json.dumps(result, ensure_ascii=False, default=str))
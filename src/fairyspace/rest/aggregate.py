@@ -0,0 +1,196 @@
+"""
+聚合统计
+
+把调用端传入的分组字段和统计指标编译成一条 values().annotate() 查询，在数据库中完成分组统计，
+只返回统计的结果，不需要把数据加载到内存中计算
+
+{
+    'group_by': ['school.name', {'field': 'created_at', 'trunc': 'month'}],
+    'metrics': [
+        {'func': 'count'},
+        {'func': 'avg', 'field': 'classroom.school.established_year', 'alias': 'avg_year'},
+    ],
+    'ordering': ['-count'],
+}
+
+- 字段支持点号连接的关系路径，每一段都会通过模型元数据进行校验
+- 路径中不能经过一对多或者多对多关系，JOIN 产生的重复数据会使统计结果不准确
+- 没有分组字段时，对整个结果集统计，返回一行数据
+- Statements 中没有声明 aggregate_fields 时，只允许统计当前模型自身的非关系列，
+  关系路径需要声明，避免通过 min / max 读取关联模型的敏感字段
+"""
+
+from django.db import models
+from django.db.models import Avg, Count, F, Max, Min, Sum
+from django.db.models.functions import Trunc
+
+from fairyspace.core import exception
+from fairyspace.utils import meta
+
+# 日期截断的精度
+TRUNC_KINDS = ('year', 'quarter', 'month', 'week', 'day', 'hour')
+
+# 统计函数，第二项为是否必须指定字段
+METRIC_FUNCS = {
+    'count': (lambda path: Count(path), False),
+    'sum': (lambda path: Sum(path), True),
+    'avg': (lambda path: Avg(path), True),
+    'min': (lambda path: Min(path), True),
+    'max': (lambda path: Max(path), True),
+    'count_distinct': (lambda path: Count(path, distinct=True), True),
+}
+
+# 求和和平均值只支持数值类型的字段
+NUMERIC_FUNCS = {'sum', 'avg'}
+NUMERIC_FIELDS = (models.IntegerField, models.FloatField, models.DecimalField, models.DurationField)
+
+
+def _raise_aggregate_error(error_data):
+    raise exception.FairySpaceException(
+        error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+        error_data=error_data,
+    )
+
+
+def resolve_path(model, field_path, allowed_fields=None):
+    """校验字段路径，返回 ORM 查询路径和最后一段的字段"""
+    if allowed_fields is None:
+        field = meta.get_field(model, field_path) if isinstance(field_path, str) else None
+        if field is None or not field.concrete or meta.is_relation_field(field):
+            _raise_aggregate_error(f'字段不允许统计：{field_path}')
+    elif field_path not in allowed_fields:
+        _raise_aggregate_error(f'字段不允许统计：{field_path}')
+    try:
+        return meta.resolve_single_path(model, field_path)
+    except ValueError as e:
+        _raise_aggregate_error(f'统计{e}：{field_path}')
+
+
+def compile_group(model, item, allowed_fields=None):
+    """
+    编译分组字段
+
+    Returns:
+        tuple (输出的键，表达式)
+    """
+    if isinstance(item, str):
+        item = {'field': item}
+    if not isinstance(item, dict):
+        _raise_aggregate_error(f'分组字段格式不合法：{item}')
+
+    field_path, trunc = item.get('field'), item.get('trunc')
+    path, field = resolve_path(model, field_path, allowed_fields)
+    if not trunc:
+        return item.get('alias') or field_path, F(path)
+
+    if trunc not in TRUNC_KINDS:
+        _raise_aggregate_error(f'日期截断的精度不支持：{trunc}')
+    if not isinstance(field, models.DateField):
+        _raise_aggregate_error(f'日期截断的字段必须是日期或者时间：{field_path}')
+
+    # 日期字段截断到小时没有意义
+    if trunc == 'hour' and not isinstance(field, models.DateTimeField):
+        _raise_aggregate_error(f'日期字段不支持截断到小时：{field_path}')
+    return item.get('alias') or f'{field_path}_{trunc}', Trunc(path, trunc)
+
+
+def compile_metric(model, item, allowed_fields=None):
+    """
+    编译统计指标
+
+    Returns:
+        tuple (输出的键，表达式)
+    """
+    if not isinstance(item, dict) or item.get('func') not in METRIC_FUNCS:
+        _raise_aggregate_error(f'统计指标不合法：{item}')
+
+    func, field_path = item['func'], item.get('field')
+    build, field_required = METRIC_FUNCS[func]
+    if not field_path:
+        if field_required:
+            _raise_aggregate_error(f'统计函数 {func} 必须指定字段')
+        return item.get('alias') or func, build('pk')
+
+    path, field = resolve_path(model, field_path, allowed_fields)
+    if func in NUMERIC_FUNCS and not isinstance(field, NUMERIC_FIELDS):
+        _raise_aggregate_error(f'统计函数 {func} 只支持数值类型的字段：{field_path}')
+    return item.get('alias') or f'{field_path}_{func}', build(path)
+
+
+class AggregatePlan:
+    """
+    聚合统计的执行计划
+
+    查询时使用 g0、m0 这样的内部别名，避免和模型的字段名称冲突，返回数据时再换成输出的键
+    """
+
+    def __init__(self, groups, metrics, ordering=None):
+        self.groups = groups
+        self.metrics = metrics
+        self.ordering = ordering or []
+
+        self.aliases = {}
+        for prefix, items in (('g', groups), ('m', metrics)):
+            for index, (key, _) in enumerate(items):
+                if key in self.aliases:
+                    _raise_aggregate_error(f'统计结果的键重复：{key}')
+                self.aliases[key] = f'{prefix}{index}'
+        self.order_by = self.get_ordering()
+
+    def get_ordering(self):
+        """排序只支持输出的键，默认按照分组字段排序"""
+        if not self.ordering:
+            return [self.aliases[key] for key, _ in self.groups]
+
+        result = []
+        for item in self.ordering:
+            if not isinstance(item, str):
+                _raise_aggregate_error(f'排序字段不合法：{item}')
+            descending = item.startswith('-')
+            key = item[1:] if descending else item
+            if key not in self.aliases:
+                _raise_aggregate_error(f'排序字段不是统计结果的键：{item}')
+            result.append(f'-{self.aliases[key]}' if descending else self.aliases[key])
+        return result
+
+    def apply(self, queryset):
+        """
+        构建统计查询，没有分组字段时，直接执行聚合查询，返回一行数据
+
+        Returns:
+            有分组字段时返回 values 结果集，否则返回字典组成的列表
+        """
+        metrics = {self.aliases[key]: expression for key, expression in self.metrics}
+        if not self.groups:
+            return [queryset.order_by().aggregate(**metrics)]
+
+        groups = {self.aliases[key]: expression for key, expression in self.groups}
+        return queryset.order_by().values(**groups).annotate(**metrics).order_by(*self.order_by)
+
+    def to_representation(self, rows):
+        """把内部别名换成输出的键"""
+        keys = [(key, self.aliases[key]) for key, _ in self.groups + self.metrics]
+        return [{key: row[alias] for key, alias in keys} for row in rows]
+
+
+def compile_aggregate_plan(model, group_by=None, metrics=None, ordering=None, allowed_fields=None):
+    """
+    编译聚合统计的执行计划
+
+    Params:
+        model 模型类
+        group_by list 分组字段，字段路径或者 {'field': 字段路径, 'trunc': 日期截断的精度, 'alias': 输出的键}
+        metrics list 统计指标 {'func': 统计函数, 'field': 字段路径, 'alias': 输出的键}，默认统计数量
+        ordering list 排序，使用输出的键，- 开头为倒序
+        allowed_fields list 允许统计的字段路径，为 None 时只允许当前模型自身的非关系列
+    """
+    group_by = group_by or []
+    metrics = metrics or [{'func': 'count'}]
+    if not isinstance(group_by, (list, tuple)) or not isinstance(metrics, (list, tuple)):
+        _raise_aggregate_error('分组字段和统计指标必须是列表')
+    if ordering is not None and not isinstance(ordering, (list, tuple)):
+        _raise_aggregate_error('排序必须是列表')
+
+    groups = [compile_group(model, item, allowed_fields) for item in group_by]
+    metrics = [compile_metric(model, item, allowed_fields) for item in metrics]
+    return AggregatePlan(groups, metrics, ordering)
@@ -0,0 +1,464 @@
+"""
+批量创建和批量更新
+
+一次请求写入多条数据，每一条数据使用对应端的表单校验，校验通过的数据按块通过
+bulk_create / bulk_update 写入，不会逐条 save，也不会逐条重新序列化
+
+- atomic 所有数据在一个事务中写入，只要有一条数据校验失败，所有数据都不写入
+- savepoint 每一块数据使用一个保存点，校验失败的数据和写入失败的块单独返回错误，其他数据正常写入
+
+指定 unique_fields 时，批量创建使用 INSERT ... ON CONFLICT，唯一键已经存在的数据更新为传入的值，
+此时表单中这些字段的唯一性校验会被去掉，同一批数据中唯一键重复的数据返回 unique 错误。
+已经存在的数据和批量更新一样，必须在视图过滤之后的结果集中并且通过对象级权限校验，否则返回错误，
+自动插入的用户字段不会更新，已经存在的数据不会因为冲突更新而改变归属
+
+注意：批量写入不会调用表单的 create / update，也不会调用模型的 save，不会触发模型信号
+"""
+
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from rest_framework import serializers
+from rest_framework.exceptions import NotAuthenticated, PermissionDenied
+from rest_framework.permissions import BasePermission
+from rest_framework.validators import UniqueTogetherValidator, UniqueValidator
+
+from fairyspace import const
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.core import exception
+from fairyspace.rest.count import invalidate_count_cache
+from fairyspace.rest.user_pip import fairy_get_user_pip_field
+from fairyspace.rest.validation import BatchValidation
+from fairyspace.utils import meta
+
+BULK_TRANSACTION_ATOMIC = 'atomic'
+BULK_TRANSACTION_SAVEPOINT = 'savepoint'
+
+
+def split_chunks(items, chunk_size):
+    """把列表按照指定大小分块"""
+    for start in range(0, len(items), chunk_size):
+        yield items[start : start + chunk_size]
+
+
+def get_error_detail(exc):
+    """获取校验异常的错误信息"""
+    if isinstance(exc, serializers.ValidationError):
+        return exc.detail
+    return {'non_field_errors': [str(exc)]}
+
+
+def get_through_fields(field):
+    """
+    获取多对多关系的中间表，以及中间表中指向当前模型和关联模型的字段名称，支持反向多对多
+
+    Returns:
+        tuple (中间表，当前模型的字段名称，关联模型的字段名称)
+    """
+    if field.concrete:
+        return field.remote_field.through, field.m2m_field_name(), field.m2m_reverse_field_name()
+    return field.through, field.field.m2m_reverse_field_name(), field.field.m2m_field_name()
+
+
+def set_many_to_many(model, objs, values, clear=True):
+    """
+    通过中间表批量设置多对多关系，只处理自动创建的中间表
+
+    Params:
+        model 模型类
+        objs list 已经写入数据库的对象
+        values list 和 objs 一一对应，每一项为 {字段名称: 关联对象或者主键列表}
+        clear bool 是否先删除原来的关系，新创建的对象不需要删除
+    """
+    names = {name for item in values for name in item}
+    for name in names:
+        field = meta.get_field(model, name)
+        through, source, target = get_through_fields(field)
+
+        pairs = [(obj, item[name]) for obj, item in zip(objs, values) if name in item]
+        if clear:
+            through._default_manager.filter(**{f'{source}__in': [obj.pk for obj, _ in pairs]}).delete()
+        through._default_manager.bulk_create(
+            [
+                through(**{f'{source}_id': obj.pk, f'{target}_id': getattr(related, 'pk', related)})
+                for obj, related_list in pairs
+                for related in related_list
+            ],
+            ignore_conflicts=True,
+        )
+        invalidate_count_cache(through)
+        invalidate_count_cache(field.related_model)
+    if names:
+        invalidate_count_cache(model)
+
+
+class BulkWriter:
+    """
+    批量写入
+
+    同一个表单实例对每一条数据执行 run_validation，不需要为每一条数据构建表单和字段，
+    唯一性和外键的校验在每一批数据校验之前按批查询
+    """
+
+    def __init__(self, view, form_class, partial=False, unique_fields=None, queryset=None):
+        self.view = view
+        self.model = view.fairy_instance.model
+        # 冲突更新允许更新的数据，唯一键已经存在的数据不在此结果集中时返回错误
+        self.queryset = self.model._default_manager.all() if queryset is None else queryset
+        self.form = form_class(context=view.get_serializer_context(), partial=partial)
+
+        statement_class = view.fairy_instance.statement_class
+        self.chunk_size = getattr(statement_class, const.FAIRY_STATEMENT_BULK_CHUNK_SIZE, None)
+        if not self.chunk_size:
+            self.chunk_size = fairy_space_settings.BULK_CHUNK_SIZE
+        self.mode = getattr(statement_class, const.FAIRY_STATEMENT_BULK_TRANSACTION, None)
+        if not self.mode:
+            self.mode = fairy_space_settings.BULK_TRANSACTION
+
+        # 用户字段只获取一次配置，不传时校验之后直接使用当前用户，不需要查询用户表
+        self.user_field = fairy_get_user_pip_field(view)
+        if self.user_field in self.form.fields:
+            self.form.fields[self.user_field].required = False
+
+        self.many_to_many = {field.name for field in self.model._meta.many_to_many}
+        # 自动更新时间的字段，bulk_update 和冲突更新都不会自动处理
+        self.auto_now_fields = [field for field in self.model._meta.concrete_fields if getattr(field, 'auto_now', False)]
+
+        self.unique_fields = self.get_unique_fields(unique_fields) if unique_fields else None
+        # 校验通过的数据中出现过的字段，唯一键冲突时只更新这些字段
+        self.provided_fields = set()
+        # 唯一性和外键的校验按批查询，需要在去掉冲突唯一键的校验之后创建
+        self.batch_validation = BatchValidation(self.form)
+
+    def get_unique_fields(self, unique_fields):
+        """
+        校验冲突的唯一键，并去掉表单中对应的唯一性校验，已经存在的数据会被更新而不是报错
+        """
+        if not isinstance(unique_fields, (list, tuple)) or not all(isinstance(name, str) for name in unique_fields):
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                error_data='唯一键必须是字段名称组成的列表',
+            )
+
+        result = []
+        for name in unique_fields:
+            field = meta.get_field(self.model, name)
+            if field is None or not field.concrete or field.many_to_many:
+                raise exception.FairySpaceException(
+                    error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                    error_data=f'唯一键不是模型的字段：{name}',
+                )
+            result.append(field.name)
+
+            form_field = self.form.fields.get(field.name)
+            if form_field is not None:
+                form_field.validators = [item for item in form_field.validators if not isinstance(item, UniqueValidator)]
+        self.form.validators = [
+            item
+            for item in self.form.validators
+            if not (isinstance(item, UniqueTogetherValidator) and set(item.fields) & set(result))
+        ]
+        return result
+
+    def get_unique_key(self, values):
+        """
+        获取唯一键的值，values 为对象或者字典，包含空值时返回 None（空值不会产生唯一键冲突）
+        """
+        if isinstance(values, dict):
+            key = tuple(values.get(name) for name in self.unique_fields)
+        else:
+            key = tuple(getattr(values, self.model._meta.get_field(name).attname) for name in self.unique_fields)
+        key = tuple(getattr(value, 'pk', value) for value in key)
+        return None if None in key else key
+
+    def get_existing(self, keys):
+        """
+        一次查询获取唯一键已经存在的数据
+
+        Returns:
+            dict {唯一键: 主键}
+        """
+        keys = {key for key in keys if key is not None}
+        if not keys:
+            return {}
+        attnames = [self.model._meta.get_field(name).attname for name in self.unique_fields]
+        if len(attnames) == 1:
+            query = Q(**{f'{attnames[0]}__in': [key[0] for key in keys]})
+        else:
+            query = Q()
+            for key in keys:
+                query |= Q(**dict(zip(attnames, key)))
+        rows = self.model._default_manager.filter(query).values_list(*attnames, 'pk')
+        return {tuple(row[:-1]): row[-1] for row in rows}
+
+    def get_conflict_keys(self, items):
+        """
+        校验之前获取每一条数据的唯一键
+
+        Returns:
+            list 和 items 一一对应，唯一键不完整或者不合法时为 None
+        """
+        keys = []
+        for item in items:
+            values = {}
+            for name in self.unique_fields:
+                form_field = self.form.fields.get(name)
+                value = item.get(name) if isinstance(item, dict) else None
+                # 没有传入的用户字段在校验之后会使用当前用户
+                if name == self.user_field and isinstance(item, dict) and name not in item:
+                    values[name] = self.view.request.user
+                    continue
+                if form_field is not None and value is not None:
+                    try:
+                        value = form_field.to_internal_value(value)
+                    except serializers.ValidationError:
+                        value = None
+                values[name] = value
+            keys.append(self.get_unique_key(values))
+        return keys
+
+    def get_conflict_instances(self, pks):
+        """
+        获取唯一键已经存在的数据，只能更新视图结果集中的数据，存在对象级权限时逐条校验
+
+        Returns:
+            tuple (已经存在的对象 {主键: 对象}，不能更新的数据 {主键: 错误信息})
+        """
+        instances = self.queryset.in_bulk(list(pks)) if pks else {}
+        errors = {pk: {'non_field_errors': ['唯一键对应的数据不存在或者没有权限更新']} for pk in pks if pk not in instances}
+        if any(
+            type(permission).has_object_permission is not BasePermission.has_object_permission
+            for permission in self.view.get_permissions()
+        ):
+            for pk, instance in list(instances.items()):
+                try:
+                    self.view.check_object_permissions(self.view.request, instance)
+                except (NotAuthenticated, PermissionDenied) as e:
+                    errors[pk] = {'non_field_errors': [e.detail]}
+                    del instances[pk]
+        return instances, errors
+
+    def validate_batch(self, items):
+        """
+        校验一批数据，唯一性和外键的校验按批查询
+
+        冲突更新时，校验之前先按唯一键查询已经存在的数据，已经存在的数据作为当前对象校验，
+        其他唯一字段的校验会排除数据自身。同一条 INSERT ... ON CONFLICT 不能更新同一行两次，
+        唯一键重复的数据只写入第一条，后面的数据返回错误
+
+        Returns:
+            list (校验后的数据，错误信息，是否新建) 组成的列表
+        """
+        self.batch_validation.prepare(items)
+        keys = self.get_conflict_keys(items) if self.unique_fields else [None] * len(items)
+        existing = self.get_existing(keys) if self.unique_fields else {}
+        instances, conflict_errors = self.get_conflict_instances(set(existing.values()))
+
+        result, seen = [], set()
+        for item, key in zip(items, keys):
+            if key is not None and key in seen:
+                message = serializers.ErrorDetail(f'唯一键重复：{", ".join(self.unique_fields)}', code='unique')
+                result.append((None, {'non_field_errors': [message]}, False))
+                continue
+            if key is not None:
+                seen.add(key)
+
+            pk = existing.get(key)
+            if pk in conflict_errors:
+                result.append((None, conflict_errors[pk], False))
+                continue
+            instance = instances.get(pk)
+            validated_data, errors = self.validate(item, instance)
+            result.append((validated_data, errors, instance is None))
+        return result
+
+    def validate(self, item, instance=None):
+        """
+        校验单条数据
+
+        Returns:
+            tuple (校验后的数据，错误信息)
+        """
+        if not isinstance(item, dict):
+            return None, {'non_field_errors': ['数据格式不合法']}
+
+        self.form.instance = instance
+        try:
+            validated_data = self.form.run_validation(item)
+        except serializers.ValidationError as e:
+            return None, e.detail
+
+        if self.user_field and self.user_field not in item:
+            validated_data[self.user_field] = self.view.request.user
+        return validated_data, None
+
+    def split_many_to_many(self, validated_data):
+        """拆分出多对多字段的数据，多对多关系在对象写入之后通过中间表设置"""
+        return {name: validated_data.pop(name) for name in list(validated_data) if name in self.many_to_many}
+
+    def check_errors(self, results):
+        """事务模式下只要有一条数据校验失败，所有数据都不写入"""
+        if self.mode == BULK_TRANSACTION_SAVEPOINT:
+            return
+        errors = [item for item in results if item is not None]
+        if errors:
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                error_data=errors,
+            )
+
+    def write(self, pending, results, write_chunk):
+        """
+        按块写入校验通过的数据
+
+        Params:
+            pending list (序号，对象，多对多数据) 组成的列表
+            results list 每一条数据的结果，写入成功后设置 id，写入失败时设置 errors
+            write_chunk function 写入一块数据
+        """
+        atomic = self.mode != BULK_TRANSACTION_SAVEPOINT
+        with transaction.atomic():
+            for chunk in split_chunks(pending, self.chunk_size):
+                try:
+                    with transaction.atomic(savepoint=not atomic):
+                        write_chunk(chunk)
+                except DatabaseError as e:
+                    if atomic:
+                        raise exception.FairySpaceException(
+                            error_code=exception.FAIRY_PARAMETER_BUSINESS_ERROR,
+                            error_data=str(e),
+                        )
+                    for index, _, _ in chunk:
+                        results[index] = {'index': index, 'errors': get_error_detail(e)}
+                    continue
+
+                for index, obj, _ in chunk:
+                    results[index] = {'index': index, 'id': obj.pk}
+
+        if pending:
+            invalidate_count_cache(self.model)
+        return self.get_summary(results)
+
+    def get_summary(self, results):
+        failed = sum(1 for item in results if 'errors' in item)
+        summary = {'success': len(results) - failed, 'failed': failed, 'results': results}
+        if self.unique_fields:
+            summary['created'] = sum(1 for item in results if item.get('created'))
+            summary['updated'] = summary['success'] - summary['created']
+        return summary
+
+    def build_instance(self, validated_data):
+        """
+        根据校验后的数据构建待创建的对象
+
+        Returns:
+            tuple (对象，多对多数据)
+        """
+        many_to_many = self.split_many_to_many(validated_data)
+        self.provided_fields.update(validated_data)
+        return self.model(**validated_data), many_to_many
+
+    def write_create_chunk(self, chunk):
+        """写入一块待创建的数据，指定唯一键时，唯一键冲突的数据更新为传入的值"""
+        objs = [obj for _, obj, _ in chunk]
+        manager = self.model._default_manager
+        if not self.unique_fields:
+            manager.bulk_create(objs)
+        else:
+            # 只更新传入过的字段，没有传入的字段保留数据库中原来的值，用户字段不更新
+            excluded = {*self.unique_fields, self.user_field}
+            update_fields = {
+                field.name
+                for field in self.model._meta.concrete_fields
+                if field.name in self.provided_fields and not field.primary_key and field.name not in excluded
+            }
+            if update_fields:
+                update_fields.update(field.name for field in self.auto_now_fields)
+                manager.bulk_create(
+                    objs, update_conflicts=True, unique_fields=self.unique_fields, update_fields=sorted(update_fields)
+                )
+            else:
+                manager.bulk_create(objs, ignore_conflicts=True)
+
+            # 只忽略冲突或者数据库不支持 RETURNING 时，不会设置主键，按唯一键再查询一次
+            missing = [obj for obj in objs if obj.pk is None]
+            if missing:
+                existing = self.get_existing(self.get_unique_key(obj) for obj in missing)
+                for obj in missing:
+                    obj.pk = existing.get(self.get_unique_key(obj))
+        # 新创建的数据没有原来的关系，冲突更新时需要先删除原来的关系
+        set_many_to_many(
+            self.model, objs, [many_to_many for _, _, many_to_many in chunk], clear=bool(self.unique_fields)
+        )
+
+    def create(self, items):
+        """批量创建，指定唯一键时为批量冲突更新，每一条数据的结果中 created 代表是否新建"""
+        results, pending, created = [], [], {}
+        for index, (validated_data, errors, is_new) in enumerate(self.validate_batch(items)):
+            if errors is not None:
+                results.append({'index': index, 'errors': errors})
+                continue
+            obj, many_to_many = self.build_instance(validated_data)
+            results.append(None)
+            pending.append((index, obj, many_to_many))
+            created[index] = is_new
+        self.check_errors(results)
+
+        self.write(pending, results, self.write_create_chunk)
+        if self.unique_fields:
+            for index, is_new in created.items():
+                if 'id' in results[index]:
+                    results[index]['created'] = is_new
+        return self.get_summary(results)
+
+    def update(self, items, queryset):
+        """
+        批量更新，每一条数据必须包含主键，对象通过一次查询获取
+
+        Params:
+            items list 更新的数据
+            queryset 允许更新的结果集
+        """
+        pk_name = self.model._meta.pk.name
+        pk_field = self.model._meta.pk
+        ids = []
+        for item in items:
+            try:
+                ids.append(pk_field.to_python(item[pk_name]))
+            except Exception:
+                ids.append(None)
+        instances = queryset.in_bulk([item for item in ids if item is not None])
+        self.batch_validation.prepare(items)
+
+        auto_now_fields = self.auto_now_fields
+        results, pending, update_fields = [], [], set()
+        for index, (item, pk) in enumerate(zip(items, ids)):
+            instance = instances.get(pk)
+            if instance is None:
+                results.append({'index': index, 'errors': {pk_name: ['数据不存在']}})
+                continue
+
+            validated_data, errors = self.validate(item, instance)
+            if errors is not None:
+                results.append({'index': index, 'errors': errors})
+                continue
+
+            many_to_many = self.split_many_to_many(validated_data)
+            for name, value in validated_data.items():
+                setattr(instance, name, value)
+                update_fields.add(self.model._meta.get_field(name).name)
+            for field in auto_now_fields:
+                field.pre_save(instance, add=False)
+            results.append(None)
+            pending.append((index, instance, many_to_many))
+        self.check_errors(results)
+
+        if update_fields:
+            update_fields.update(field.name for field in auto_now_fields)
+
+        def write_chunk(chunk):
+            objs = [obj for _, obj, _ in chunk]
+            if update_fields:
+                self.model._default_manager.bulk_update(objs, sorted(update_fields))
+            set_many_to_many(self.model, objs, [many_to_many for _, _, many_to_many in chunk])
+
+        return self.write(pending, results, write_chunk)
@@ -0,0 +1,216 @@
+"""
+分页总数的计算策略
+
+页码分页每一页都要对过滤后的结果集执行一次 COUNT(*)，数据量很大时，这往往是整个请求中
+最慢的查询，这里提供多种计算总数的策略，通过 Statements 中的 count_strategy 选择：
+
+- exact 精确计数（默认）
+- cached 精确计数的结果缓存一段时间，模型数据写入时缓存失效
+- estimated 使用数据库执行计划或者统计信息估算，估算值小于阈值时回退到精确计数
+- none 不计算总数，多查询一条数据判断是否有下一页
+"""
+
+import hashlib
+import json
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import signals
+
+from fairyspace import const
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.utils.module import fairy_load_statement
+
+COUNT_STRATEGY_EXACT = 'exact'
+COUNT_STRATEGY_CACHED = 'cached'
+COUNT_STRATEGY_ESTIMATED = 'estimated'
+COUNT_STRATEGY_NONE = 'none'
+
+COUNT_STRATEGIES = (
+    COUNT_STRATEGY_EXACT,
+    COUNT_STRATEGY_CACHED,
+    COUNT_STRATEGY_ESTIMATED,
+    COUNT_STRATEGY_NONE,
+)
+
+# 缓存键前缀
+COUNT_CACHE_PREFIX = 'fairyspace:count'
+
+
+def get_count_version_key(model):
+    return f'{COUNT_CACHE_PREFIX}:version:{model._meta.label_lower}'
+
+
+def get_count_version(model):
+    """获取模型的计数缓存版本，版本变化后，旧版本的计数缓存全部失效"""
+    key = get_count_version_key(model)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        # 其他请求已经设置过版本时，使用已经存在的版本
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def invalidate_count_cache(model):
+    """
+    使模型的计数缓存失效
+
+    fairyspace 的写入动作（创建、更新、删除、批量写入、多对多关联等）会在写入之后调用，
+    使用 cached 策略的模型还会通过 track_count_cache 监听 ORM 的写入信号。
+    bulk_create、update 等不发送信号的写入需要手动调用，否则依赖 COUNT_CACHE_TTL 过期
+    """
+    cache.set(get_count_version_key(model), uuid.uuid4().hex, None)
+
+
+def count_cache_receiver(sender, **kwargs):
+    """模型数据保存或者删除后，使计数缓存失效"""
+    invalidate_count_cache(sender)
+
+
+def m2m_count_cache_receiver(sender, instance, action, model, **kwargs):
+    """多对多关联变化后，使关联两端和中间表的计数缓存失效"""
+    if not action.startswith('post_'):
+        return
+    invalidate_count_cache(sender)
+    invalidate_count_cache(instance.__class__)
+    invalidate_count_cache(model)
+
+
+# 已经连接了写入信号的模型
+tracked_models = set()
+
+
+def track_count_cache(model):
+    """
+    监听使用 cached 策略的模型的写入信号，ORM 的写入也会使计数缓存失效
+
+    只按照模型连接信号，不监听全局信号，其他模型的 save 不受影响。
+    fairyspace 的删除计划会忽略这里的接收函数，快速删除时直接使计数缓存失效
+    """
+    if model in tracked_models:
+        return
+
+    dispatch_uid = 'fairyspace.count_cache'
+    signals.post_save.connect(count_cache_receiver, sender=model, weak=False, dispatch_uid=dispatch_uid)
+    signals.post_delete.connect(count_cache_receiver, sender=model, weak=False, dispatch_uid=dispatch_uid)
+
+    opts = model._meta
+    throughs = [field.remote_field.through for field in opts.many_to_many]
+    throughs += [relation.through for relation in opts.related_objects if relation.many_to_many]
+    for through in throughs:
+        signals.m2m_changed.connect(m2m_count_cache_receiver, sender=through, weak=False, dispatch_uid=dispatch_uid)
+    tracked_models.add(model)
+
+
+def get_statement_count_strategy(app_label, model):
+    """
+    获取模型在各个端点的 Statements 中声明的计数策略
+
+    和视图中一样，全局空间的声明优先于应用空间的声明，未声明时使用全局配置 COUNT_STRATEGY
+    """
+    statement_modules = [item for item in fairy_load_statement(app_label) if item]
+    endpoints = (getattr(settings, 'FAIRY_SPACE_CONFIG', None) or {}).get('endpoints') or {}
+    strategies = set()
+    for endpoint in endpoints:
+        class_name = f'{model.__name__}{endpoint.title()}Statements'
+        strategy = None
+        for module in statement_modules:
+            strategy = getattr(getattr(module, class_name, None), const.FAIRY_STATEMENT_COUNT_STRATEGY, None)
+            if strategy is not None:
+                break
+        strategies.add(strategy or fairy_space_settings.COUNT_STRATEGY)
+    return strategies
+
+
+def track_cached_count_models():
+    """启动时为声明了 cached 策略的模型连接写入信号"""
+    for app_config in apps.get_app_configs():
+        for model in app_config.get_models():
+            if COUNT_STRATEGY_CACHED in get_statement_count_strategy(app_config.label, model):
+                track_count_cache(model)
+
+
+def get_query_key(queryset):
+    """结果集的指纹，相同的 SQL 和参数得到相同的指纹"""
+    sql, params = queryset.query.sql_with_params()
+    return hashlib.md5(f'{queryset.db}:{sql}:{params!r}'.encode()).hexdigest()
+
+
+def cached_count(queryset, timeout=None):
+    """
+    缓存精确计数的结果
+
+    缓存键包含模型的计数缓存版本，模型数据有写入时，版本变化，缓存自动失效
+
+    注意：只跟踪结果集本身的模型，过滤条件中关联模型的写入不会使缓存失效，依赖 timeout 过期
+    """
+    if timeout is None:
+        timeout = fairy_space_settings.COUNT_CACHE_TTL
+
+    # 启动之后才使用 cached 策略的模型（例如通过全局配置），在第一次计数时连接写入信号
+    track_count_cache(queryset.model)
+
+    queryset = queryset.order_by()
+    key = f'{COUNT_CACHE_PREFIX}:{get_count_version(queryset.model)}:{get_query_key(queryset)}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+def estimate_count(queryset):
+    """
+    通过数据库的执行计划估算结果集的数量，数据库不支持时返回 None
+
+    - PostgreSQL：EXPLAIN 的 Plan Rows
+    - MySQL：EXPLAIN 的 rows
+    """
+    queryset = queryset.order_by()
+    vendor = connections[queryset.db].vendor
+    try:
+        if vendor == 'postgresql':
+            plan = json.loads(queryset.explain(format='json'))
+            return int(plan[0]['Plan']['Plan Rows'])
+        if vendor == 'mysql':
+            plan = json.loads(queryset.explain(format='json'))
+            return int(plan['query_block']['table']['rows_examined_per_scan'])
+    except Exception:
+        return
+    return
+
+
+def estimated_count(queryset, threshold=None):
+    """
+    估算计数，估算值小于阈值或者数据库不支持估算时，使用精确计数
+
+    Returns:
+        tuple (数量，实际使用的策略)
+    """
+    if threshold is None:
+        threshold = fairy_space_settings.COUNT_ESTIMATE_THRESHOLD
+
+    count = estimate_count(queryset)
+    if count is None or count < threshold:
+        return queryset.count(), COUNT_STRATEGY_EXACT
+    return count, COUNT_STRATEGY_ESTIMATED
+
+
+def count_queryset(queryset, strategy, timeout=None):
+    """
+    按照策略计算结果集的数量
+
+    Returns:
+        tuple (数量，实际使用的策略)
+    """
+    if strategy == COUNT_STRATEGY_CACHED:
+        return cached_count(queryset, timeout), COUNT_STRATEGY_CACHED
+    if strategy == COUNT_STRATEGY_ESTIMATED:
+        return estimated_count(queryset)
+    return queryset.count(), COUNT_STRATEGY_EXACT
+
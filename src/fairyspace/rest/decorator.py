@@ -2,8 +2,46 @@
 装饰器列表
 """
 
+# 计算属性的值缓存在模型实例上的属性名称
+FAIRY_PROPERTY_CACHE_NAME = '_fairy_property_cache'
 
-def fairyproperty(verbose_name='', field_type='Char'):
+
+def _get_property_cache(instance):
+    """获取模型实例上的计算属性缓存，模型实例只在一次请求中存在，所以缓存的生命周期就是一次请求"""
+    try:
+        return instance.__dict__[FAIRY_PROPERTY_CACHE_NAME]
+    except KeyError:
+        return instance.__dict__.setdefault(FAIRY_PROPERTY_CACHE_NAME, {})
+
+
+class BoundFairyProperty:
+    """
+    绑定了模型实例的计算属性
+
+    每次访问属性时都会生成新的绑定对象，不会把模型实例保存到类级别共享的描述器上
+    """
+
+    __slots__ = ('descriptor', 'instance')
+
+    def __init__(self, descriptor, instance):
+        self.descriptor = descriptor
+        self.instance = instance
+
+    def __getattr__(self, name):
+        return getattr(self.descriptor, name)
+
+    def __call__(self):
+        cache = _get_property_cache(self.instance)
+        name = self.descriptor.name
+        if name not in cache:
+            if self.descriptor.batch:
+                self.descriptor.prime([self.instance])
+            else:
+                cache[name] = self.descriptor.fget(self.instance)
+        return cache.get(name)
+
+
+def fairyproperty(verbose_name='', field_type='Char', batch=False, depends=None):
     """
     通用的属性装饰器，适合使用在模型中，主要是用来做序列化使用
 
@@ -18,9 +56,30 @@ def fairyproperty(verbose_name='', field_type='Char'):
 
     instance = Spam()
 
-    使用时取值时 instance.age.value
+    使用时取值时 instance.age()
+
+    注意: instance.age 得到的是一个绑定了实例的描述器
+
+    批量计算属性，函数接收的是一页模型实例的列表，返回主键和值的映射，序列化列表数据时，
+    每一页只会调用一次，适合需要查询数据库的计算属性，避免 N+1 查询
+
+    class School:
 
-    注意: instance.age 得到的是一个描述器
+        @fairyproperty('学生数量', 'Integer', batch=True)
+        def student_count(instances):
+            queryset = Student.objects.filter(school__in=instances)
+            return dict(queryset.values('school').annotate(c=Count('id')).values_list('school', 'c'))
+
+    计算结果会缓存在模型实例上，同一次请求中同一个实例只会计算一次
+
+    depends 声明计算属性用到的模型字段，读取数据时只会查询展示字段和 depends 中的字段，
+    没有声明时，不裁剪模型的字段，避免访问被延迟加载的字段时产生 N+1 查询
+
+    class Student:
+
+        @fairyproperty('显示名称', depends=['name', 'classroom'])
+        def display_name(self):
+            return f'{self.classroom_id}-{self.name}'
     """
 
     class Property:
@@ -29,27 +88,60 @@ def fairyproperty(verbose_name='', field_type='Char'):
         def __init__(self, fget, **kwargs):
             # 函数
             self.fget = fget
+            # 属性名称
+            self.name = fget.__name__
             # 属性字段名称
             self.verbose_name = verbose_name
             # 属性字段类型
             self.field_type = field_type
-            # 模型对象实例
-            self._instance = None
+            # 是否是批量计算属性
+            self.batch = batch
+            # 计算属性用到的模型字段，为 None 时代表未声明
+            self.depends = tuple(depends) if depends is not None else None
             # 标识这是一个计算属性字段
             self.is_fairy_property_field = True
 
-        def __get__(self, instance, cls):
-            self._instance = instance
-            return self
+        def __set_name__(self, owner, name):
+            self.name = name
 
-        def __call__(self):
-            # 获取数据
-            if self.fget is not None:
-                return self.fget(self._instance)
+        def __get__(self, instance, cls):
+            if instance is None:
+                return self
+            return BoundFairyProperty(self, instance)
+
+        def prime(self, instances):
+            """
+            批量计算一组模型实例的属性值，并缓存到每个实例上，已经缓存过的实例不会重复计算
+            """
+            pending = [item for item in instances if self.name not in _get_property_cache(item)]
+            if not pending:
+                return
+
+            if self.batch:
+                values = self.fget(pending) or {}
+                for item in pending:
+                    _get_property_cache(item)[self.name] = values.get(item.pk)
+            else:
+                for item in pending:
+                    _get_property_cache(item)[self.name] = self.fget(item)
 
     return Property
 
 
+def prime_fairy_properties(properties, instances):
+    """
+    批量计算一组模型实例的批量计算属性
+
+    Params:
+        properties list 计算属性描述器列表
+        instances list 模型实例列表
+    """
+    if not properties or not instances:
+        return
+    for item in properties:
+        item.prime(instances)
+
+
 def fairyaction(**kwargs):
     """
     动作装饰器，改变函数的某些行为，例如可以针对函数这是函数级别的权限类等等
@@ -57,6 +149,12 @@ def fairyaction(**kwargs):
     @fairyaction(permission_classes=[AllowAny])
     def list_enhance(self, view, request, *args, **kwargs):
         return view.fairy_pure_list(request, *args, **kwargs)
+
+    声明单个动作的查询预算，超过时记录日志或者抛出异常
+
+    @fairyaction(query_budget=5)
+    def list_enhance(self, view, request, *args, **kwargs):
+        ...
     """
 
     def decorator(func):
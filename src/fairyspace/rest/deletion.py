@@ -0,0 +1,262 @@
+"""
+批量删除和快速级联删除
+
+Django 的 Collector 删除数据时，会把所有级联的数据逐层加载到内存中，删除一个学校需要加载所有的班级、
+学生、学生卡和书包。这里根据模型元数据编译删除计划，级联的数据通过子查询直接在数据库中删除：
+
+- CASCADE 的反向关系递归删除，先删除关联的数据，再删除当前数据
+- SET_NULL 的反向关系通过一次 UPDATE 置空
+- PROTECT 的反向关系存在数据时抛出异常
+- 自动创建的多对多中间表直接删除
+- DO_NOTHING 不处理
+
+下面的情况不能快速删除，回退到 Django 的 Collector（逐条加载，触发信号）：
+
+- 涉及的模型连接了 pre_delete / post_delete 信号
+- 存在 RESTRICT、SET_DEFAULT、SET() 等删除方式，存在多表继承、GenericRelation 或者循环的级联关系
+
+要删除的数据按照主键分块，每一块执行一轮删除。数据量很大时可以交给后台任务逐块删除，
+每一块一个事务，进度保存在 Django 缓存中
+
+后台任务的限制：
+
+- 任务在当前 web 进程的守护线程中执行，进程重启或者回收时任务会直接中断，已经删除的块不会回滚
+- 进度保存在 Django 缓存中，多进程部署时需要配置共享的缓存（例如 Redis、Memcached），
+  默认的 LocMemCache 只在当前进程中可见，其他进程查询进度时会找不到任务
+- 任务的进度按照模型和发起删除的用户隔离，只有同一个用户通过同一个模型的接口才能查询
+"""
+
+import logging
+import threading
+import uuid
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import connections, models, router, transaction
+from django.db.models import signals
+
+from fairyspace.core import exception
+from fairyspace.rest.batch import split_chunks
+from fairyspace.rest.count import count_cache_receiver, invalidate_count_cache
+
+logger = logging.getLogger(__name__)
+
+DELETE_JOB_KEY = 'fairyspace:delete:{owner}:{job}'
+# 删除任务的进度保存一天
+DELETE_JOB_TTL = 60 * 60 * 24
+
+DELETE_JOB_RUNNING = 'running'
+DELETE_JOB_FINISHED = 'finished'
+DELETE_JOB_FAILED = 'failed'
+
+
+def has_delete_receivers(model):
+    """
+    模型是否连接了删除信号
+
+    计数缓存的接收函数除外，快速删除时会直接使删除的模型的计数缓存失效
+    """
+    if signals.pre_delete.has_listeners(model):
+        return True
+    sync_receivers, async_receivers = signals.post_delete._live_receivers(model)
+    return any(receiver is not count_cache_receiver for receiver in [*sync_receivers, *async_receivers])
+
+
+class DeleteNode:
+    """
+    一个模型的删除计划
+
+    children 为 (关联模型的外键，子计划)，set_null 和 protected 为关联模型的外键，
+    through 为 (中间表，中间表中指向当前模型的字段名称)
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.children = []
+        self.set_null = []
+        self.protected = []
+        self.through = []
+
+
+def compile_delete_plan(model, path=()):
+    """
+    编译删除计划，不能快速删除时返回 None
+
+    Params:
+        model 模型类
+        path tuple 级联路径上的模型，用来检测循环
+    """
+    opts = model._meta
+    if model in path or opts.parents or has_delete_receivers(model):
+        return
+    if any(field.is_relation for field in opts.private_fields):
+        return
+
+    node = DeleteNode(model)
+    for field in opts.many_to_many:
+        through = field.remote_field.through
+        if not through._meta.auto_created:
+            return
+        node.through.append((through, field.m2m_field_name()))
+
+    # related_objects 不包含 related_name 为 '+' 的隐藏关系，这里需要包含，否则这些关联数据不会被级联处理
+    for relation in opts._get_fields(forward=False, reverse=True, include_hidden=True):
+        # 自动创建的中间表指向当前模型的外键，已经通过多对多关系处理
+        if relation.related_model._meta.auto_created:
+            continue
+        if relation.many_to_many:
+            through = relation.through
+            if not through._meta.auto_created:
+                return
+            node.through.append((through, relation.field.m2m_reverse_field_name()))
+            continue
+
+        field, on_delete = relation.field, relation.on_delete
+        if on_delete is models.CASCADE:
+            child = compile_delete_plan(relation.related_model, path + (model,))
+            if child is None:
+                return
+            node.children.append((field, child))
+        elif on_delete is models.SET_NULL:
+            node.set_null.append(field)
+        elif on_delete is models.PROTECT:
+            node.protected.append(field)
+        elif on_delete is not models.DO_NOTHING:
+            return
+    return node
+
+
+class DeleteExecutor:
+    """按照删除计划执行删除，统计每个模型删除的数量"""
+
+    def __init__(self, plan, using):
+        self.plan = plan
+        self.using = using
+        self.rows = {}
+
+    def related(self, field, queryset):
+        """外键指向 queryset 中数据的关联数据"""
+        values = queryset.values(field.target_field.attname)
+        return field.model._base_manager.using(self.using).filter(**{f'{field.attname}__in': values})
+
+    def check_protected(self, node, queryset):
+        for field in node.protected:
+            if self.related(field, queryset).exists():
+                raise exception.FairySpaceException(
+                    error_code=exception.FAIRY_PARAMETER_BUSINESS_ERROR,
+                    error_data=f'存在受保护的关联数据，不能删除：{field.model._meta.label}.{field.name}',
+                )
+        for field, child in node.children:
+            self.check_protected(child, self.related(field, queryset))
+
+    def delete(self, node, queryset):
+        """先删除中间表和级联的数据，置空 SET_NULL 的外键，最后删除当前数据"""
+        pks = queryset.values('pk')
+        for through, name in node.through:
+            through._base_manager.using(self.using).filter(**{f'{name}__in': pks})._raw_delete(self.using)
+        for field in node.set_null:
+            self.related(field, queryset).update(**{field.name: None})
+        for field, child in node.children:
+            self.delete(child, self.related(field, queryset))
+
+        count = queryset._raw_delete(self.using)
+        if count:
+            label = node.model._meta.label
+            self.rows[label] = self.rows.get(label, 0) + count
+            invalidate_count_cache(node.model)
+
+    def execute(self, pks):
+        """删除一块数据"""
+        queryset = self.plan.model._base_manager.using(self.using).filter(pk__in=pks)
+        with transaction.atomic(using=self.using):
+            self.check_protected(self.plan, queryset)
+            self.delete(self.plan, queryset)
+
+    def get_result(self):
+        return {'deleted': sum(self.rows.values()), 'rows': self.rows}
+
+
+def delete_queryset(queryset, chunk_size, progress=None):
+    """
+    删除结果集中的数据，能快速删除时按块执行删除计划，否则回退到 Django 的 Collector
+
+    Params:
+        queryset 要删除的数据
+        chunk_size int 每一块的数据条数
+        progress function 每一块删除完成时调用 progress(已删除的主键数量，执行器)
+
+    Returns:
+        dict {'deleted': 删除的总数，'rows': {模型: 删除的数量}}
+    """
+    model = queryset.model
+    using = queryset.db if queryset._db else router.db_for_write(model)
+    plan = compile_delete_plan(model)
+    if plan is None:
+        total, rows = queryset.delete()
+        for label in rows:
+            invalidate_count_cache(apps.get_model(label))
+        return {'deleted': total, 'rows': rows}
+
+    pks = list(queryset.order_by().values_list('pk', flat=True))
+    executor = DeleteExecutor(plan, using)
+    done = 0
+    for chunk in split_chunks(pks, chunk_size):
+        executor.execute(chunk)
+        done += len(chunk)
+        if progress:
+            progress(done, executor)
+    return executor.get_result()
+
+
+def get_delete_job_owner(model, user):
+    """删除任务的归属，由模型和发起删除的用户组成"""
+    return f'{model._meta.label_lower}:{getattr(user, "pk", None)}'
+
+
+def get_delete_job(job_id, owner):
+    """获取删除任务的进度，只能获取同一个归属的任务"""
+    if not isinstance(job_id, str):
+        return
+    return cache.get(DELETE_JOB_KEY.format(owner=owner, job=job_id))
+
+
+def _run_delete_job(key, queryset, chunk_size):
+    job = cache.get(key)
+
+    def progress(done, executor):
+        job.update(done=done, **executor.get_result())
+        cache.set(key, job, DELETE_JOB_TTL)
+
+    try:
+        job.update(delete_queryset(queryset, chunk_size, progress))
+        job['status'] = DELETE_JOB_FINISHED
+    except Exception as e:
+        logger.exception('fairyspace delete job %s failed', job['job'])
+        job.update(status=DELETE_JOB_FAILED, error=getattr(e, 'error_data', None) or str(e))
+    finally:
+        cache.set(key, job, DELETE_JOB_TTL)
+        connections.close_all()
+
+
+def start_delete_job(queryset, chunk_size, owner):
+    """
+    在后台线程中逐块删除数据，每一块一个事务，中途失败时已经删除的块不会回滚
+
+    Params:
+        queryset 要删除的数据
+        chunk_size int 每一块的数据条数
+        owner str 任务的归属，查询进度时需要一致
+
+    Returns:
+        dict 任务的初始进度，包含任务 id
+    """
+    pks = list(queryset.order_by().values_list('pk', flat=True))
+    job = {'job': uuid.uuid4().hex, 'status': DELETE_JOB_RUNNING, 'total': len(pks), 'done': 0, 'deleted': 0, 'rows': {}}
+    key = DELETE_JOB_KEY.format(owner=owner, job=job['job'])
+    cache.set(key, job, DELETE_JOB_TTL)
+
+    # 后台线程重新按主键构建结果集，不依赖请求中的过滤条件
+    queryset = queryset.model._base_manager.using(queryset.db).filter(pk__in=pks)
+    thread = threading.Thread(target=_run_delete_job, args=(key, queryset, chunk_size), daemon=True)
+    thread.start()
+    return job
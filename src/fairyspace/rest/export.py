@@ -0,0 +1,353 @@
+"""
+数据导出
+
+导出的数据量往往很大，这里按块从数据库读取数据（服务端游标，每一块单独预取关联数据），
+按块序列化，然后逐块写出文件内容，整个导出过程的内存占用和数据总量无关
+
+支持的格式：
+
+- csv 嵌套的单值关系展开成点号连接的列，例如 school.name，多值关系输出 JSON 字符串
+- ndjson 每一行一个 JSON 对象
+- arrow Arrow IPC 流式格式，parquet Parquet 列式文件，需要安装 pyarrow（pip install fairyspace[arrow]），
+  只支持真实存在的列，按块通过 values_list 读取，直接按列构建 record batch，不构建每一行的字典
+"""
+
+import csv
+import io
+import json
+
+from django.conf import settings as django_settings
+from django.db import models
+from rest_framework import serializers
+from rest_framework.utils.encoders import JSONEncoder
+
+from fairyspace import const
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.core import exception
+from fairyspace.rest.stream import iter_chunks
+from fairyspace.utils import meta
+
+EXPORT_FORMAT_CSV = 'csv'
+EXPORT_FORMAT_NDJSON = 'ndjson'
+EXPORT_FORMAT_ARROW = 'arrow'
+EXPORT_FORMAT_PARQUET = 'parquet'
+
+# 列式的导出格式
+COLUMNAR_EXPORT_FORMATS = (EXPORT_FORMAT_ARROW, EXPORT_FORMAT_PARQUET)
+
+
+def _raise_export_error(error_data):
+    raise exception.FairySpaceException(
+        error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+        error_data=error_data,
+    )
+
+
+def get_export_columns(serializer, prefix=()):
+    """
+    根据序列化类的字段形状获取导出的列，单值的嵌套序列化类展开成多列
+
+    Returns:
+        list 每一列为字段路径组成的元组，例如 ('school', 'name')
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+
+    columns = []
+    for field in serializer._readable_fields:
+        path = prefix + (field.field_name,)
+        if isinstance(field, serializers.Serializer):
+            columns.extend(get_export_columns(field, path))
+        else:
+            columns.append(path)
+    return columns
+
+
+def dumps(value):
+    """和接口返回的 JSON 保持一致的编码方式"""
+    return json.dumps(value, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def get_cell(row, path):
+    """按照字段路径取值，中间的关系为空时返回 None"""
+    value = row
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def to_cell(value):
+    """把单元格的值转换成 CSV 中的文本"""
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return dumps(value)
+    return value
+
+
+def iter_csv(chunks, columns, headers=None, bom=True, include_header=True):
+    """
+    逐块输出 CSV 文件内容
+
+    Params:
+        chunks iterable 已经序列化好的数据块，每一块是一个列表
+        columns list 导出的列
+        headers dict 列名的映射，键为点号连接的字段路径，没有映射的列使用字段路径
+        bom bool 是否输出 UTF-8 BOM，方便 Excel 识别编码
+        include_header bool 是否输出表头（包括 BOM），分片导出时只有第一个分片输出表头
+    """
+    headers = headers or {}
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if include_header:
+        names = ['.'.join(path) for path in columns]
+        writer.writerow([headers.get(name, name) for name in names])
+        yield (('\ufeff' if bom else '') + buffer.getvalue()).encode('utf-8')
+
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([to_cell(get_cell(row, path)) for path in columns] for row in chunk)
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_ndjson(chunks):
+    """逐块输出 NDJSON 文件内容"""
+    for chunk in chunks:
+        if chunk:
+            yield ''.join(f'{dumps(row)}\n' for row in chunk).encode('utf-8')
+
+
+"""
+导出格式，值为 (内容类型，文件扩展名)
+"""
+EXPORT_FORMATS = {
+    EXPORT_FORMAT_CSV: ('text/csv; charset=utf-8', 'csv'),
+    EXPORT_FORMAT_NDJSON: ('application/x-ndjson', 'ndjson'),
+    EXPORT_FORMAT_ARROW: ('application/vnd.apache.arrow.stream', 'arrows'),
+    EXPORT_FORMAT_PARQUET: ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def get_export_config(statement_class, key):
+    """
+    获取 Statements 中声明的导出配置
+
+    Params:
+        statement_class 配置声明类
+        key str 调用端传入的导出配置的键，为空时不使用导出配置
+    """
+    if not key:
+        return
+    export_configs = getattr(statement_class, const.FAIRY_STATEMENT_EXPORT_CONFIG, None) or {}
+    config = export_configs.get(key) if isinstance(export_configs, dict) else None
+    if not isinstance(config, dict):
+        _raise_export_error(f'找不到对应的导出配置：{key}')
+    return config
+
+
+def iter_export(chunks, export_format, columns, headers=None, bom=True, include_header=True):
+    """按照导出格式逐块输出文件内容"""
+    if export_format == EXPORT_FORMAT_CSV:
+        return iter_csv(chunks, columns, headers, bom, include_header)
+    if export_format == EXPORT_FORMAT_NDJSON:
+        return iter_ndjson(chunks)
+    _raise_export_error(f'导出格式不支持：{export_format}')
+
+
+def import_pyarrow():
+    """pyarrow 是可选依赖，只有导出列式格式时才需要"""
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        _raise_export_error('导出 arrow 和 parquet 格式需要安装 pyarrow')
+    return pyarrow
+
+
+def _to_str(value):
+    return str(value)
+
+
+def get_arrow_type(pa, field):
+    """
+    根据 Django 字段类型获取 Arrow 类型和转换函数，转换函数为 None 时代表不需要转换
+
+    注意：子类需要放在父类前面，例如 BigAutoField 是 AutoField 的子类
+    """
+    if isinstance(field, (models.BigAutoField, models.BigIntegerField, models.PositiveBigIntegerField)):
+        return pa.int64(), None
+    if isinstance(field, (models.SmallAutoField, models.SmallIntegerField, models.PositiveSmallIntegerField)):
+        return pa.int16(), None
+    if isinstance(field, (models.AutoField, models.IntegerField)):
+        return pa.int32(), None
+    if isinstance(field, models.FloatField):
+        return pa.float64(), None
+    if isinstance(field, models.DecimalField):
+        return pa.decimal128(field.max_digits, field.decimal_places), None
+    if isinstance(field, models.BooleanField):
+        return pa.bool_(), None
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp('us', tz='UTC' if django_settings.USE_TZ else None), None
+    if isinstance(field, models.DateField):
+        return pa.date32(), None
+    if isinstance(field, models.TimeField):
+        return pa.time64('us'), None
+    if isinstance(field, models.DurationField):
+        return pa.duration('us'), None
+    if isinstance(field, models.BinaryField):
+        return pa.binary(), bytes
+    if isinstance(field, models.JSONField):
+        return pa.string(), dumps
+    if isinstance(field, (models.CharField, models.TextField)):
+        return pa.string(), None
+    if isinstance(field, models.UUIDField):
+        return pa.string(), _to_str
+    return pa.string(), _to_str
+
+
+class ColumnarPlan:
+    """
+    列式导出的执行计划
+
+    columns 为 (列名，查询路径，Arrow 类型，转换函数) 组成的元组
+    """
+
+    def __init__(self, pa, columns):
+        self.pa = pa
+        self.names = [item[0] for item in columns]
+        self.paths = [item[1] for item in columns]
+        self.types = [item[2] for item in columns]
+        self.converters = [item[3] for item in columns]
+        self.schema = pa.schema(list(zip(self.names, self.types)))
+
+    def apply(self, queryset):
+        """按列读取数据，不需要构建模型实例和预取关联数据"""
+        return queryset.prefetch_related(None).values_list(*self.paths)
+
+    def to_batch(self, rows):
+        """把一块 values_list 数据按列转换成 record batch"""
+        arrays = []
+        for values, arrow_type, converter in zip(zip(*rows), self.types, self.converters):
+            if converter is not None:
+                values = [None if value is None else converter(value) for value in values]
+            arrays.append(self.pa.array(values, type=arrow_type))
+        return self.pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+
+def compile_columnar_plan(model, columns):
+    """
+    编译列式导出的执行计划，每一列必须是真实存在的列或者经过单值关系的列
+
+    Params:
+        model 模型类
+        columns list get_export_columns 返回的列
+    """
+    pa = import_pyarrow()
+    items = []
+    for path in columns:
+        field_path = '.'.join(path)
+        try:
+            query, field = meta.resolve_single_path(model, field_path)
+        except ValueError as e:
+            _raise_export_error(f'列式导出{e}：{field_path}')
+        if not field.concrete:
+            _raise_export_error(f'列式导出只支持真实存在的列：{field_path}')
+        arrow_type, converter = get_arrow_type(pa, field)
+        items.append((field_path, query, arrow_type, converter))
+    if not items:
+        _raise_export_error('列式导出至少需要一列')
+    return ColumnarPlan(pa, items)
+
+
+class _ChunkSink:
+    """
+    Arrow 写入的目标文件，只在内存中保留上一次取走之后写入的数据
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.buffer = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.buffer.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self.buffer = b''.join(self.buffer), []
+        return data
+
+
+def iter_columnar(chunks, export_format, plan):
+    """
+    逐块输出 Arrow IPC 流或者 Parquet 文件内容，每一块数据写成一个 record batch（Parquet 中的一个 row group）
+
+    Params:
+        chunks iterable values_list 的数据块
+        export_format str arrow 或者 parquet
+        plan ColumnarPlan 列式导出的执行计划
+    """
+    pa = plan.pa
+    sink = _ChunkSink()
+    if export_format == EXPORT_FORMAT_PARQUET:
+        writer = pa.parquet.ParquetWriter(sink, plan.schema)
+    else:
+        writer = pa.ipc.new_stream(sink, plan.schema)
+
+    for chunk in chunks:
+        if chunk:
+            writer.write_batch(plan.to_batch(chunk))
+            yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def iter_export_content(queryset, serializer, export_format, headers=None, values_plan=None, include_header=True):
+    """
+    按块读取、序列化和输出导出的文件内容，流式导出和分片导出共用，保证输出一致
+
+    - 列式格式按块通过 values_list 读取并按列构建
+    - 其他格式按块序列化之后再逐块输出，存在扁平字段的执行计划时直接通过 values_list 读取
+    - 结果集没有排序时按照主键排序，保证导出的结果是稳定的
+
+    Params:
+        queryset 过滤之后的结果集
+        serializer 导出的序列化对象（many=True）
+        export_format str 导出格式
+        headers dict CSV 的列名映射
+        values_plan ValuesPlan 扁平字段的执行计划
+        include_header bool 是否输出 CSV 表头
+    """
+    chunk_size = fairy_space_settings.EXPORT_CHUNK_SIZE
+    columns = get_export_columns(serializer)
+    if not queryset.ordered:
+        queryset = queryset.order_by('pk')
+
+    if export_format in COLUMNAR_EXPORT_FORMATS:
+        plan = compile_columnar_plan(queryset.model, columns)
+        return iter_columnar(iter_chunks(plan.apply(queryset), chunk_size), export_format, plan)
+
+    if values_plan is not None:
+        queryset = values_plan.apply(queryset)
+        serialize = values_plan.execute_many
+    else:
+        serialize = serializer.to_representation
+
+    chunks = (serialize(chunk) for chunk in iter_chunks(queryset, chunk_size))
+    return iter_export(chunks, export_format, columns, headers, fairy_space_settings.EXPORT_CSV_BOM, include_header)
@@ -1,6 +1,7 @@
-import inspect
 from rest_framework import fields
 
+from fairyspace.utils import meta
+
 
 class PropertyFieldMixin:
     """计算字段业务"""
@@ -25,13 +26,23 @@ def fairy_property_to_drf_field(field_type):
 
 def get_fairy_property_fields(model):
     """
-    获取模型中使用 fairyproperty 装饰的方法列表
+    获取模型中使用 fairyproperty 装饰的方法列表，从模型元数据索引中读取
     """
-    result = {}
+    return meta.get_fairy_property_fields(model)
+
 
-    for name, method in inspect.getmembers(model, predicate=inspect.ismethoddescriptor):
-        if not name.startswith('__') and getattr(method, 'is_fairy_property_field', False):
-            result[name] = method
+def get_batch_fairy_properties(serializer):
+    """
+    获取序列化对象需要输出的批量计算属性描述器列表
+    """
+    property_fields = get_fairy_property_fields(serializer.Meta.model)
+    result = []
+    for field in serializer._readable_fields:
+        if not isinstance(field, PropertyFieldMixin):
+            continue
+        descriptor = property_fields.get(field.source)
+        if descriptor is not None and descriptor.batch:
+            result.append(descriptor)
     return result
 
 
@@ -0,0 +1,257 @@
+"""
+过滤条件编译
+
+把调用端传入的过滤条件编译成 Q 对象，下推到数据库中执行
+
+[
+    {'field': 'name', 'operator': '=', 'value': 'allen'},
+    {'field': 'school.name', 'operator': 'startswith', 'value': '第一'},
+    {'field': 'teachers.courses.code', 'operator': 'in', 'value': ['A01', 'A02']},
+]
+
+- 字段支持点号连接的关系路径，每一段都会通过模型元数据进行校验
+- 路径中经过一对多或者多对多关系时，使用 EXISTS 子查询（半连接），不会因为 JOIN 产生重复数据，
+  也就不需要 DISTINCT，路径以一对多或者多对多关系结尾的 isnull 判断是否存在关联数据
+- Statements 中没有声明 filter_fields 时，只允许过滤当前模型自身的列（包括外键的值），
+  不能通过关系路径访问关联模型的字段，避免通过 startswith 这类条件逐位猜测敏感字段
+- 相同形状（模型，字段，运算符）的过滤条件只解析一次，解析结果缓存起来
+"""
+
+from django.db.models import Exists, OuterRef, Q
+
+from rest_framework.filters import BaseFilterBackend
+
+from fairyspace import const
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.core import exception
+from fairyspace.utils import meta
+from fairyspace.utils.cache import LRUCache
+
+# 运算符和 ORM 查询条件的映射，第二项为是否取反
+OPERATORS = {
+    '=': ('exact', False),
+    '!=': ('exact', True),
+    '>': ('gt', False),
+    '>=': ('gte', False),
+    '<': ('lt', False),
+    '<=': ('lte', False),
+    'in': ('in', False),
+    'not_in': ('in', True),
+    'iexact': ('iexact', False),
+    'contains': ('contains', False),
+    'icontains': ('icontains', False),
+    'startswith': ('startswith', False),
+    'istartswith': ('istartswith', False),
+    'endswith': ('endswith', False),
+    'iendswith': ('iendswith', False),
+    'isnull': ('isnull', False),
+    'range': ('range', False),
+}
+
+# 值必须是列表的运算符
+LIST_VALUE_LOOKUPS = {'in', 'range'}
+
+
+def _raise_filter_error(error_data):
+    raise exception.FairySpaceException(
+        error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+        error_data=error_data,
+    )
+
+
+def compile_path(model, field_path, lookup):
+    """
+    把字段路径编译成构建函数，构建函数接收过滤的值，返回 Q 对象
+
+    Params:
+        model 模型类
+        field_path str 点号连接的字段路径
+        lookup str ORM 查询条件，例如 exact
+
+    Returns:
+        function value -> Q
+    """
+    segments = field_path.split('.') if isinstance(field_path, str) else []
+    if not segments or not all(segments):
+        _raise_filter_error(f'过滤字段不合法：{field_path}')
+
+    prefix = []
+    for index, name in enumerate(segments):
+        field = meta.get_field(model, name)
+        if field is None:
+            _raise_filter_error(f'过滤字段不存在：{field_path}')
+
+        is_last = index == len(segments) - 1
+        if not meta.is_relation_field(field):
+            if not is_last:
+                _raise_filter_error(f'过滤字段不是关系字段：{field_path}')
+            query = '__'.join(prefix + [field.name, lookup])
+            return lambda value: Q(**{query: value})
+
+        # 多值的关系，后续的路径通过 EXISTS 子查询处理
+        if meta.get_model_index(model).is_many(name):
+            related_model = field.related_model
+            remainder = '.'.join(segments[index + 1 :]) or related_model._meta.pk.name
+            inner = compile_path(related_model, remainder, lookup)
+            reverse_name = meta.get_reverse_query_name(field)
+            outer_ref = '__'.join(prefix + ['pk'])
+
+            # 路径以多值的关系结尾的 isnull 判断是否存在关联数据，不能编译成 EXISTS(... pk IS NULL)
+            if is_last and lookup == 'isnull':
+
+                def build(value, related_model=related_model, reverse_name=reverse_name, outer_ref=outer_ref):
+                    if not isinstance(value, bool):
+                        _raise_filter_error('运算符 isnull 的值必须是布尔值')
+                    exists = Exists(related_model._default_manager.filter(**{reverse_name: OuterRef(outer_ref)}))
+                    return Q(~exists) if value else Q(exists)
+
+                return build
+
+            def build(value, related_model=related_model, inner=inner, reverse_name=reverse_name, outer_ref=outer_ref):
+                manager = related_model._default_manager
+                subquery = manager.filter(inner(value), **{reverse_name: OuterRef(outer_ref)})
+                return Q(Exists(subquery))
+
+            return build
+
+        # 反向字段查询时使用 related_query_name（即 field.name），而不是 accessor name，
+        # 例如没有指定 related_name 时，accessor name 是 b_set，查询时使用的是 b
+        prefix.append(field.name)
+        model = field.related_model
+
+        # 路径以单值的关系字段结尾时，比较的是关联对象的主键
+        if is_last:
+            query = '__'.join(prefix + [lookup])
+            return lambda value: Q(**{query: value})
+
+
+def is_local_column(model, field_path):
+    """字段是否是当前模型自身的列，外键和一对一的值也是当前模型的列"""
+    field = meta.get_field(model, field_path) if isinstance(field_path, str) else None
+    return field is not None and field.concrete and not field.many_to_many
+
+
+class FilterPlan:
+    """
+    过滤条件的执行计划
+
+    items 为 (构建函数，是否取反，运算符) 组成的元组，和调用端传入的过滤条件一一对应
+    """
+
+    __slots__ = ('model', 'items')
+
+    def __init__(self, model, items):
+        self.model = model
+        self.items = tuple(items)
+
+    def build(self, values):
+        """根据过滤条件的值构建 Q 对象，多个条件之间是并且的关系"""
+        condition = Q()
+        for (builder, negate, lookup), value in zip(self.items, values):
+            if lookup in LIST_VALUE_LOOKUPS and not isinstance(value, (list, tuple)):
+                _raise_filter_error(f'运算符 {lookup} 的值必须是列表')
+            item = builder(value)
+            condition &= ~item if negate else item
+        return condition
+
+
+def compile_filter_plan(model, shape, allowed_fields=None):
+    """
+    编译过滤条件的执行计划
+
+    Params:
+        model 模型类
+        shape tuple (字段路径，运算符) 组成的元组
+        allowed_fields list 允许过滤的字段路径，为 None 时只允许当前模型自身的列
+    """
+    items = []
+    for field_path, operator in shape:
+        if operator not in OPERATORS:
+            _raise_filter_error(f'过滤运算符不支持：{operator}')
+        if allowed_fields is None:
+            if not is_local_column(model, field_path):
+                _raise_filter_error(f'字段不允许过滤：{field_path}')
+        elif field_path not in allowed_fields:
+            _raise_filter_error(f'字段不允许过滤：{field_path}')
+
+        lookup, negate = OPERATORS[operator]
+        items.append((compile_path(model, field_path, lookup), negate, lookup))
+    return FilterPlan(model, items)
+
+
+"""
+过滤条件执行计划缓存，键为 (模型，过滤字段白名单，(字段路径，运算符)...)
+"""
+filter_plan_cache = LRUCache(maxsize=fairy_space_settings.FILTER_PLAN_CACHE_SIZE)
+
+
+def get_filter_plan(model, shape, allowed_fields=None):
+    """获取过滤条件的执行计划，优先从缓存中获取"""
+    allowed_key = tuple(allowed_fields) if allowed_fields is not None else None
+    key = (model, allowed_key, shape)
+    plan = filter_plan_cache.get(key)
+    if plan is None:
+        plan = compile_filter_plan(model, shape, allowed_fields)
+        filter_plan_cache.set(key, plan)
+    return plan
+
+
+def parse_filters(filters):
+    """
+    把调用端传入的过滤条件拆分成形状和值
+
+    Returns:
+        tuple (形状，值列表)
+    """
+    if not isinstance(filters, (list, tuple)):
+        _raise_filter_error('过滤条件必须是列表')
+
+    shape, values = [], []
+    for item in filters:
+        if (
+            not isinstance(item, dict)
+            or not isinstance(item.get('field'), str)
+            or not isinstance(item.get('operator', '='), str)
+        ):
+            _raise_filter_error(f'过滤条件格式不合法：{item}')
+        shape.append((item['field'], item.get('operator', '=')))
+        values.append(item.get('value'))
+    return tuple(shape), values
+
+
+def apply_filters(queryset, filters, allowed_fields=None):
+    """
+    把调用端传入的过滤条件应用到结果集上
+
+    Params:
+        queryset 结果集
+        filters list 过滤条件
+        allowed_fields list 允许过滤的字段路径，为 None 时只允许当前模型自身的列
+    """
+    if not filters:
+        return queryset
+
+    shape, values = parse_filters(filters)
+    plan = get_filter_plan(queryset.model, shape, allowed_fields)
+    try:
+        return queryset.filter(plan.build(values))
+    except exception.FairySpaceException:
+        raise
+    except Exception as e:
+        _raise_filter_error(f'过滤条件的值不合法：{e}')
+
+
+class FairyFilterBackend(BaseFilterBackend):
+    """
+    根据调用端命名空间中的 filters 过滤结果集
+
+    Statements 中可以通过 filter_fields 声明允许过滤的字段路径，没有声明时只允许过滤当前模型自身的列
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        filters = view.fairy_instance.request_namespace.get(const.FAIRY_CALLER_QUERY_FILTER_LIST)
+        if not filters:
+            return queryset
+
+        allowed_fields = getattr(view.fairy_instance.statement_class, const.FAIRY_STATEMENT_FILTER_FIELDS, None)
+        return apply_filters(queryset, filters, allowed_fields)
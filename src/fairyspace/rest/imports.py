@@ -0,0 +1,198 @@
+"""
+数据导入
+
+上传 CSV 或者 NDJSON 文件批量导入数据
+
+- 上传的文件逐行解析，每次只在内存中保留一块数据
+- 每一块数据使用创建动作的表单校验，然后通过 bulk_create 写入，可以指定唯一键进行冲突更新
+- 返回导入的汇总信息和错误报告，错误报告中的行号为文件中的行号，最多返回 IMPORT_MAX_ERRORS 条
+
+CSV 的第一行为字段名称，空字符串视为没有传值
+"""
+
+import csv
+import io
+import json
+import os
+
+from django.db import transaction
+
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.core import exception
+from fairyspace.rest.batch import BULK_TRANSACTION_SAVEPOINT
+
+IMPORT_FORMAT_CSV = 'csv'
+IMPORT_FORMAT_NDJSON = 'ndjson'
+
+# 文件扩展名和导入格式的映射
+IMPORT_EXTENSIONS = {
+    '.csv': IMPORT_FORMAT_CSV,
+    '.ndjson': IMPORT_FORMAT_NDJSON,
+    '.jsonl': IMPORT_FORMAT_NDJSON,
+}
+
+
+def get_import_format(file, import_format=None):
+    """获取导入格式，没有指定时根据文件扩展名判断"""
+    if not import_format:
+        import_format = IMPORT_EXTENSIONS.get(os.path.splitext(file.name or '')[1].lower())
+    if import_format not in (IMPORT_FORMAT_CSV, IMPORT_FORMAT_NDJSON):
+        raise exception.FairySpaceException(
+            error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+            error_data=f'导入格式不支持：{import_format or file.name}',
+        )
+    return import_format
+
+
+def iter_csv_rows(text):
+    """
+    逐行解析 CSV
+
+    Returns:
+        iterator (行号，数据，解析错误)
+    """
+    reader = csv.DictReader(text)
+    for row in reader:
+        # 多出来的列在 DictReader 中的键为 None
+        yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}, None
+
+
+def iter_ndjson_rows(text):
+    """
+    逐行解析 NDJSON，空行忽略
+
+    Returns:
+        iterator (行号，数据，解析错误)
+    """
+    for line_num, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            yield line_num, None, f'JSON 格式错误：{e}'
+            continue
+        if not isinstance(item, dict):
+            yield line_num, None, '每一行必须是 JSON 对象'
+            continue
+        yield line_num, item, None
+
+
+def iter_rows(file, import_format):
+    """逐行解析上传的文件，不会把整个文件读到内存中"""
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        if import_format == IMPORT_FORMAT_CSV:
+            yield from iter_csv_rows(text)
+        else:
+            yield from iter_ndjson_rows(text)
+    except UnicodeDecodeError:
+        raise exception.FairySpaceException(
+            error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+            error_data='文件必须使用 UTF-8 编码',
+        )
+    finally:
+        # 关闭的是上传的文件，由 Django 负责清理，这里只断开包装
+        text.detach()
+
+
+def iter_batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BulkImporter:
+    """
+    批量导入
+
+    写入的方式和批量创建一致：
+
+    - atomic 校验和写入全部在一个事务中，有任何一行失败时，继续校验剩余的数据用于错误报告，
+      但不再写入，最后回滚整个事务
+    - savepoint 每一块数据使用一个保存点，失败的行记录到错误报告中，其他数据正常写入
+    """
+
+    def __init__(self, writer, max_errors=None):
+        self.writer = writer
+        self.max_errors = fairy_space_settings.IMPORT_MAX_ERRORS if max_errors is None else max_errors
+        self.rows = 0
+        self.success = 0
+        self.failed = 0
+        self.created = 0
+        self.errors = []
+
+    def add_error(self, line_num, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line_num, 'errors': errors})
+
+    def get_summary(self):
+        summary = {
+            'rows': self.rows,
+            'success': self.success,
+            'failed': self.failed,
+            'errors': sorted(self.errors, key=lambda item: item['line']),
+            'errors_truncated': self.failed > len(self.errors),
+        }
+        if self.writer.unique_fields:
+            summary['created'] = self.created
+            summary['updated'] = self.success - self.created
+        return summary
+
+    def import_batch(self, batch, atomic):
+        self.rows += len(batch)
+        rows = []
+        for line_num, item, error in batch:
+            if error is not None:
+                self.add_error(line_num, {'non_field_errors': [error]})
+            else:
+                rows.append((line_num, item))
+
+        results, pending, lines = [], [], []
+        validated = self.writer.validate_batch([item for _, item in rows])
+        for (line_num, _), (validated_data, errors, is_new) in zip(rows, validated):
+            if errors is not None:
+                self.add_error(line_num, errors)
+                continue
+            obj, many_to_many = self.writer.build_instance(validated_data)
+            pending.append((len(results), obj, many_to_many))
+            results.append(None)
+            lines.append((line_num, is_new))
+
+        # 事务模式下已经有失败的行时，整个事务都会回滚，不需要再写入
+        if not pending or (atomic and self.failed):
+            return
+
+        self.writer.write(pending, results, self.writer.write_create_chunk)
+        for (line_num, is_new), result in zip(lines, results):
+            if 'errors' in result:
+                self.add_error(line_num, result['errors'])
+            else:
+                self.success += 1
+                self.created += is_new
+
+    def run(self, rows):
+        """
+        导入数据
+
+        Params:
+            rows iterable (行号，数据，解析错误) 组成的迭代器
+        """
+        atomic = self.writer.mode != BULK_TRANSACTION_SAVEPOINT
+        with transaction.atomic():
+            for batch in iter_batches(rows, self.writer.chunk_size):
+                self.import_batch(batch, atomic)
+
+            if atomic and self.failed:
+                self.success = self.created = 0
+                raise exception.FairySpaceException(
+                    error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                    error_data=self.get_summary(),
+                )
+        return self.get_summary()
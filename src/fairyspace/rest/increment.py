@@ -0,0 +1,206 @@
+"""
+原子增减
+
+计数类的字段（库存、浏览数）通过一条 UPDATE ... SET f = f + delta 在数据库中增减，
+不需要先读取数据，也不会因为并发覆盖别人的修改
+
+- 只允许 Statements 中 increment_fields 声明的数值字段
+- 批量增减时，多条数据的增量通过 CASE WHEN 合并到同一条 UPDATE 中
+- 数据库支持 UPDATE ... RETURNING 时（PostgreSQL、SQLite 3.35+）直接返回新的值，
+  否则在同一个事务中再查询一次
+- 自动更新时间的字段（auto_now）同时更新为当前时间
+"""
+
+from decimal import Decimal
+
+from django.db import connections, models, router, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.sql import UpdateQuery
+from django.utils import timezone
+
+from fairyspace import const
+from fairyspace.core import exception
+from fairyspace.rest.count import invalidate_count_cache
+
+
+def _raise_increment_error(error_data):
+    raise exception.FairySpaceException(
+        error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+        error_data=error_data,
+    )
+
+
+def can_update_returning(connection):
+    """数据库是否支持 UPDATE ... RETURNING"""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+def get_increment_fields(model, statement_class):
+    """获取允许增减的字段，没有声明时不允许增减"""
+    names = getattr(statement_class, const.FAIRY_STATEMENT_INCREMENT_FIELDS, None) or []
+    fields = {}
+    for name in names:
+        field = model._meta.get_field(name)
+        if not isinstance(field, (models.IntegerField, models.FloatField, models.DecimalField)) or field.primary_key:
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_INNER_SYSTEM_ERROR,
+                error_data=f'increment_fields 只能声明数值字段：{name}',
+            )
+        fields[field.name] = field
+    return fields
+
+
+def to_delta(field, value):
+    """校验增量，整数字段只接受整数"""
+    if isinstance(value, bool):
+        _raise_increment_error(f'增量必须是数字：{field.name}')
+    if isinstance(field, models.IntegerField):
+        if not isinstance(value, int):
+            _raise_increment_error(f'增量必须是整数：{field.name}')
+        return value
+    if isinstance(field, models.DecimalField):
+        try:
+            return Decimal(str(value))
+        except Exception:
+            _raise_increment_error(f'增量必须是数字：{field.name}')
+    if not isinstance(value, (int, float)):
+        _raise_increment_error(f'增量必须是数字：{field.name}')
+    return value
+
+
+class IncrementPlan:
+    """
+    增减的执行计划
+
+    Params:
+        model 模型类
+        fields dict 允许增减的字段
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        if not fields:
+            _raise_increment_error('当前模型不允许增减')
+
+    def parse(self, deltas):
+        """校验 {字段: 增量}，返回字段名称和增量"""
+        if not isinstance(deltas, dict) or not deltas:
+            _raise_increment_error('增量必须是 {字段: 增量} 格式的非空字典')
+        result = {}
+        for name, value in deltas.items():
+            field = self.fields.get(name)
+            if field is None:
+                _raise_increment_error(f'字段不允许增减：{name}')
+            result[field.name] = to_delta(field, value)
+        return result
+
+    def parse_many(self, items):
+        """
+        校验批量增减的数据，每一条为 {主键字段: 主键, 字段: 增量}
+
+        Returns:
+            dict {主键: {字段: 增量}}
+        """
+        if not isinstance(items, list) or not items:
+            _raise_increment_error('批量增减的数据必须是非空列表')
+        pk_field = self.model._meta.pk
+        result = {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or pk_field.name not in item:
+                _raise_increment_error(f'第 {index} 项数据必须包含主键：{pk_field.name}')
+            deltas = dict(item)
+            try:
+                pk = pk_field.to_python(deltas.pop(pk_field.name))
+            except Exception:
+                _raise_increment_error(f'第 {index} 项数据的主键不合法')
+            if pk in result:
+                _raise_increment_error(f'第 {index} 项数据的主键重复：{pk}')
+            result[pk] = self.parse(deltas)
+        return result
+
+    def get_values(self, deltas):
+        """
+        构建 UPDATE 的赋值表达式
+
+        Params:
+            deltas dict {主键: {字段: 增量}}
+        """
+        names = {name for item in deltas.values() for name in item}
+        values = {}
+        for name in sorted(names):
+            field = self.fields[name]
+            increments = {pk: item[name] for pk, item in deltas.items() if name in item}
+            amounts = set(increments.values())
+            if len(amounts) == 1 and len(increments) == len(deltas):
+                delta = Value(amounts.pop(), output_field=field)
+            else:
+                # 每一条数据的增量不同时，通过 CASE WHEN 合并到一条 UPDATE 中
+                whens = [When(pk=pk, then=Value(amount, output_field=field)) for pk, amount in increments.items()]
+                delta = Case(*whens, default=Value(0, output_field=field), output_field=field)
+            values[name] = F(name) + delta
+
+        now = timezone.now()
+        for field in self.model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False):
+                values[field.name] = now
+        return values
+
+    def execute(self, queryset, deltas):
+        """
+        执行增减
+
+        Params:
+            queryset 允许增减的结果集
+            deltas dict {主键: {字段: 增量}}
+
+        Returns:
+            list 每一条更新的数据的主键和增减字段的新值
+        """
+        pk_name = self.model._meta.pk.name
+        names = sorted({name for item in deltas.values() for name in item})
+        queryset = queryset.filter(pk__in=list(deltas)).order_by()
+        values = self.get_values(deltas)
+        using = queryset.db if queryset._db else router.db_for_write(self.model)
+        connection = connections[using]
+
+        with transaction.atomic(using=using):
+            if can_update_returning(connection):
+                rows = self.update_returning(queryset, values, names, using)
+            else:
+                queryset.update(**values)
+                rows = queryset.values_list('pk', *names)
+
+            result = []
+            for row in rows:
+                item = {pk_name: self.model._meta.pk.to_python(row[0])}
+                for name, value in zip(names, row[1:]):
+                    item[name] = self.fields[name].to_python(value)
+                result.append(item)
+        invalidate_count_cache(self.model)
+        # 按照传入的顺序返回
+        order = {pk: index for index, pk in enumerate(deltas)}
+        result.sort(key=lambda item: order.get(item[pk_name], len(order)))
+        return result
+
+    def update_returning(self, queryset, values, names, using):
+        """执行 UPDATE ... RETURNING，返回主键和增减字段的新值"""
+        query = queryset.query.chain(UpdateQuery)
+        query.add_update_values(values)
+        query.clear_select_clause()
+        compiler = query.get_compiler(using)
+        compiler.pre_sql_setup()
+        sql, params = compiler.as_sql()
+        if not sql:
+            return []
+
+        quote_name = compiler.connection.ops.quote_name
+        columns = [self.model._meta.pk.column] + [self.fields[name].column for name in names]
+        sql = f'{sql} RETURNING {", ".join(quote_name(column) for column in columns)}'
+        with compiler.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
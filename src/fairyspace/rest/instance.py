@@ -28,6 +28,8 @@ DEFAULT_SPACE = {
     #   data: {}
     # }
     'request_namespace': None,
+    # 展开字段的查询计划，select_related 和 prefetch_related 的规划结果
+    'query_plan': None,
     # 配置声明类
     'statement_class': None,
     # 扩展字段是否已经转换过
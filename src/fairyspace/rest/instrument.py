@@ -0,0 +1,88 @@
+"""
+请求级别的 SQL 记录
+
+通过 connection.execute_wrapper 记录一次请求中执行的全部 SQL，统计数量和耗时，并按照指纹
+（参数化之后的 SQL，IN 列表合并）分组，同一个指纹重复执行多次时，很可能是 N+1 查询
+
+注意：流式响应在视图返回之后才会查询数据库，这部分查询不会被记录
+"""
+
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+# IN (%s, %s, ...) 合并成 IN (...)
+IN_LIST_PATTERN = re.compile(r'\bIN\s*\((?:\s*%s\s*,?)+\)', re.IGNORECASE)
+# 数字和字符串字面量
+LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def get_fingerprint(sql):
+    """SQL 的指纹，只保留语句的结构，去掉具体的值"""
+    sql = IN_LIST_PATTERN.sub('IN (...)', sql)
+    sql = LITERAL_PATTERN.sub('?', sql)
+    return WHITESPACE_PATTERN.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """
+    SQL 记录器，作为 execute_wrapper 使用
+
+    recorder = QueryRecorder()
+    with recorder.record():
+        ...
+    recorder.count
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        # 原始 SQL 和执行次数，指纹在需要时才计算，避免每次执行都做正则替换
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+
+    @contextmanager
+    def record(self):
+        """在全部数据库连接上记录 SQL"""
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def get_fingerprints(self):
+        """按照指纹分组的执行次数"""
+        result = Counter()
+        for sql, count in self.statements.items():
+            result[get_fingerprint(sql)] += count
+        return result
+
+    def get_repeated(self, threshold):
+        """
+        重复执行的指纹，执行次数不小于 threshold 时，认为可能是 N+1 查询
+
+        Returns:
+            list (指纹，执行次数) 组成的列表，按执行次数倒序
+        """
+        if not threshold:
+            return []
+        return [item for item in self.get_fingerprints().most_common() if item[1] >= threshold]
+
+    def summary(self, threshold=None):
+        """查询的汇总信息"""
+        return {
+            'count': self.count,
+            'duration_ms': round(self.duration * 1000, 3),
+            'repeated': [{'sql': sql, 'count': count} for sql, count in self.get_repeated(threshold)],
+        }
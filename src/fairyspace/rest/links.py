@@ -0,0 +1,174 @@
+"""
+多对多关系的批量关联和取消关联
+
+直接在自动创建的中间表上操作，不加载任何模型实例：
+
+- add 通过 bulk_create(ignore_conflicts=True) 插入关系，已经存在的关系忽略
+- remove 每一块数据按照当前模型的主键分组，通过一次过滤删除
+- set 传入的当前数据的关系替换为传入的关系，先删除不在传入列表中的关系，再插入新的关系
+
+传入的数据为 (当前数据的主键，关联数据的主键) 组成的列表，例如学生的 teachers：
+
+[[1, 10], [1, 11], [2, 10]]
+
+当前数据的主键必须在视图允许的结果集中，关联数据的主键必须存在，这两项校验只查询主键
+"""
+
+from django.db import transaction
+from django.db.models import Q
+
+from fairyspace.core import exception
+from fairyspace.rest.batch import get_through_fields, split_chunks
+from fairyspace.rest.count import invalidate_count_cache
+from fairyspace.utils import meta
+
+ModelMetaIndex = meta.ModelMetaIndex
+
+
+def _raise_link_error(error_data):
+    raise exception.FairySpaceException(
+        error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+        error_data=error_data,
+    )
+
+
+def _to_pk(pk_field, value):
+    if value is None or isinstance(value, (bool, dict, list)):
+        raise ValueError
+    return pk_field.to_python(value)
+
+
+class LinkWriter:
+    """
+    多对多关系的批量写入
+
+    Params:
+        queryset 当前模型允许操作的结果集
+        relation str 多对多字段名称，支持反向多对多的 accessor name
+        chunk_size int 每一块的数据条数
+        check_object function 当前数据的对象级权限校验，没有权限时抛出异常，为 None 时不校验
+    """
+
+    def __init__(self, queryset, relation, chunk_size, check_object=None):
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+        self.check_object = check_object
+
+        model = queryset.model
+        if not isinstance(relation, str) or meta.get_model_index(model).get_relation_kind(relation) not in (
+            ModelMetaIndex.FORWARD_M2M,
+            ModelMetaIndex.REVERSE_M2M,
+        ):
+            _raise_link_error(f'字段不是多对多关系：{relation}')
+
+        field = meta.get_field(model, relation)
+        self.through, self.source, self.target = get_through_fields(field)
+        if not self.through._meta.auto_created:
+            _raise_link_error(f'自定义中间表的多对多关系不支持批量关联：{relation}')
+        self.related_model = field.related_model
+        self.manager = self.through._default_manager
+
+    def parse_pairs(self, pairs):
+        """校验传入的关系，返回去重之后的 (当前数据的主键，关联数据的主键) 列表"""
+        if not isinstance(pairs, list) or not pairs:
+            _raise_link_error('关系必须是非空列表')
+
+        source_pk, target_pk = self.queryset.model._meta.pk, self.related_model._meta.pk
+        result = {}
+        for index, pair in enumerate(pairs):
+            try:
+                if not isinstance(pair, (list, tuple)):
+                    raise ValueError
+                source, target = pair
+                result[(_to_pk(source_pk, source), _to_pk(target_pk, target))] = None
+            except Exception:
+                _raise_link_error(f'第 {index} 项关系不合法：{pair}')
+        return list(result)
+
+    def check_ids(self, pairs):
+        """
+        当前数据的主键必须在允许的结果集中，关联数据的主键必须存在，按块只查询主键
+
+        存在对象级权限时，当前数据按块查询对象，和单条操作一样逐条校验
+        """
+        for name, queryset, ids, check_object in (
+            ('当前数据', self.queryset, {source for source, _ in pairs}, self.check_object),
+            ('关联数据', self.related_model._default_manager.all(), {target for _, target in pairs}, None),
+        ):
+            ids = list(ids)
+            existing = set()
+            for chunk in split_chunks(ids, self.chunk_size):
+                if check_object is None:
+                    existing.update(queryset.filter(pk__in=chunk).values_list('pk', flat=True))
+                    continue
+                for instance in queryset.filter(pk__in=chunk):
+                    check_object(instance)
+                    existing.add(instance.pk)
+            missing = [item for item in ids if item not in existing]
+            if missing:
+                _raise_link_error({name: missing[:100]})
+
+    def count(self, sources):
+        total = 0
+        for chunk in split_chunks(list(sources), self.chunk_size):
+            total += self.manager.filter(**{f'{self.source}__in': chunk}).count()
+        return total
+
+    def insert(self, pairs):
+        for chunk in split_chunks(pairs, self.chunk_size):
+            self.manager.bulk_create(
+                [self.through(**{f'{self.source}_id': source, f'{self.target}_id': target}) for source, target in chunk],
+                ignore_conflicts=True,
+            )
+
+    def group(self, pairs):
+        """按照当前数据的主键分组"""
+        groups = {}
+        for source, target in pairs:
+            groups.setdefault(source, []).append(target)
+        return groups
+
+    def delete(self, groups, keep=False):
+        """
+        按块删除关系，每一块通过一次过滤删除
+
+        Params:
+            groups dict {当前数据的主键: 关联数据的主键列表}
+            keep bool 为 True 时删除不在列表中的关系，为 False 时删除列表中的关系
+        """
+        removed = 0
+        for chunk in split_chunks(list(groups.items()), self.chunk_size):
+            query = Q()
+            for source, targets in chunk:
+                condition = Q(**{f'{self.target}__in': targets})
+                query |= Q(**{self.source: source}) & (~condition if keep else condition)
+            removed += self.manager.filter(query).delete()[0]
+        return removed
+
+    def write(self, pairs, mode):
+        """
+        写入关系
+
+        Params:
+            pairs list 传入的关系
+            mode str add、remove 或者 set
+
+        Returns:
+            dict 新增和删除的关系数量
+        """
+        pairs = self.parse_pairs(pairs)
+        self.check_ids(pairs)
+        groups = self.group(pairs)
+
+        with transaction.atomic():
+            if mode == 'remove':
+                result = {'added': 0, 'removed': self.delete(groups)}
+            else:
+                removed = self.delete(groups, keep=True) if mode == 'set' else 0
+                before = self.count(groups)
+                self.insert(pairs)
+                result = {'added': self.count(groups) - before, 'removed': removed}
+
+        for model in (self.queryset.model, self.related_model, self.through):
+            invalidate_count_cache(model)
+        return result
@@ -1,14 +1,38 @@
+import json
 import os
+from functools import partial
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
+from django.db.models import Model
+from django.http import StreamingHttpResponse
+from django.utils.http import content_disposition_header
 from django.apps import apps
 from django.conf import settings
 
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import BasePermission
 from rest_framework import serializers
 
 from fairyspace import const
 from fairyspace.core import exception
-from fairyspace.rest.response import success_response
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.rest.aggregate import compile_aggregate_plan
+from fairyspace.rest.batch import BulkWriter
+from fairyspace.rest.count import invalidate_count_cache
+from fairyspace.rest.export import (
+    EXPORT_FORMAT_CSV,
+    EXPORT_FORMATS,
+    get_export_config,
+    iter_export_content,
+)
+from fairyspace.rest.deletion import delete_queryset, get_delete_job, get_delete_job_owner, start_delete_job
+from fairyspace.rest.increment import IncrementPlan, get_increment_fields
+from fairyspace.rest.imports import BulkImporter, get_import_format, iter_rows
+from fairyspace.rest.links import LinkWriter
+from fairyspace.rest.nested import NestedWriter
+from fairyspace.rest.response import streaming_success_response, success_response
+from fairyspace.rest.stream import iter_chunks
 from fairyspace.rest.user_pip import fairy_pip_user_add_handle
 from fairyspace.utils import meta, data
 from fairyspace.utils.module import fairy_load_statement, fairy_load_view
@@ -21,6 +45,25 @@ class FairyMixin:
         """重置"""
         pass
 
+    def fairy_has_object_permissions(self):
+        """是否存在重写了 has_object_permission 的权限类，没有时批量操作不需要读取对象校验权限"""
+        return any(
+            type(permission).has_object_permission is not BasePermission.has_object_permission
+            for permission in self.get_permissions()
+        )
+
+    def fairy_check_object_permissions_many(self, request, queryset, chunk_size=None):
+        """
+        批量操作的对象级权限校验
+
+        存在重写了 has_object_permission 的权限类时，和单条操作一样逐条校验结果集中的数据，
+        任何一条没有权限都会抛出异常，没有对象级权限时不读取数据
+        """
+        if not self.fairy_has_object_permissions():
+            return
+        for instance in queryset.iterator(chunk_size=chunk_size or fairy_space_settings.BULK_CHUNK_SIZE):
+            self.check_object_permissions(request, instance)
+
     def fairy_get_statements(self):
         """获取配置声明类"""
 
@@ -106,9 +149,19 @@ class FairyMixin:
             },
             data: 数据
         }
+
+        上传文件（multipart）时，命名空间为 JSON 字符串
         """
         # 获取请求端传入的命名空间
         self.fairy_instance.request_namespace = request.data.get(const.FAIRY_CALLER_NAMESPACE, {})
+        if isinstance(self.fairy_instance.request_namespace, str):
+            try:
+                self.fairy_instance.request_namespace = json.loads(self.fairy_instance.request_namespace)
+            except ValueError:
+                raise exception.FairySpaceException(
+                    error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                    error_data='命名空间必须是 JSON 格式',
+                )
         if not isinstance(self.fairy_instance.request_namespace, dict):
             self.fairy_instance.request_namespace = {}
 
@@ -120,15 +173,29 @@ class FairyMixin:
         self.fairy_instance.model_label = self.kwargs.get('model')
         self.fairy_instance.model = apps.get_model(self.fairy_instance.app_label, self.fairy_instance.model_label)
 
+    def fairy_get_export_config(self, request, *args, **kwargs):
+        """导出动作时，根据调用端传入的键获取 Statements 中的导出配置"""
+        if self.action != const.FAIRY_INNER_ACTION_EXPORT_FILE:
+            return
+        key = self.fairy_instance.request_namespace.get(const.FAIRY_CALLER_EXPORT_DATA_KEY)
+        self.fairy_instance.export_config = get_export_config(self.fairy_instance.statement_class, key)
+
+    def fairy_get_nested_fields(self):
+        """允许嵌套写入的字段路径"""
+        return getattr(self.fairy_instance.statement_class, const.FAIRY_STATEMENT_NESTED_FIELDS, None)
+
     def fairy_get_expand_fields(self, request, *args, **kwargs):
         """获取扩展字段
 
-        这里通过客户端传递过来的 display_fields 进行扩展字段的筛选和处理
+        这里通过客户端传递过来的 display_fields 进行扩展字段的筛选和处理，导出配置中声明了
+        fields 时，使用导出配置的字段
         """
         try:
-            self.fairy_instance.display_fields = self.fairy_instance.request_namespace.get(
-                const.FAIRY_CALLER_DISPLAY_FIELD_LIST
-            )
+            export_config = self.fairy_instance.export_config or {}
+            display_fields = export_config.get('fields')
+            if not display_fields:
+                display_fields = self.fairy_instance.request_namespace.get(const.FAIRY_CALLER_DISPLAY_FIELD_LIST)
+            self.fairy_instance.display_fields = display_fields
             self.fairy_instance.expand_fields = data.get_prefetch_fields(self.fairy_instance.display_fields)
 
             self.fairy_translate_expand_fields(self.fairy_instance.expand_fields)
@@ -181,6 +248,11 @@ class FairyRetrieveModelMixin:
 
     def fairy_connate_retrieve(self, request, *args, **kwargs):
         """原生的检索"""
+        values_plan = self.fairy_get_values_plan(detail=True)
+        if values_plan is not None:
+            row = self.fairy_get_values_object(values_plan)
+            return success_response(values_plan.execute(row))
+
         instance = self.get_object()
         serializer = self.get_serializer(instance)
         return success_response(serializer.data)
@@ -201,6 +273,11 @@ class FairyPostRetrieveModelMixin:
 
     def fairy_connate_retrieve_enhance(self, request, *args, **kwargs):
         """原生的检索"""
+        values_plan = self.fairy_get_values_plan(detail=True)
+        if values_plan is not None:
+            row = self.fairy_get_values_object(values_plan)
+            return success_response(values_plan.execute(row))
+
         instance = self.get_object()
         serializer = self.get_serializer(instance)
         return success_response(serializer.data)
@@ -228,11 +305,17 @@ class FairyDestroyModelMixin:
     """
 
     def perform_destroy(self, instance):
+        # 模型重写了 delete 时保持逐条删除
+        if fairy_space_settings.DELETE_FAST and type(instance).delete is Model.delete:
+            queryset = self.fairy_instance.model._base_manager.using(instance._state.db).filter(pk=instance.pk)
+            delete_queryset(queryset, fairy_space_settings.DELETE_CHUNK_SIZE)
+            return
         instance.delete()
 
     def fairy_connate_destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         self.perform_destroy(instance)
+        invalidate_count_cache(self.fairy_instance.model)
         return success_response()
 
     def destroy(self, request, *args, **kwargs):
@@ -245,20 +328,109 @@ class FairyDestroyModelMixin:
         return self.fairy_connate_destroy(request, *args, **kwargs)
 
 
+class FairyDestroyManyModelMixin:
+    """批量删除
+
+    传入的 data 为主键列表，只删除视图允许操作的数据，级联的数据在数据库中按块删除，
+    数据量超过 DELETE_BACKGROUND_THRESHOLD 或者命名空间中 background 为 true 时交给后台任务，
+    后台任务的进度保存在 Django 缓存中，多进程部署时需要配置共享的缓存
+    """
+
+    def fairy_check_destroy_permissions(self, request, queryset):
+        """存在对象级权限时，和单条删除一样逐条校验，全部通过之后才删除"""
+        self.fairy_check_object_permissions_many(request, queryset, fairy_space_settings.DELETE_CHUNK_SIZE)
+
+    def fairy_connate_destroy_many(self, request, *args, **kwargs):
+        ids = request.data.get('data')
+        if not isinstance(ids, list) or not ids:
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                error_data='批量删除的数据必须是主键组成的非空列表',
+            )
+        queryset = self.filter_queryset(self.fairy_instance.model.objects.all()).filter(pk__in=ids)
+        self.fairy_check_destroy_permissions(request, queryset)
+        chunk_size = fairy_space_settings.DELETE_CHUNK_SIZE
+
+        background = self.fairy_instance.request_namespace.get(const.FAIRY_CALLER_BACKGROUND)
+        threshold = fairy_space_settings.DELETE_BACKGROUND_THRESHOLD
+        if background or (threshold is not None and len(ids) > threshold):
+            owner = get_delete_job_owner(self.fairy_instance.model, request.user)
+            return success_response(start_delete_job(queryset, chunk_size, owner))
+        return success_response(delete_queryset(queryset, chunk_size))
+
+    @action(methods=['post'], detail=False, url_path='destroy_many')
+    def destroy_many(self, request, *args, **kwargs):
+        reset_handler = self.fairy_instance.custom_action_handler
+        if reset_handler:
+            return reset_handler(self, request, *args, **kwargs)
+        return self.fairy_connate_destroy_many(request, *args, **kwargs)
+
+    @action(methods=['post'], detail=False, url_path='destroy_many/status')
+    def destroy_many_status(self, request, *args, **kwargs):
+        """查询后台删除任务的进度，命名空间中的 job 为任务 id，只能查询当前用户通过当前模型发起的任务"""
+        job = get_delete_job(
+            self.fairy_instance.request_namespace.get(const.FAIRY_CALLER_JOB),
+            get_delete_job_owner(self.fairy_instance.model, request.user),
+        )
+        if job is None:
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                error_data='删除任务不存在或者已经过期',
+            )
+        return success_response(job)
+
+
 class _BaseListMixin:
     """列表查询基类"""
 
     def _list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
 
+        # 展示字段都是真实的列时，直接通过 values_list 查询，不构建模型实例
+        values_plan = self.fairy_get_values_plan()
+        if values_plan is not None:
+            queryset = values_plan.apply(queryset)
+
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            response = self.get_paginated_response(serializer.data)
+            response = self.get_paginated_response(self.fairy_serialize(page, values_plan))
             return success_response(response.data)
 
-        serializer = self.get_serializer(queryset, many=True)
-        return success_response(serializer.data)
+        if self.fairy_instance.request_namespace.get(const.FAIRY_CALLER_STREAM):
+            return self._stream_list(queryset, values_plan)
+
+        return success_response(self.fairy_serialize(self._limit_rows(queryset), values_plan))
+
+    def _stream_list(self, queryset, values_plan=None):
+        """流式返回列表数据，按块读取和序列化，内存占用和数据总量无关"""
+        chunk_size = fairy_space_settings.STREAM_CHUNK_SIZE
+
+        if values_plan is not None:
+            serialize = values_plan.execute_many
+        else:
+            # 同一个序列化对象可以重复使用，执行计划只会编译一次
+            serialize = self.get_serializer(many=True).to_representation
+
+        chunks = (serialize(chunk) for chunk in iter_chunks(queryset, chunk_size))
+        return streaming_success_response(chunks)
+
+    def _limit_rows(self, queryset):
+        """
+        不分页时的数据条数上限检查，超过上限时报错，而不是把全部数据加载到内存中
+        """
+        max_rows = getattr(self.fairy_instance.statement_class, const.FAIRY_STATEMENT_LIST_MAX_ROWS, None)
+        if max_rows is None:
+            max_rows = fairy_space_settings.LIST_MAX_ROWS
+        if not max_rows:
+            return queryset
+
+        rows = list(queryset[: max_rows + 1])
+        if len(rows) > max_rows:
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_PARAMETER_BUSINESS_ERROR,
+                error_data=f'数据超过 {max_rows} 条，请使用分页或者流式查询',
+            )
+        return rows
 
 
 class FairyListModelMixin(_BaseListMixin):
@@ -299,6 +471,77 @@ class FairyPostListModelMixin(_BaseListMixin):
         return self._list(request, *args, **kwargs)
 
 
+class FairyAggregateModelMixin(_BaseListMixin):
+    """分组统计"""
+
+    def fairy_connate_aggregate(self, request, *args, **kwargs):
+        namespace = self.fairy_instance.request_namespace
+        plan = compile_aggregate_plan(
+            self.fairy_instance.model,
+            group_by=namespace.get(const.FAIRY_CALLER_GROUP_BY),
+            metrics=namespace.get(const.FAIRY_CALLER_METRICS),
+            ordering=namespace.get(const.FAIRY_CALLER_ORDERING),
+            allowed_fields=getattr(self.fairy_instance.statement_class, const.FAIRY_STATEMENT_AGGREGATE_FIELDS, None),
+        )
+        # 分组统计不需要展开字段和裁剪列，不使用 get_queryset
+        queryset = self.filter_queryset(self.fairy_instance.model.objects.all())
+        return success_response(plan.to_representation(self._limit_rows(plan.apply(queryset))))
+
+    @action(methods=['post'], detail=False, url_path='aggregate')
+    def aggregate(self, request, *args, **kwargs):
+        """
+        根据命名空间中的 group_by 和 metrics 分组统计，过滤条件和列表一致
+
+        请求方法为：POST
+        """
+        reset_handler = self.fairy_instance.custom_action_handler
+        if reset_handler:
+            return reset_handler(self, request, *args, **kwargs)
+        return self.fairy_connate_aggregate(request, *args, **kwargs)
+
+
+class FairyExportModelMixin:
+    """流式导出数据"""
+
+    def fairy_connate_export(self, request, *args, **kwargs):
+        export_config = self.fairy_instance.export_config or {}
+        export_format = (
+            self.fairy_instance.request_namespace.get(const.FAIRY_CALLER_EXPORT_FORMAT)
+            or export_config.get('format')
+            or EXPORT_FORMAT_CSV
+        )
+        if export_format not in EXPORT_FORMATS:
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                error_data=f'导出格式不支持：{export_format}',
+            )
+
+        content = iter_export_content(
+            self.filter_queryset(self.get_queryset()),
+            self.get_serializer(many=True),
+            export_format,
+            headers=export_config.get('headers'),
+            values_plan=self.fairy_get_values_plan(),
+        )
+        content_type, extension = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(content, content_type=content_type)
+        filename = export_config.get('filename') or self.fairy_instance.model._meta.model_name
+        response['Content-Disposition'] = content_disposition_header(True, f'{filename}.{extension}')
+        return response
+
+    @action(methods=['post'], detail=False, url_path='export')
+    def export(self, request, *args, **kwargs):
+        """
+        导出数据，过滤条件和列表一致，调用端通过 export 指定使用的导出配置，通过 format 指定导出格式
+
+        请求方法为：POST
+        """
+        reset_handler = self.fairy_instance.custom_action_handler
+        if reset_handler:
+            return reset_handler(self, request, *args, **kwargs)
+        return self.fairy_connate_export(request, *args, **kwargs)
+
+
 class FairyCreateModelMixin:
     """客户端的创建类"""
 
@@ -310,10 +553,15 @@ class FairyCreateModelMixin:
         with transaction.atomic():
             # 处理正向的关系数据
             fairy_pip_user_add_handle(self, data)
+            # 嵌套的关联数据，正向的关系先写入，反向和多对多的关系在当前数据写入之后写入
+            nested_writer = NestedWriter(self, self.fairy_get_nested_fields())
+            nested = nested_writer.prepare(self.fairy_instance.model, data)
             serializer = self.get_validate_form(self.action)(data=data)
             serializer.is_valid(raise_exception=True)
 
             instance = self.perform_create(serializer)
+            nested_writer.write_nested(instance, nested)
+            invalidate_count_cache(self.fairy_instance.model)
             serializer = self.get_serializer(instance)
             return success_response(serializer.data)
 
@@ -336,9 +584,14 @@ class _BaseUpdateMixin:
 
         with transaction.atomic():
             fairy_pip_user_add_handle(self, data)
+            nested_writer = NestedWriter(self, self.fairy_get_nested_fields())
+            nested = nested_writer.prepare(self.fairy_instance.model, data)
             serializer = self.get_validate_form(self.action)(instance, data=data, partial=partial)
             serializer.is_valid(raise_exception=True)
             instance = self.perform_update(serializer)
+            # 更新时多对多的嵌套数据替换原来的关系
+            nested_writer.write_nested(instance, nested, clear=True)
+            invalidate_count_cache(self.fairy_instance.model)
             serializer = self.get_serializer(instance)
             return success_response(serializer.data)
 
@@ -375,6 +628,199 @@ class FairyPutPartialUpdateModelMixin(_BaseUpdateMixin):
         return self._update(request, True, *args, **kwargs)
 
 
+class FairyBulkModelMixin:
+    """批量创建、批量更新和批量冲突更新
+
+    传入的 data 为列表，批量更新时每一条数据必须包含主键，冲突更新时命名空间中必须指定 unique_fields
+    """
+
+    def _get_bulk_items(self, request):
+        items = request.data.get('data')
+        if not isinstance(items, list) or not items:
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                error_data='批量写入的数据必须是非空列表',
+            )
+        return items
+
+    def fairy_connate_bulk_create(self, request, *args, **kwargs):
+        # 复用创建动作的表单
+        writer = BulkWriter(self, self.get_validate_form(const.FAIRY_INNER_ACTION_CREATE))
+        return success_response(writer.create(self._get_bulk_items(request)))
+
+    def fairy_connate_bulk_update(self, request, *args, **kwargs):
+        # 复用部分更新动作的表单，只更新传入的字段
+        writer = BulkWriter(self, self.get_validate_form(const.FAIRY_INNER_ACTION_PARTIAL_UPDATE), partial=True)
+        queryset = self.filter_queryset(self.fairy_instance.model.objects.all())
+        return success_response(writer.update(self._get_bulk_items(request), queryset))
+
+    def fairy_connate_upsert(self, request, *args, **kwargs):
+        unique_fields = self.fairy_instance.request_namespace.get(const.FAIRY_CALLER_UNIQUE_FIELDS)
+        if not unique_fields:
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                error_data='冲突更新必须指定唯一键',
+            )
+        # 复用创建动作的表单，唯一键已经存在的数据只更新传入的字段，和批量更新一样只能更新结果集中的数据
+        writer = BulkWriter(
+            self,
+            self.get_validate_form(const.FAIRY_INNER_ACTION_CREATE),
+            unique_fields=unique_fields,
+            queryset=self.filter_queryset(self.fairy_instance.model.objects.all()),
+        )
+        return success_response(writer.create(self._get_bulk_items(request)))
+
+    @action(methods=['post'], detail=False, url_path='bulk/create')
+    def bulk_create(self, request, *args, **kwargs):
+        reset_handler = self.fairy_instance.custom_action_handler
+        if reset_handler:
+            return reset_handler(self, request, *args, **kwargs)
+        return self.fairy_connate_bulk_create(request, *args, **kwargs)
+
+    @action(methods=['post'], detail=False, url_path='bulk/update')
+    def bulk_update(self, request, *args, **kwargs):
+        reset_handler = self.fairy_instance.custom_action_handler
+        if reset_handler:
+            return reset_handler(self, request, *args, **kwargs)
+        return self.fairy_connate_bulk_update(request, *args, **kwargs)
+
+    @action(methods=['post'], detail=False, url_path='upsert')
+    def upsert(self, request, *args, **kwargs):
+        reset_handler = self.fairy_instance.custom_action_handler
+        if reset_handler:
+            return reset_handler(self, request, *args, **kwargs)
+        return self.fairy_connate_upsert(request, *args, **kwargs)
+
+
+class FairyImportModelMixin:
+    """从上传的 CSV 或者 NDJSON 文件导入数据
+
+    上传的文件字段为 file，命名空间中可以指定 format 和 unique_fields，
+    指定 unique_fields 时唯一键已经存在的数据更新为文件中的值
+    """
+
+    def fairy_connate_import(self, request, *args, **kwargs):
+        file = request.FILES.get('file')
+        if not file:
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                error_data='上传的文件不能为空',
+            )
+
+        namespace = self.fairy_instance.request_namespace
+        import_format = get_import_format(file, namespace.get(const.FAIRY_CALLER_IMPORT_FORMAT))
+        # 复用创建动作的表单，指定唯一键时和冲突更新一样只能更新结果集中的数据
+        writer = BulkWriter(
+            self,
+            self.get_validate_form(const.FAIRY_INNER_ACTION_CREATE),
+            unique_fields=namespace.get(const.FAIRY_CALLER_UNIQUE_FIELDS),
+            queryset=self.filter_queryset(self.fairy_instance.model.objects.all()),
+        )
+        return success_response(BulkImporter(writer).run(iter_rows(file, import_format)))
+
+    @action(methods=['post'], detail=False, url_path='import', parser_classes=[MultiPartParser])
+    def import_data(self, request, *args, **kwargs):
+        reset_handler = self.fairy_instance.custom_action_handler
+        if reset_handler:
+            return reset_handler(self, request, *args, **kwargs)
+        return self.fairy_connate_import(request, *args, **kwargs)
+
+
+class FairyIncrementModelMixin:
+    """原子增减
+
+    传入的 data 为 {字段: 增量}，批量增减时为 {主键字段: 主键, 字段: 增量} 组成的列表，
+    只允许 Statements 中 increment_fields 声明的字段，返回增减之后的新值
+    """
+
+    def _get_increment_plan(self):
+        model = self.fairy_instance.model
+        return IncrementPlan(model, get_increment_fields(model, self.fairy_instance.statement_class))
+
+    def fairy_connate_increment(self, request, *args, **kwargs):
+        plan = self._get_increment_plan()
+        deltas = plan.parse(request.data.get('data'))
+
+        # 存在对象级权限时需要先获取对象校验权限，否则直接按照主键更新，不读取数据
+        if self.fairy_has_object_permissions():
+            pk = self.get_object().pk
+        else:
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            try:
+                pk = self.fairy_instance.model._meta.pk.to_python(self.kwargs[lookup_url_kwarg])
+            except DjangoValidationError:
+                raise exception.FairySpaceException(error_code=exception.FAIRY_OBJECT_NOT_FOUND)
+
+        queryset = self.filter_queryset(self.fairy_instance.model.objects.all())
+        result = plan.execute(queryset, {pk: deltas})
+        if not result:
+            raise exception.FairySpaceException(error_code=exception.FAIRY_OBJECT_NOT_FOUND)
+        return success_response(result[0])
+
+    def fairy_connate_increment_many(self, request, *args, **kwargs):
+        plan = self._get_increment_plan()
+        deltas = plan.parse_many(request.data.get('data'))
+        queryset = self.filter_queryset(self.fairy_instance.model.objects.all())
+        # 和单条增减一样校验对象级权限，全部通过之后才增减
+        self.fairy_check_object_permissions_many(request, queryset.filter(pk__in=list(deltas)))
+        return success_response(plan.execute(queryset, deltas))
+
+    @action(methods=['post'], detail=True, url_path='increment')
+    def increment(self, request, *args, **kwargs):
+        reset_handler = self.fairy_instance.custom_action_handler
+        if reset_handler:
+            return reset_handler(self, request, *args, **kwargs)
+        return self.fairy_connate_increment(request, *args, **kwargs)
+
+    @action(methods=['post'], detail=False, url_path='increment')
+    def increment_many(self, request, *args, **kwargs):
+        reset_handler = self.fairy_instance.custom_action_handler
+        if reset_handler:
+            return reset_handler(self, request, *args, **kwargs)
+        return self.fairy_connate_increment_many(request, *args, **kwargs)
+
+
+class FairyManyToManyLinkMixin:
+    """多对多关系的批量关联、取消关联和替换
+
+    命名空间中的 relation 为多对多字段名称，传入的 data 为 (当前数据的主键，关联数据的主键) 组成的列表
+    """
+
+    def fairy_connate_m2m(self, request, mode):
+        statement_class = self.fairy_instance.statement_class
+        chunk_size = getattr(statement_class, const.FAIRY_STATEMENT_BULK_CHUNK_SIZE, None)
+        # 和单条更新一样校验当前数据的对象级权限
+        check_object = partial(self.check_object_permissions, request) if self.fairy_has_object_permissions() else None
+        writer = LinkWriter(
+            self.filter_queryset(self.fairy_instance.model.objects.all()),
+            self.fairy_instance.request_namespace.get(const.FAIRY_CALLER_RELATION),
+            chunk_size or fairy_space_settings.BULK_CHUNK_SIZE,
+            check_object=check_object,
+        )
+        return success_response(writer.write(request.data.get('data'), mode))
+
+    @action(methods=['post'], detail=False, url_path='m2m/add')
+    def m2m_add(self, request, *args, **kwargs):
+        reset_handler = self.fairy_instance.custom_action_handler
+        if reset_handler:
+            return reset_handler(self, request, *args, **kwargs)
+        return self.fairy_connate_m2m(request, 'add')
+
+    @action(methods=['post'], detail=False, url_path='m2m/remove')
+    def m2m_remove(self, request, *args, **kwargs):
+        reset_handler = self.fairy_instance.custom_action_handler
+        if reset_handler:
+            return reset_handler(self, request, *args, **kwargs)
+        return self.fairy_connate_m2m(request, 'remove')
+
+    @action(methods=['post'], detail=False, url_path='m2m/set')
+    def m2m_set(self, request, *args, **kwargs):
+        reset_handler = self.fairy_instance.custom_action_handler
+        if reset_handler:
+            return reset_handler(self, request, *args, **kwargs)
+        return self.fairy_connate_m2m(request, 'set')
+
+
 class FairyCloudFuncMixin:
     """云函数"""
 
@@ -0,0 +1,343 @@
+"""
+嵌套写入
+
+创建和更新时，data 中的关系字段可以直接传入关联的数据，在同一个请求、同一个事务中写入：
+
+{
+    'name': '张三',
+    'classroom': {'name': '一班', 'school': 1},
+    'card': {'card_number': 'N01', 'issued_date': '2024-09-01'},
+    'teachers': [1, {'name': '李老师', 'school': 1, 'subject': 'math', 'hire_date': '2024-01-01'}],
+}
+
+- 正向外键和正向一对一传入字典时，先写入关联的数据，再把主键回填到 data 中
+- 反向一对一传入字典，反向外键传入字典组成的列表，在当前数据写入之后写入，外键自动指向当前数据
+- 多对多（包括反向多对多）传入主键或者字典组成的列表，字典先写入，然后通过中间表一次批量插入关系，
+  更新时替换原来的关系
+- 同一层同一个字段的关联数据通过一次 bulk_create 写入，关联数据中可以继续嵌套
+- 关联数据使用关联模型默认的表单校验，嵌套的字典总是创建新的数据，错误信息按照嵌套的结构返回，
+  列表形式的关系（反向外键和多对多）的错误信息为和传入的列表一一对应的列表
+- 更新时多对多替换原来的关系，反向外键只追加新的关联数据，不会删除原来的关联数据
+
+只有 Statements 中 nested_fields 声明的字段路径允许嵌套写入，没有声明时不允许嵌套写入。关联数据
+不经过关联模型接口的权限、自定义表单和用户字段处理，声明之前需要确认调用端可以直接创建这些数据
+
+注意：关联数据通过 bulk_create 写入，不会调用模型的 save，也不会触发模型信号
+"""
+
+from django.db import DatabaseError, connections, router
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+
+from fairyspace.core import exception
+from fairyspace.rest.batch import get_through_fields, set_many_to_many
+from fairyspace.rest.count import invalidate_count_cache
+from fairyspace.rest.form import create_form_class
+from fairyspace.rest.validation import BatchValidation
+from fairyspace.utils import meta
+
+ModelMetaIndex = meta.ModelMetaIndex
+
+# 写入之前处理的正向关系
+FORWARD_KINDS = (ModelMetaIndex.FORWARD_FK, ModelMetaIndex.FORWARD_O2O)
+# 写入之后处理的反向关系
+REVERSE_KINDS = (ModelMetaIndex.REVERSE_FK, ModelMetaIndex.REVERSE_O2O)
+# 多对多关系
+MANY_TO_MANY_KINDS = (ModelMetaIndex.FORWARD_M2M, ModelMetaIndex.REVERSE_M2M)
+
+
+def split_nested(model, data, allowed_fields=(), prefix=''):
+    """
+    拆分出 data 中嵌套的关联数据，只有传入字典（多对多为包含字典的列表，反向多对多为列表）时才作为嵌套数据
+
+    Params:
+        model 模型类
+        data dict 写入的数据
+        allowed_fields list 允许嵌套写入的字段路径
+        prefix str 当前数据在嵌套结构中的路径前缀
+
+    Returns:
+        dict {字段名称: (关系类型，字段，传入的值)}，拆分出来的字段会从 data 中移除
+    """
+    index = meta.get_model_index(model)
+    nested = {}
+    for name, value in list(data.items()):
+        kind = index.get_relation_kind(name)
+        if kind is None:
+            continue
+        if kind in (*FORWARD_KINDS, ModelMetaIndex.REVERSE_O2O):
+            is_nested = isinstance(value, dict)
+        elif kind in (ModelMetaIndex.REVERSE_FK, ModelMetaIndex.REVERSE_M2M):
+            # 反向关系不在表单中，列表总是作为嵌套数据处理
+            is_nested = isinstance(value, list)
+        else:
+            is_nested = isinstance(value, list) and any(isinstance(item, dict) for item in value)
+        if is_nested:
+            if f'{prefix}{name}' not in allowed_fields:
+                raise exception.FairySpaceException(
+                    error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                    error_data=f'字段不允许嵌套写入：{prefix}{name}',
+                )
+            nested[name] = (kind, index.get_field(name), data.pop(name))
+    return nested
+
+
+def _to_pk(pk_field, value):
+    """把传入的主键转换成可以比较的值，不合法时返回 None"""
+    if value is None or isinstance(value, (bool, list)):
+        return
+    try:
+        return pk_field.to_python(value)
+    except Exception:
+        return
+
+
+class NestedWriter:
+    """
+    嵌套写入
+
+    每个关联模型只构建一次表单，唯一性和外键的校验按批查询
+
+    Params:
+        view 当前视图
+        allowed_fields list 允许嵌套写入的字段路径，例如 ['students', 'students.card']
+    """
+
+    def __init__(self, view, allowed_fields=()):
+        self.view = view
+        self.allowed_fields = allowed_fields or ()
+        self.forms = {}
+
+    def get_form(self, model):
+        if model not in self.forms:
+            form = create_form_class(model, 'create')(context=self.view.get_serializer_context())
+            self.forms[model] = (form, BatchValidation(form))
+        return self.forms[model]
+
+    def bulk_create(self, model, objs):
+        """批量写入，数据库不支持返回多行主键时（例如 MySQL）逐条插入，后续的关联数据需要主键"""
+        connection = connections[router.db_for_write(model)]
+        try:
+            if len(objs) > 1 and not connection.features.can_return_rows_from_bulk_insert:
+                for obj in objs:
+                    obj.save(force_insert=True)
+            else:
+                model._default_manager.bulk_create(objs)
+        except DatabaseError as e:
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_PARAMETER_BUSINESS_ERROR,
+                error_data=str(e),
+            )
+        invalidate_count_cache(model)
+
+    def write_forward(self, items, nested_list, prefix=''):
+        """
+        写入正向外键和正向一对一的关联数据，并把主键回填到对应的数据中
+
+        Returns:
+            list 和 items 一一对应的错误信息
+        """
+        errors = [{} for _ in items]
+        names = {name for nested in nested_list for name, (kind, _, _) in nested.items() if kind in FORWARD_KINDS}
+        for name in names:
+            owners = [(position, nested[name]) for position, nested in enumerate(nested_list) if name in nested]
+            field = owners[0][1][1]
+            try:
+                objs = self.write_many(field.related_model, [value for _, (_, _, value) in owners], f'{prefix}{name}.')
+            except serializers.ValidationError as e:
+                for (position, _), detail in zip(owners, e.detail):
+                    if detail:
+                        errors[position][name] = detail
+                continue
+            for (position, _), obj in zip(owners, objs):
+                items[position][name] = obj.pk
+        return errors
+
+    def write_reverse(self, objs, nested_list, prefix=''):
+        """
+        写入反向外键和反向一对一的关联数据，外键指向已经写入的数据
+
+        Returns:
+            list 和 objs 一一对应的错误信息
+        """
+        errors = [{} for _ in objs]
+        names = {name for nested in nested_list for name, (kind, _, _) in nested.items() if kind in REVERSE_KINDS}
+        for name in names:
+            owners, children = [], []
+            for position, (obj, nested) in enumerate(zip(objs, nested_list)):
+                if name not in nested:
+                    continue
+                kind, field, value = nested[name]
+                values = [value] if kind == ModelMetaIndex.REVERSE_O2O else value
+                for child_index, child in enumerate(values):
+                    if isinstance(child, dict):
+                        child = {**child, field.field.name: obj.pk}
+                    owners.append((position, kind, child_index))
+                    children.append(child)
+            if not children:
+                continue
+
+            try:
+                self.write_many(field.related_model, children, f'{prefix}{name}.')
+            except serializers.ValidationError as e:
+                for (position, kind, child_index), detail in zip(owners, e.detail):
+                    if kind == ModelMetaIndex.REVERSE_O2O:
+                        if detail:
+                            errors[position][name] = detail
+                        continue
+                    size = len(nested_list[position][name][2])
+                    errors[position].setdefault(name, [{} for _ in range(size)])[child_index] = detail
+        return errors
+
+    def write_many_to_many(self, model, objs, nested_list, clear=False, prefix=''):
+        """
+        写入多对多的关联数据，字典先写入关联模型，主键校验是否存在，然后批量插入中间表
+
+        Returns:
+            list 和 objs 一一对应的错误信息
+        """
+        errors = [{} for _ in objs]
+        names = {name for nested in nested_list for name, (kind, _, _) in nested.items() if kind in MANY_TO_MANY_KINDS}
+        for name in names:
+            field = next(nested[name][1] for nested in nested_list if name in nested)
+            through = get_through_fields(field)[0]
+            if not through._meta.auto_created:
+                raise exception.FairySpaceException(
+                    error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                    error_data=f'自定义中间表的多对多关系不支持嵌套写入：{name}',
+                )
+
+            related_model = field.related_model
+            pk_field = related_model._meta.pk
+            owners, children, keys = [], [], []
+            for position, nested in enumerate(nested_list):
+                if name not in nested:
+                    continue
+                for child_index, child in enumerate(nested[name][2]):
+                    if isinstance(child, dict):
+                        owners.append((position, child_index))
+                        children.append(child)
+                    else:
+                        keys.append((position, child_index, child, _to_pk(pk_field, child)))
+
+            # 传入的主键一次查询校验是否存在，错误信息和 PrimaryKeyRelatedField 一致
+            messages = PrimaryKeyRelatedField.default_error_messages
+            ids = {key for _, _, _, key in keys if key is not None}
+            existing = set(related_model._default_manager.filter(pk__in=ids).values_list('pk', flat=True)) if ids else set()
+
+            def set_error(position, child_index, detail):
+                # 和反向外键一致，错误信息为和传入的列表一一对应的列表
+                size = len(nested_list[position][name][2])
+                errors[position].setdefault(name, [{} for _ in range(size)])[child_index] = detail
+
+            for position, child_index, child, key in keys:
+                if key is None:
+                    message = messages['incorrect_type'].format(data_type=type(child).__name__)
+                elif key not in existing:
+                    message = messages['does_not_exist'].format(pk_value=child)
+                else:
+                    continue
+                set_error(position, child_index, [message])
+
+            created = {}
+            if children:
+                try:
+                    for owner, obj in zip(owners, self.write_many(related_model, children, f'{prefix}{name}.')):
+                        created[owner] = obj.pk
+                except serializers.ValidationError as e:
+                    for (position, child_index), detail in zip(owners, e.detail):
+                        if detail:
+                            set_error(position, child_index, detail)
+
+            if any(errors):
+                continue
+            values = [
+                {name: [created.get((position, child_index), child) for child_index, child in enumerate(nested[name][2])]}
+                if name in nested
+                else {}
+                for position, nested in enumerate(nested_list)
+            ]
+            set_many_to_many(model, objs, values, clear=clear)
+        return errors
+
+    def write_many(self, model, items, prefix=''):
+        """
+        写入同一个模型的一组数据，先写入正向的关联数据，再写入数据本身，最后写入反向和多对多的关联数据
+
+        Params:
+            model 模型类
+            items list 写入的数据
+            prefix str 这一组数据在嵌套结构中的路径前缀，例如 students.
+
+        Raises:
+            serializers.ValidationError 错误信息为和 items 一一对应的列表
+        """
+        if not all(isinstance(item, dict) for item in items):
+            raise serializers.ValidationError(
+                [{} if isinstance(item, dict) else {'non_field_errors': ['数据格式不合法']} for item in items]
+            )
+        items = [dict(item) for item in items]
+        nested_list = [split_nested(model, item, self.allowed_fields, prefix) for item in items]
+
+        errors = self.write_forward(items, nested_list, prefix)
+        form, batch_validation = self.get_form(model)
+        batch_validation.prepare(items)
+        objs, many_to_many = [], []
+        many_to_many_names = {field.name for field in model._meta.many_to_many}
+        for position, item in enumerate(items):
+            try:
+                validated_data = form.run_validation(item)
+            except serializers.ValidationError as e:
+                errors[position] = {**e.detail, **errors[position]}
+                continue
+            many_to_many.append({name: validated_data.pop(name) for name in list(validated_data) if name in many_to_many_names})
+            objs.append(model(**validated_data))
+        self.raise_errors(errors)
+
+        self.bulk_create(model, objs)
+        set_many_to_many(model, objs, many_to_many, clear=False)
+        self.write_related(objs, nested_list, prefix=prefix)
+        return objs
+
+    def write_related(self, objs, nested_list, clear=False, prefix=''):
+        """写入已经写入的数据的反向和多对多关联数据"""
+        if not any(nested_list):
+            return
+        model = type(objs[0])
+        errors = self.write_reverse(objs, nested_list, prefix)
+        for position, item in enumerate(self.write_many_to_many(model, objs, nested_list, clear, prefix)):
+            errors[position].update(item)
+        self.raise_errors(errors)
+
+    def raise_errors(self, errors):
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+    def prepare(self, model, data):
+        """
+        创建和更新之前拆分出嵌套的关联数据，并写入正向的关联数据
+
+        Returns:
+            dict 拆分出来的嵌套数据，data 写入之后传给 write_nested
+        """
+        if not isinstance(data, dict):
+            return {}
+        nested = split_nested(model, data, self.allowed_fields)
+        if nested:
+            errors = self.write_forward([data], [nested])[0]
+            if errors:
+                raise serializers.ValidationError(errors)
+        return nested
+
+    def write_nested(self, instance, nested, clear=False):
+        """
+        当前数据写入之后，写入反向和多对多的关联数据
+
+        更新时 clear 为 True，替换原来的多对多关系，反向外键的关联数据只追加，不删除原来的数据
+        """
+        if not nested:
+            return
+        try:
+            self.write_related([instance], [nested], clear)
+        except serializers.ValidationError as e:
+            raise serializers.ValidationError(e.detail[0])
@@ -1,7 +1,76 @@
+import base64
+import datetime
+import json
+from collections import OrderedDict
+from functools import cached_property, partial
+
+from django.core.paginator import Paginator as DjangoPaginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import (
     _positive_int,
+    BasePagination,
     PageNumberPagination as OriginPageNumberPagination,
 )
+from rest_framework.response import Response
+
+from fairyspace import const
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.core import exception
+from fairyspace.rest.count import (
+    COUNT_STRATEGIES,
+    COUNT_STRATEGY_EXACT,
+    COUNT_STRATEGY_NONE,
+    count_queryset,
+)
+from fairyspace.utils import meta
+
+
+class CountPaginator(DjangoPaginator):
+    """按照指定的策略计算总数的分页器"""
+
+    def __init__(self, object_list, per_page, count_strategy=COUNT_STRATEGY_EXACT, count_timeout=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        # 估算的数量太小时会回退到精确计数，这里记录的是实际使用的策略
+        self.count_strategy = count_strategy
+        self.count_timeout = count_timeout
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            self.count_strategy = COUNT_STRATEGY_EXACT
+            return len(self.object_list)
+        count, self.count_strategy = count_queryset(self.object_list, self.count_strategy, self.count_timeout)
+        return count
+
+
+class NoCountPage:
+    """不计算总数时的分页数据，通过多查询一条数据判断是否有下一页"""
+
+    def __init__(self, object_list, number, has_next):
+        self.object_list = object_list
+        self.number = number
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self.number > 1
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
 
 
 class PageNumberPagination(OriginPageNumberPagination):
@@ -27,3 +96,267 @@ class PageNumberPagination(OriginPageNumberPagination):
             except (KeyError, ValueError):
                 return
         return self.page_size
+
+    def get_count_strategy(self, view):
+        """获取总数的计算策略和缓存时间，优先使用 Statements 中的声明"""
+        statement_class = getattr(getattr(view, 'fairy_instance', None), 'statement_class', None)
+        strategy = getattr(statement_class, const.FAIRY_STATEMENT_COUNT_STRATEGY, None)
+        if strategy is None:
+            strategy = fairy_space_settings.COUNT_STRATEGY
+        if strategy not in COUNT_STRATEGIES:
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                error_data=f'count_strategy: {strategy} 不合法',
+            )
+        return strategy, getattr(statement_class, const.FAIRY_STATEMENT_COUNT_CACHE_TTL, None)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_strategy, count_timeout = self.get_count_strategy(view)
+        if self.count_strategy != COUNT_STRATEGY_NONE:
+            self.django_paginator_class = partial(
+                CountPaginator,
+                count_strategy=self.count_strategy,
+                count_timeout=count_timeout,
+            )
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        page_number = request.query_params.get(self.page_query_param) or 1
+        try:
+            page_number = _positive_int(page_number, strict=True)
+        except ValueError:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message='页码不合法'))
+
+        # 多查询一条数据，用来判断是否有下一页
+        offset = (page_number - 1) * page_size
+        rows = list(queryset[offset : offset + page_size + 1])
+        self.page = NoCountPage(rows[:page_size], page_number, len(rows) > page_size)
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        """在默认的分页数据结构中添加 count_strategy，代表总数是通过哪种策略计算出来的"""
+        if isinstance(self.page, NoCountPage):
+            count, count_strategy = None, COUNT_STRATEGY_NONE
+        else:
+            count = self.page.paginator.count
+            count_strategy = getattr(self.page.paginator, 'count_strategy', COUNT_STRATEGY_EXACT)
+
+        return Response(
+            {
+                'count': count,
+                'count_strategy': count_strategy,
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link(),
+                'results': data,
+            }
+        )
+
+
+class KeysetPagination(BasePagination):
+    """
+    游标（键集）分页
+
+    按照排序字段的值定位下一页，而不是使用 OFFSET，不需要 COUNT 查询，翻到多深的页面
+    耗时都是一样的
+
+    - 排序字段必须是建立了索引的、不能为空的真实列，排序的最后总会补充主键作为唯一的决胜字段
+    - 游标是不透明的字符串，由上一页返回，调用端原样传回即可
+
+    返回的数据结构：
+
+    {
+        'next': 下一页的游标，没有下一页时为 None,
+        'results': [...]
+    }
+
+    调用端通过 ?cursor=xxx&size=20 翻页，排序字段的优先级：
+
+    - 命名空间中的 ordering
+    - Statements 中的 keyset_ordering
+    - 主键
+    """
+
+    max_page_size = 1000
+    page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'size'
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, queryset, view):
+        """获取排序字段，并校验排序字段是否合法，返回 (字段，是否倒序) 组成的元组"""
+        fairy_instance = view.fairy_instance
+        ordering = fairy_instance.request_namespace.get(const.FAIRY_CALLER_ORDERING)
+        if not ordering:
+            ordering = getattr(fairy_instance.statement_class, const.FAIRY_STATEMENT_KEYSET_ORDERING, None)
+        return get_keyset_ordering(queryset.model, ordering or ())
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset, view)
+
+        # 外键按照 attname 排序，和游标条件比较的列一致，不使用关联模型 Meta.ordering 的排序
+        queryset = queryset.order_by(*[f'-{field.attname}' if desc else field.attname for field, desc in self.ordering])
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(get_keyset_condition(self.ordering, decode_cursor(cursor, self.ordering)))
+
+        # values_list 的结果集，在末尾补充排序字段，用来生成下一页的游标，执行计划只会读取前面的列
+        fields = getattr(queryset, '_fields', None)
+        if fields is not None:
+            queryset = queryset.values_list(*fields, *[field.attname for field, _ in self.ordering])
+
+        rows = list(queryset[: self.page_size + 1])
+        has_next = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+
+        self.next_cursor = None
+        if has_next and rows:
+            last = rows[-1]
+            if fields is not None:
+                values = list(last[len(fields) :])
+            else:
+                values = [getattr(last, field.attname) for field, _ in self.ordering]
+            self.next_cursor = encode_cursor(self.ordering, values)
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([('next', self.next_cursor), ('results', data)]))
+
+
+def is_indexed_ordering(model, names):
+    """
+    排序字段是否能够使用索引
+
+    - 单个字段：字段本身有索引（主键、唯一、db_index、外键），或者是某个索引的第一个字段
+    - 多个字段：是某个联合索引（包括联合唯一约束）的前缀
+    """
+    if not names:
+        return True
+
+    opts = model._meta
+    if len(names) == 1:
+        field = opts.get_field(names[0])
+        if field.primary_key or field.unique or field.db_index:
+            return True
+
+    index_fields = [[item.lstrip('-') for item in index.fields] for index in opts.indexes]
+    index_fields += [list(item) for item in opts.unique_together]
+    index_fields += [list(item.fields) for item in opts.constraints if getattr(item, 'fields', None)]
+    return any(item[: len(names)] == list(names) for item in index_fields)
+
+
+def get_keyset_ordering(model, ordering):
+    """
+    校验并规范排序字段，排序的最后补充主键
+
+    Params:
+        model 模型类
+        ordering list 排序字段，例如 ['-created_at']
+
+    Returns:
+        tuple (字段，是否倒序) 组成的元组
+    """
+    if isinstance(ordering, str) or not isinstance(ordering, (list, tuple)):
+        raise exception.FairySpaceException(
+            error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+            error_data='排序字段必须是列表',
+        )
+
+    index = meta.get_model_index(model)
+    pk = model._meta.pk
+
+    result, names = [], []
+    for item in ordering:
+        name = item.lstrip('-') if isinstance(item, str) else None
+        field = pk if name == 'pk' else index.field_map.get(name)
+        if field is None or not field.concrete or field.many_to_many or field.null:
+            raise exception.FairySpaceException(
+                error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+                error_data=f'排序字段不合法：{item}',
+            )
+        result.append((field, item.startswith('-')))
+        names.append(field.name)
+        if field.primary_key:
+            break
+
+    if not is_indexed_ordering(model, [item for item in names if item != pk.name]):
+        raise exception.FairySpaceException(
+            error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+            error_data=f'排序字段没有索引：{ordering}',
+        )
+
+    # 主键作为决胜字段，方向和第一个排序字段一致
+    if not result or not result[-1][0].primary_key:
+        result.append((pk, result[0][1] if result else False))
+    return tuple(result)
+
+
+def get_keyset_condition(ordering, values):
+    """
+    构建定位下一页的查询条件
+
+    排序为 (a, -b, pk) 时，条件为：
+
+        a > va OR (a = va AND b < vb) OR (a = va AND b = vb AND pk > vpk)
+    """
+    condition = Q()
+    for position, (field, desc) in enumerate(ordering):
+        lookup = 'lt' if desc else 'gt'
+        item = Q(**{f'{field.attname}__{lookup}': values[position]})
+        for (previous, _), value in zip(ordering[:position], values):
+            item &= Q(**{previous.attname: value})
+        condition |= item
+    return condition
+
+
+def get_ordering_signature(ordering):
+    """排序字段的签名，用来校验游标是否属于当前的排序"""
+    return [f'-{field.name}' if desc else field.name for field, desc in ordering]
+
+
+class CursorJSONEncoder(DjangoJSONEncoder):
+    """
+    游标的 JSON 编码
+
+    DjangoJSONEncoder 会把时间截断到毫秒，同一毫秒内的数据会被重复或者跳过，游标里的时间保留完整的微秒
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(ordering, values):
+    """把排序字段的值编码成不透明的游标"""
+    data = json.dumps({'o': get_ordering_signature(ordering), 'v': values}, cls=CursorJSONEncoder)
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor, ordering):
+    """解码游标，游标和当前的排序字段不一致时报错"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        values = data['v']
+        if data['o'] != get_ordering_signature(ordering) or len(values) != len(ordering):
+            raise ValueError
+        return [field.to_python(value) for (field, _), value in zip(ordering, values)]
+    except Exception:
+        raise exception.FairySpaceException(
+            error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+            error_data='游标不合法',
+        )
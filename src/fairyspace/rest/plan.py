@@ -0,0 +1,300 @@
+"""
+序列化执行计划
+
+ModelSerializer 默认的序列化流程中，每一行数据都要重新计算虚拟关系字段列表，查找字段和
+accessor name，并且经过 DRF 通用的 get_attribute/SkipField/PKOnlyObject 检查
+
+这里把序列化类的字段形状一次性编译成扁平的执行计划，计划中的每一项为：
+
+    (输出键，取值函数，转换函数，嵌套计划)
+
+执行计划时，每一行只需要依次调用取值函数和转换函数，输出结果和默认的序列化流程一致
+"""
+
+import operator
+from collections import OrderedDict
+from functools import partial
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models
+
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject, PrimaryKeyRelatedField
+
+from fairyspace.rest.decorator import prime_fairy_properties
+from fairyspace.rest.fields import get_batch_fairy_properties
+from fairyspace.utils import meta
+
+# 取值函数返回此标识时，代表对应的键不输出
+MISSING = object()
+
+# 序列化时依赖 context 的字段，例如文件的绝对地址需要 request，包含这些字段的计划不能在序列化类上共用
+CONTEXT_FIELDS = (serializers.SerializerMethodField, serializers.FileField, serializers.HyperlinkedRelatedField)
+
+
+class RowPlan:
+    """
+    单个模型的执行计划
+
+    items 为 (输出键，取值函数，转换函数，嵌套计划) 组成的元组，嵌套计划为 None 时代表没有嵌套
+
+    batch_properties 为需要输出的批量计算属性，执行多个对象时，每一批对象只计算一次
+
+    shareable 为 True 时，计划中的字段都不依赖序列化对象的 context，可以在序列化类上缓存，
+    同一个序列化类的所有实例共用一个计划
+    """
+
+    __slots__ = ('model', 'items', 'batch_properties', 'shareable')
+
+    def __init__(self, model, items, batch_properties=(), shareable=False):
+        self.model = model
+        self.items = tuple(items)
+        self.batch_properties = tuple(batch_properties)
+        self.shareable = shareable
+
+    def __repr__(self):
+        return f'<RowPlan {self.model.__name__}: {[item[0] for item in self.items]}>'
+
+
+def execute_plan(plan, instance):
+    """执行计划，序列化单个对象"""
+    ret = OrderedDict()
+    for key, getter, converter, _ in plan.items:
+        value = getter(instance)
+        if value is MISSING:
+            continue
+        if value is None:
+            ret[key] = None
+            continue
+        value = converter(value)
+        if value is MISSING:
+            continue
+        ret[key] = value
+    return ret
+
+
+def execute_plan_many(plan, instances):
+    """执行计划，序列化多个对象"""
+    if isinstance(instances, models.manager.BaseManager):
+        instances = instances.all()
+    if plan.batch_properties:
+        instances = list(instances)
+        prime_fairy_properties(plan.batch_properties, instances)
+    return [execute_plan(plan, instance) for instance in instances]
+
+
+def _identity(value):
+    return value
+
+
+def _get_plan(serializer):
+    """获取序列化对象的执行计划，非本库的序列化类返回 None"""
+    return getattr(serializer, 'fairy_plan', None)
+
+
+def _virtual_getter(accessor_name, one_to_one):
+    """反向关系字段的取值函数，和默认流程一样，取值异常时此键不输出"""
+
+    def getter(instance):
+        try:
+            attribute = getattr(instance, accessor_name)
+            return attribute if one_to_one else attribute.all()
+        except Exception:
+            return MISSING
+
+    return getter
+
+
+def _tolerant(converter):
+    """转换异常时此键不输出，用于反向关系字段"""
+
+    def wrapper(value):
+        try:
+            return converter(value)
+        except Exception:
+            return MISSING
+
+    return wrapper
+
+
+def _relation_getter(source, many):
+    """正向关系字段的取值函数"""
+
+    def getter(instance):
+        try:
+            attribute = getattr(instance, source)
+        except ObjectDoesNotExist:
+            return None
+        return attribute.all() if many else attribute
+
+    return getter
+
+
+def _generic_getter(field):
+    """通用的取值函数，和默认的序列化流程保持一致"""
+
+    def getter(instance):
+        try:
+            attribute = field.get_attribute(instance)
+        except SkipField:
+            return MISSING
+
+        if isinstance(attribute, PKOnlyObject):
+            return None if attribute.pk is None else attribute
+        if isinstance(attribute, models.Manager):
+            return attribute.all()
+        return attribute
+
+    return getter
+
+
+def _nested_converter(field):
+    """
+    嵌套序列化字段的转换函数以及嵌套计划
+
+    只有嵌套的是本库的序列化类时，才能编译成嵌套计划
+    """
+    if isinstance(field, serializers.ListSerializer):
+        nested = _get_plan(field.child)
+        if nested is not None:
+            return partial(execute_plan_many, nested), nested
+    elif isinstance(field, serializers.BaseSerializer):
+        nested = _get_plan(field)
+        if nested is not None:
+            return partial(execute_plan, nested), nested
+    return field.to_representation, None
+
+
+def compile_field(model, field, virtual_relation_names):
+    """把单个 DRF 字段编译成计划项"""
+    key = field.field_name
+    converter, nested = _nested_converter(field)
+
+    # 反向关系字段，通过 accessor name 取值
+    if key in virtual_relation_names:
+        django_field = meta.get_field(model, key)
+        getter = _virtual_getter(meta.get_accessor_name(django_field), django_field.one_to_one)
+        return key, getter, _tolerant(converter), nested
+
+    source = field.source
+    django_field = None
+    if source != '*' and len(field.source_attrs) == 1:
+        django_field = meta.get_model_index(model).field_map.get(source)
+
+    if django_field is None or not django_field.concrete:
+        return key, _generic_getter(field), converter, nested
+
+    # 正向的关系字段
+    if meta.is_relation_field(django_field):
+        if nested is not None:
+            return key, _relation_getter(source, django_field.many_to_many), converter, nested
+
+        # 外键主键字段直接读取外键列，不需要访问关联对象
+        if isinstance(field, PrimaryKeyRelatedField) and not django_field.many_to_many:
+            pk_converter = field.pk_field.to_representation if field.pk_field is not None else _identity
+            return key, operator.attrgetter(django_field.attname), pk_converter, None
+
+        return key, _generic_getter(field), converter, nested
+
+    # 普通字段
+    return key, operator.attrgetter(source), converter, None
+
+
+def is_context_free(field):
+    """字段的取值和转换是否不依赖序列化对象的 context（例如 request）"""
+    if isinstance(field, serializers.ManyRelatedField):
+        field = field.child_relation
+    if isinstance(field, serializers.ListSerializer):
+        field = field.child
+    if isinstance(field, serializers.BaseSerializer):
+        nested = _get_plan(field)
+        return nested is not None and nested.shareable
+    return not isinstance(field, CONTEXT_FIELDS)
+
+
+def compile_serializer(serializer):
+    """把序列化对象的可读字段编译成执行计划"""
+    model = serializer.Meta.model
+    virtual_relation_names = {item.name for item in meta.get_virtual_relation_fields(model)}
+    fields = list(serializer._readable_fields)
+    items = [compile_field(model, field, virtual_relation_names) for field in fields]
+    shareable = all(is_context_free(field) for field in fields)
+    return RowPlan(model, items, get_batch_fairy_properties(serializer), shareable)
+
+
+class ValuesPlan:
+    """
+    扁平字段的执行计划
+
+    当展示字段都是模型真实存在的列（包括正向外键的 id）时，直接通过 values_list 查询，
+    不需要构建模型实例，也不需要经过 DRF 的字段分发
+
+    items 为 (输出键，查询列，转换函数) 组成的元组
+    """
+
+    __slots__ = ('model', 'keys', 'columns', 'converters')
+
+    def __init__(self, model, items):
+        self.model = model
+        self.keys = tuple(item[0] for item in items)
+        self.columns = tuple(item[1] for item in items)
+        self.converters = tuple(item[2] for item in items)
+
+    def __repr__(self):
+        return f'<ValuesPlan {self.model.__name__}: {list(self.columns)}>'
+
+    def apply(self, queryset):
+        """把结果集转换成 values_list 结果集，扁平字段不需要预取关联数据"""
+        return queryset.prefetch_related(None).values_list(*self.columns)
+
+    def execute(self, row):
+        """把 values_list 的单行数据转换成输出数据"""
+        return OrderedDict(
+            (key, None if value is None else converter(value))
+            for key, value, converter in zip(self.keys, row, self.converters)
+        )
+
+    def execute_many(self, rows):
+        return [self.execute(row) for row in rows]
+
+
+def compile_values_field(model, field):
+    """
+    把单个 DRF 字段编译成 (输出键，查询列，转换函数)，不能通过 values_list 获取时返回 None
+    """
+    if field.source == '*' or len(field.source_attrs) != 1 or field.source != field.field_name:
+        return
+
+    django_field = meta.get_model_index(model).field_map.get(field.source)
+    if django_field is None or not django_field.concrete or django_field.many_to_many:
+        return
+
+    # 外键只支持主键字段，values_list 查询外键名称时得到的是外键 id
+    if meta.is_relation_field(django_field):
+        if type(field) is not PrimaryKeyRelatedField:
+            return
+        pk_converter = field.pk_field.to_representation if field.pk_field is not None else _identity
+        return field.field_name, field.source, pk_converter
+
+    # 嵌套序列化类和关系字段不能走快速通道，计算属性不是真实的列，在上面已经排除
+    if isinstance(field, (serializers.BaseSerializer, serializers.RelatedField, serializers.ManyRelatedField)):
+        return
+
+    return field.field_name, field.source, field.to_representation
+
+
+def compile_values_plan(serializer):
+    """
+    编译扁平字段的执行计划，如果有任何一个字段不能通过 values_list 获取，返回 None
+    """
+    model = serializer.Meta.model
+    items = []
+    for field in serializer._readable_fields:
+        item = compile_values_field(model, field)
+        if item is None:
+            return
+        items.append(item)
+    if not items:
+        return
+    return ValuesPlan(model, items)
@@ -0,0 +1,427 @@
+"""
+查询计划
+
+展开字段默认全部使用 prefetch_related，每一层关系都会多一次数据库往返，但是正向外键、
+一对一这类单值的关系，一次 JOIN 就可以取回
+
+这里根据关系的基数对展开字段进行规划：
+
+- 单值的关系链（正向外键、正向一对一、反向一对一）使用 select_related
+- 多值的关系（反向外键、多对多）使用 Prefetch，Prefetch 的结果集内部继续按照同样的规则规划
+- 重叠的路径会合并成一棵树，例如 school 和 school.teachers 只会 JOIN 一次 school
+- 展开的多值关系可以限制每个父对象最多返回的条数，并返回每个父对象关联数据的总数
+- 读取数据的动作会根据展示字段裁剪查询的列，根结果集和每个 Prefetch 的结果集都使用 only()，
+  关联查询需要的外键列会自动补充，计算属性需要的列通过 fairyproperty 的 depends 声明
+
+student 展开 school.teachers.courses、classroom、teachers 时，计划为：
+
+{
+    'model': 'school.Student',
+    'select_related': ['school', 'classroom'],
+    'only': None,
+    'prefetch_related': [
+        {
+            'lookup': 'school__teachers',
+            'model': 'school.Teacher',
+            'select_related': [],
+            'only': None,
+            'prefetch_related': [
+                {'lookup': 'courses', 'model': 'school.Course', 'select_related': [], 'only': None, ...},
+            ],
+        },
+        {'lookup': 'teachers', 'model': 'school.Teacher', 'select_related': [], 'only': None, ...},
+    ],
+}
+"""
+
+import logging
+
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.core import exception
+from fairyspace.utils import meta
+from fairyspace.utils.cache import LRUCache
+from fairyspace.utils.data import ExpandTotalField, freeze_fields, generate_nest_field_dict
+
+logger = logging.getLogger(__name__)
+
+
+class LimitedPrefetch(Prefetch):
+    """
+    使用切片结果集的 Prefetch
+
+    Django 对切片的 Prefetch 结果集会使用按父对象分区的窗口函数进行过滤，但是没有指定 to_attr 时，
+    预取结果写入关联管理器缓存的过程中，会对切片后的结果集再次 filter 而报错
+
+    这里把切片结果集只用于查询，queryset 属性保持为 None，写入缓存时使用关联管理器默认的结果集，
+    预取的数据仍然可以通过 instance.students.all() 访问
+    """
+
+    def __init__(self, lookup, queryset):
+        super().__init__(lookup)
+        self.limited_queryset = queryset
+
+    def get_current_querysets(self, level):
+        if self.get_current_prefetch_to(level) == self.prefetch_to:
+            return [self.limited_queryset]
+        return None
+
+
+class QueryPlan:
+    """
+    单个模型的查询计划
+
+    select_related 为单值关系的查询路径列表，prefetches 为 (查询路径，子计划) 组成的元组，
+    子计划是多值关系对应模型的查询计划
+
+    only 为需要查询的列（包含 select_related 关联模型的列），为 None 时查询全部的列
+
+    totals 为 (输出键，多值关系字段) 组成的元组，每个父对象关联数据的总数通过子查询注解
+
+    ordering 和 limit 只用于 Prefetch 的子计划，限制每个父对象最多预取的关联数据条数，
+    Django 对切片的 Prefetch 结果集使用按父对象分区的窗口函数（ROW_NUMBER）实现
+    """
+
+    __slots__ = ('model', 'select_related', 'prefetches', 'only', 'totals', 'ordering', 'limit')
+
+    def __init__(self, model, select_related=(), prefetches=(), only=None, totals=(), ordering=(), limit=None):
+        self.model = model
+        self.select_related = tuple(select_related)
+        self.prefetches = tuple(prefetches)
+        self.only = tuple(only) if only is not None else None
+        self.totals = tuple(totals)
+        self.ordering = tuple(ordering)
+        self.limit = limit
+
+    def __repr__(self):
+        return f'<QueryPlan {self.model._meta.label}: {self.explain()}>'
+
+    def __bool__(self):
+        return bool(self.select_related or self.prefetches or self.only is not None or self.totals or self.ordering)
+
+    def get_prefetch_list(self):
+        """
+        构建 Prefetch 对象列表
+
+        Prefetch 对象在执行过程中会被修改，所以每次都重新构建，不在多个请求之间共享
+        """
+        result = []
+        for lookup, plan in self.prefetches:
+            queryset = plan.apply(plan.model._default_manager.all())
+            if plan.limit:
+                result.append(LimitedPrefetch(lookup, queryset[: plan.limit]))
+            else:
+                result.append(Prefetch(lookup, queryset=queryset))
+        return result
+
+    def apply(self, queryset):
+        """把查询计划应用到结果集上"""
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.totals:
+            queryset = queryset.annotate(**{name: get_total_expression(field) for name, field in self.totals})
+        if self.only is not None:
+            queryset = queryset.only(*self.only)
+        if self.ordering:
+            queryset = queryset.order_by(*self.ordering)
+        if self.prefetches:
+            queryset = queryset.prefetch_related(*self.get_prefetch_list())
+        return queryset
+
+    def explain(self):
+        """以字典的形式输出查询计划，用于调试"""
+        result = {
+            'model': self.model._meta.label,
+            'select_related': list(self.select_related),
+            'only': list(self.only) if self.only is not None else None,
+            'prefetch_related': [{'lookup': lookup, **plan.explain()} for lookup, plan in self.prefetches],
+        }
+        if self.totals:
+            result['totals'] = [name for name, _ in self.totals]
+        if self.ordering:
+            result['ordering'] = list(self.ordering)
+        if self.limit:
+            result['limit'] = self.limit
+        return result
+
+
+def get_total_expression(field):
+    """
+    多值关系的总数子查询
+
+    SELECT COUNT(*) FROM 关联表 WHERE 关联表.外键 = 父表.主键 GROUP BY 关联表.外键
+    """
+    reverse_name = meta.get_reverse_query_name(field)
+    queryset = (
+        field.related_model._default_manager.filter(**{reverse_name: OuterRef('pk')})
+        .order_by()
+        .values(reverse_name)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(queryset), 0)
+
+
+def _raise_expand_error(error_data):
+    raise exception.FairySpaceException(
+        error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+        error_data=error_data,
+    )
+
+
+def get_expand_ordering(model, options):
+    """
+    校验展开关系的排序字段，设置了 limit 但是没有指定排序时，使用模型默认的排序或者主键，
+    保证每次截取的数据是确定的
+    """
+    ordering = options.get('ordering')
+    if ordering is None:
+        if not options.get('limit'):
+            return ()
+        ordering = model._meta.ordering or ['pk']
+
+    if isinstance(ordering, str) or not isinstance(ordering, (list, tuple)):
+        _raise_expand_error('展开关系的 ordering 必须是列表')
+
+    index = meta.get_model_index(model)
+    result = []
+    for item in ordering:
+        name = item.lstrip('-') if isinstance(item, str) else None
+        field = model._meta.pk if name == 'pk' else index.field_map.get(name)
+        if field is None or not field.concrete or field.many_to_many:
+            _raise_expand_error(f'展开关系的排序字段不合法：{item}')
+        result.append(f'-{field.name}' if item.startswith('-') else field.name)
+    return tuple(result)
+
+
+def get_expand_limit(options):
+    """校验展开关系的 limit，必须是正整数"""
+    limit = options.get('limit')
+    if limit is None:
+        return
+    if isinstance(limit, bool) or not isinstance(limit, int) or limit <= 0:
+        _raise_expand_error(f'展开关系的 limit 必须是正整数：{limit}')
+    return limit
+
+
+def get_shape_totals(model, shape):
+    """
+    展示字段形状中需要返回总数的多值关系
+
+    Returns:
+        list (输出键，多值关系字段) 组成的列表
+    """
+    index = meta.get_model_index(model)
+    result = []
+    for key, value in (shape or {}).items():
+        if not isinstance(value, ExpandTotalField):
+            continue
+        field = index.get_field(value.relation)
+        if field is None or not index.is_many(field.name):
+            _raise_expand_error(f'只有一对多和多对多关系支持 total：{value.relation}')
+        result.append((str(key), field))
+    return result
+
+
+def build_path_tree(model, paths):
+    """
+    把展开字段的路径合并成一棵树，重叠的路径只保留一份
+
+    路径中的每一段都通过模型元数据进行校验，不是关系字段的段以及后续的段会被忽略
+
+    Returns:
+        dict {字段名称: (字段，子树)}
+    """
+    tree = {}
+    for path in paths:
+        node, current_model = tree, model
+        for name in path.replace('__', '.').split('.'):
+            field = meta.get_field(current_model, name)
+            if field is None or not meta.is_relation_field(field) or field.related_model is None:
+                break
+            # 字段名称和 accessor name 指向同一个字段时，合并成同一个节点
+            _, node = node.setdefault(field.name, (field, {}))
+            current_model = field.related_model
+    return tree
+
+
+def get_attribute_name(field):
+    """关系字段在模型实例上的属性名称，反向字段使用 accessor name"""
+    if meta.is_virtual_relation_field(field):
+        return meta.get_accessor_name(field)
+    return field.name
+
+
+def get_all_columns(model):
+    """模型全部的列对应的字段名称"""
+    return [item.name for item in meta.get_concrete_fields(model) if not item.many_to_many]
+
+
+def get_shape_columns(model, shape):
+    """
+    根据展示字段的形状计算需要查询的列
+
+    - 主键始终查询
+    - 普通字段和正向的外键、一对一字段查询对应的列（外键只需要外键 id 列）
+    - 反向关系和多对多关系不需要当前模型的列
+    - 计算属性查询 depends 中声明的列
+
+    Params:
+        model 模型类
+        shape dict generate_nest_field_dict 生成的字段形状，为空时代表全部字段
+
+    Returns:
+        set 需要查询的字段名称，无法确定时（例如计算属性没有声明 depends）返回 None
+    """
+    if not shape:
+        return
+
+    index = meta.get_model_index(model)
+    columns = {model._meta.pk.name}
+    for key, value in shape.items():
+        # 关系总数是子查询注解，不需要查询列
+        if isinstance(value, ExpandTotalField):
+            continue
+        field = index.get_field(key)
+        if field is None:
+            depends = getattr(index.fairy_property_fields.get(key), 'depends', None)
+            if depends is None:
+                return
+            columns.update(depends)
+        elif field.many_to_many or (field.auto_created and not field.concrete):
+            continue
+        elif field.concrete:
+            columns.add(field.name)
+        else:
+            return
+    return columns
+
+
+def get_child_shapes(model, shape):
+    """展示字段形状中的嵌套部分，键统一为字段名称"""
+    result = {}
+    for key, value in (shape or {}).items():
+        if isinstance(value, dict):
+            field = meta.get_field(model, key)
+            if field is not None:
+                result[field.name] = value
+    return result
+
+
+def compile_tree(model, tree, shape=None, prune=False, query_prefix=(), attribute_prefix=()):
+    """
+    编译路径树
+
+    单值关系的子树会继续合并到当前的计划中，查询路径带上前缀；多值关系的子树会编译成
+    独立的子计划，放到 Prefetch 中
+
+    select_related 的路径使用查询名称（反向字段为 field.name），prefetch_related 的路径
+    使用属性名称（反向字段为 accessor name，例如 classroom_set），所以分别记录两种前缀
+
+    单值关系的子树需要返回关联数据的总数时，JOIN 的模型上不能添加注解，所以这个单值关系
+    也会使用 Prefetch
+
+    Params:
+        shape dict 当前模型的展示字段形状
+        prune bool 是否裁剪查询的列
+
+    Returns:
+        tuple (select_related 列表，prefetches 列表，需要查询的列)
+
+        需要查询的列为 None 时代表查询全部的列，列名称带有 query_prefix 前缀
+    """
+    index = meta.get_model_index(model)
+    child_shapes = get_child_shapes(model, shape)
+    columns = get_shape_columns(model, shape) if prune else None
+    select_related, prefetches, only = [], [], []
+    pruned = columns is not None
+
+    for name, (field, children) in tree.items():
+        attributes = attribute_prefix + (get_attribute_name(field),)
+        child_shape = child_shapes.get(name)
+        related_model = field.related_model
+
+        totals = get_shape_totals(related_model, child_shape)
+        if index.is_many(name) or totals:
+            options = getattr(child_shape, 'options', {}) if index.is_many(name) else {}
+            sub_select, sub_prefetches, sub_only = compile_tree(related_model, children, child_shape, prune)
+            # 反向关系预取时，需要通过关联模型的外键列和父对象进行匹配
+            if sub_only is not None and meta.is_virtual_relation_field(field) and not field.many_to_many:
+                sub_only.append(field.field.name)
+            sub_plan = QueryPlan(
+                related_model,
+                sub_select,
+                sub_prefetches,
+                sub_only,
+                totals=totals,
+                ordering=get_expand_ordering(related_model, options),
+                limit=get_expand_limit(options),
+            )
+            prefetches.append(('__'.join(attributes), sub_plan))
+            continue
+
+        path = query_prefix + (field.name,)
+        select_related.append('__'.join(path))
+
+        sub_select, sub_prefetches, sub_only = compile_tree(related_model, children, child_shape, prune, path, attributes)
+        select_related.extend(sub_select)
+        prefetches.extend(sub_prefetches)
+        if sub_only is None:
+            # 只指定关系路径时，关联模型的全部列都会查询
+            only.append('__'.join(path))
+        else:
+            only.extend(sub_only)
+            pruned = True
+
+    # 子路径已经包含了父路径的 JOIN，这里只保留最长的路径
+    select_related = [
+        item for item in select_related if not any(other.startswith(f'{item}__') for other in select_related)
+    ]
+
+    if not pruned:
+        return select_related, prefetches, None
+
+    if columns is None:
+        columns = get_all_columns(model)
+    only = ['__'.join(query_prefix + (item,)) for item in sorted(columns)] + only
+    return select_related, prefetches, only
+
+
+def compile_query_plan(model, paths, display_fields=None, prune=False):
+    """
+    编译查询计划
+
+    Params:
+        model 模型类
+        paths list 展开字段路径，点号连接，例如 ['school.teachers', 'classroom_set']
+        display_fields list 展示字段，用于裁剪查询的列
+        prune bool 是否裁剪查询的列
+    """
+    shape = generate_nest_field_dict(display_fields) if display_fields else None
+    tree = build_path_tree(model, paths or ())
+    select_related, prefetches, only = compile_tree(model, tree, shape, prune)
+    return QueryPlan(model, select_related, prefetches, only, totals=get_shape_totals(model, shape))
+
+
+"""
+查询计划缓存，键为 (模型，排序后的展开字段路径，展示字段的规范形式，是否裁剪查询的列)
+"""
+query_plan_cache = LRUCache(maxsize=fairy_space_settings.QUERY_PLAN_CACHE_SIZE)
+
+
+def get_query_plan(model, paths, display_fields=None, prune=False):
+    """获取查询计划，优先从缓存中获取，展示字段无法转换成规范形式时，不使用缓存"""
+    paths = tuple(sorted(set(paths or ())))
+    try:
+        key = (model, paths, freeze_fields(display_fields), prune)
+    except TypeError:
+        return compile_query_plan(model, paths, display_fields, prune)
+
+    plan = query_plan_cache.get(key)
+    if plan is None:
+        plan = compile_query_plan(model, paths, display_fields, prune)
+        query_plan_cache.set(key, plan)
+        logger.debug('fairyspace query plan: %s', plan.explain())
+    return plan
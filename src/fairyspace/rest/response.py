@@ -1,6 +1,8 @@
+from django.http import StreamingHttpResponse
 from rest_framework.response import Response
 
 from fairyspace.core.exception import ERROR_PHRASES
+from fairyspace.rest.stream import iter_success_json
 
 
 def success_response(data=None):
@@ -16,6 +18,15 @@ def success_response(data=None):
     return Response({'code': 0, 'message': '', 'result': data})
 
 
+def streaming_success_response(chunks):
+    """流式返回成功的数据结构，result 为逐块输出的列表
+
+    Params:
+        chunks iterable 已经序列化好的数据块，每一块是一个列表
+    """
+    return StreamingHttpResponse(iter_success_json(chunks), content_type='application/json')
+
+
 def error_response(code, message=None, data=None, app=None):
     """业务异常返回的数据结构，这里返回了四种数据结构
 
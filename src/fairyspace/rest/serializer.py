@@ -7,25 +7,101 @@ from rest_framework import serializers
 from rest_framework.fields import SkipField
 from rest_framework.relations import PKOnlyObject
 
+from fairyspace.conf.settings import fairy_space_settings
 from fairyspace.const import FAIRY_INNER_ACTION_EXPORT_FILE
 from fairyspace.rest import fields as drf_fields
+from fairyspace.rest import plan as row_plan
+from fairyspace.rest.decorator import prime_fairy_properties
 from fairyspace.rest.fields import (
     fairy_property_to_drf_field,
+    get_batch_fairy_properties,
     get_fairy_property_fields,
 )
 
 from fairyspace.utils import meta
+from fairyspace.utils.cache import LRUCache
 from fairyspace.utils.data import (
+    ExpandTotalField,
     check_include_nest_dict,
+    freeze_fields,
     generate_nest_field_dict,
 )
 
 
+class FairyListSerializer(serializers.ListSerializer):
+    """列表序列化类，子序列化类开启编译模式时，直接执行子序列化类的执行计划"""
+
+    def to_representation(self, data):
+        plan = getattr(self.child, 'fairy_plan', None)
+        if plan is not None:
+            return row_plan.execute_plan_many(plan, data)
+
+        iterable = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        # 批量计算属性，每一批数据只计算一次
+        prime_fairy_properties(get_batch_fairy_properties(self.child), iterable)
+        return [self.child.to_representation(item) for item in iterable]
+
+
 class ModelSerializer(serializers.ModelSerializer):
+    # 是否使用编译后的执行计划进行序列化
+    fairy_compiled = fairy_space_settings.COMPILED_SERIALIZER
+
+    @property
+    def fairy_plan(self):
+        """
+        编译后的执行计划
+
+        动态序列化类按照字段形状缓存，计划不依赖 context 时在序列化类上缓存，每个字段形状只编译一次，
+        编译时使用一个新的序列化对象，避免类上的缓存引用请求的数据；依赖 context 时每个序列化对象编译一次
+
+        没有开启编译模式时返回 None
+
+        注意：使用 cls.__dict__ 而不是 getattr，避免子类拿到父类的计划
+        """
+        if not self.fairy_compiled:
+            return None
+        cls = self.__class__
+        plan = cls.__dict__.get('_fairy_plan') or self.__dict__.get('_fairy_plan')
+        if plan is not None:
+            return plan
+
+        if cls.__dict__.get('_fairy_plan_shareable', True):
+            plan = row_plan.compile_serializer(cls())
+            if plan.shareable:
+                cls._fairy_plan = plan
+                return plan
+            cls._fairy_plan_shareable = False
+
+        self._fairy_plan = row_plan.compile_serializer(self)
+        return self._fairy_plan
+
+    def get_fields(self):
+        """
+        同一个序列化类构建出来的字段是一样的，这里在类上缓存一份字段原型，
+        后续实例直接复制原型，避免每次都重新分析模型构建字段
+
+        注意：使用 cls.__dict__ 而不是 getattr，避免子类拿到父类的原型
+        """
+        cls = self.__class__
+        prototype = cls.__dict__.get('_fairy_fields_prototype')
+        if prototype is None:
+            prototype = super().get_fields()
+            cls._fairy_fields_prototype = prototype
+        return copy.deepcopy(prototype)
+
     def to_representation(self, instance):
         """
         Object instance -> Dict of primitive datatypes.
         """
+        plan = self.fairy_plan
+        if plan is not None:
+            return row_plan.execute_plan(plan, instance)
+        return self.fairy_generic_representation(instance)
+
+    def fairy_generic_representation(self, instance):
+        """
+        未编译的序列化流程，逐个字段通过 DRF 通用的取值方式进行处理
+        """
         ret = OrderedDict()
         fields = self._readable_fields
 
@@ -103,7 +179,7 @@ class ExportModelSerializer(ModelSerializer):
 def create_meta_class(model, display_fields=None, action=None, **kwargs):
     """构建序列化类的 Meta 类"""
 
-    attrs = {'model': model}
+    attrs = {'model': model, 'list_serializer_class': FairyListSerializer}
 
     if display_fields:
         fields = display_fields
@@ -158,6 +234,11 @@ def create_serializer_class(model, action=None, attrs=None, display_fields=None)
     )
 
 
+def create_expand_total_field():
+    """展开关系的总数字段，值来自查询计划添加的同名注解"""
+    return serializers.IntegerField(read_only=True)
+
+
 def create_nested_serializer_class(model, field_nest, action=None, **kwargs):
     """构建嵌套序列化类
 
@@ -166,6 +247,9 @@ def create_nested_serializer_class(model, field_nest, action=None, **kwargs):
     attrs = {}
 
     for key, value in field_nest.items():
+        if isinstance(value, ExpandTotalField):
+            attrs[key] = create_expand_total_field()
+            continue
         if not isinstance(value, dict):
             continue
 
@@ -207,6 +291,9 @@ def create_dynamic_serializer_class(model, action=None, display_fields=None):
 
     # 处理扩展字段对应的序列化类
     for key, value in nest_field_dict.items():
+        if isinstance(value, ExpandTotalField):
+            attrs[key] = create_expand_total_field()
+            continue
         if not isinstance(value, dict):
             continue
         field = meta.get_field(model, key)
@@ -233,3 +320,29 @@ def create_dynamic_serializer_class(model, action=None, display_fields=None):
         attrs=attrs,
         display_fields=list(nest_field_dict.keys()),
     )
+
+
+"""
+动态序列化类缓存
+
+相同的模型，动作和展示字段构建出来的序列化类是一样的，缓存起来避免每次请求都重新构建
+"""
+serializer_class_cache = LRUCache(maxsize=fairy_space_settings.SERIALIZER_CACHE_SIZE)
+
+
+def get_dynamic_serializer_class(model, action=None, display_fields=None):
+    """
+    获取动态序列化类，优先从缓存中获取
+
+    缓存键为 (模型，动作，展示字段的规范形式)，如果展示字段无法转换成规范形式，
+    则不使用缓存，直接构建
+    """
+    try:
+        key = (model, action, freeze_fields(display_fields))
+    except TypeError:
+        return create_dynamic_serializer_class(model, action=action, display_fields=display_fields)
+
+    return serializer_class_cache.get_or_create(
+        key,
+        lambda: create_dynamic_serializer_class(model, action=action, display_fields=display_fields),
+    )
@@ -0,0 +1,245 @@
+"""
+分片并行导出
+
+单个进程逐块序列化时，数据量很大的导出既用不满 CPU，也用不满磁盘。这里把过滤之后的结果集
+按照主键范围切分成多个分片，每个分片交给进程池中的一个进程导出到单独的文件，最后可以按顺序
+把分片文件合并成一个文件
+
+- 每个分片在子进程中重建结果集（过滤条件通过 Query 对象传递）和导出的序列化类，使用子进程自己的
+  数据库连接，输出的内容和流式导出完全一致
+- 子进程按照导出字段应用查询计划（select_related、prefetch_related 和裁剪查询的列），和导出接口一样
+  不会对展开的关系逐行查询
+- 分片按照主键排序，主键范围通过一次主键索引扫描计算，每个分片的数据条数基本相同
+- 子进程使用 spawn 方式启动，不会继承父进程的数据库连接
+- max_workers 为 0 时在当前进程中依次导出，不启动进程池
+- 只有 csv 和 ndjson 可以合并，arrow 和 parquet 的每个分片都是单独的完整文件
+
+分片导出会启动进程池，只通过 fairy_export 命令或者后台任务调用，不由接口的调用端触发。
+导出的文件保存在不对外提供访问的目录中，不会自动清理，由调用方处理
+"""
+
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.apps import apps
+from django.conf import settings as django_settings
+
+from fairyspace import const
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.core import exception
+from fairyspace.rest.export import COLUMNAR_EXPORT_FORMATS, EXPORT_FORMATS, iter_export_content
+from fairyspace.rest.plan import compile_values_plan
+from fairyspace.rest.planner import get_query_plan
+from fairyspace.rest.serializer import get_dynamic_serializer_class
+from fairyspace.utils.data import get_prefetch_fields
+
+logger = logging.getLogger(__name__)
+
+
+def get_shard_ranges(queryset, shard_size):
+    """
+    按照主键把结果集切分成多个范围
+
+    只读取主键列，按块遍历，内存占用和数据总量无关
+
+    Returns:
+        list (起始主键，结束主键，数据条数) 组成的列表，范围包含两端
+    """
+    ranges = []
+    start, last, count = None, None, 0
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    for pk in pks.iterator(chunk_size=fairy_space_settings.EXPORT_CHUNK_SIZE):
+        if start is None:
+            start = pk
+        last, count = pk, count + 1
+        if count >= shard_size:
+            ranges.append((start, last, count))
+            start, count = None, 0
+    if start is not None:
+        ranges.append((start, last, count))
+    return ranges
+
+
+def get_export_directory():
+    """分片文件的存放目录，没有配置时使用临时目录下的 fairyspace/exports，不放在对外访问的 MEDIA_ROOT 下"""
+    directory = fairy_space_settings.EXPORT_SHARD_DIR
+    if not directory:
+        directory = os.path.join(tempfile.gettempdir(), 'fairyspace', 'exports')
+    return directory
+
+
+def export_shard(task):
+    """
+    导出单个分片，在子进程中执行
+
+    Params:
+        task dict 分片任务，只包含可以序列化的数据
+
+    Returns:
+        dict 分片的结果
+    """
+    model = apps.get_model(task['model'])
+    queryset = model._default_manager.using(task['db']).all()
+    queryset.query = task['query']
+    queryset = queryset.prefetch_related(*task['prefetches'])
+    # Prefetch 对象在执行过程中会被修改，每个分片单独构建查询计划的预取对象
+    display_fields = task['display_fields']
+    query_plan = get_query_plan(model, get_prefetch_fields(display_fields), display_fields=display_fields, prune=True)
+    queryset = query_plan.apply(queryset).order_by('pk')
+    # 没有数据时只有一个空的分片，只输出表头
+    if task['start'] is None:
+        queryset = queryset.none()
+    else:
+        queryset = queryset.filter(pk__gte=task['start'], pk__lte=task['end'])
+
+    serializer_class = get_dynamic_serializer_class(
+        model, action=const.FAIRY_INNER_ACTION_EXPORT_FILE, display_fields=display_fields
+    )
+    serializer = serializer_class(many=True)
+    values_plan = compile_values_plan(serializer.child) if fairy_space_settings.VALUES_FAST_PATH else None
+
+    content = iter_export_content(
+        queryset,
+        serializer,
+        task['format'],
+        headers=task['headers'],
+        values_plan=values_plan,
+        include_header=task['index'] == 0,
+    )
+    size = 0
+    with open(task['path'], 'wb') as f:
+        for data in content:
+            f.write(data)
+            size += len(data)
+
+    return {
+        'index': task['index'],
+        'path': task['path'],
+        'start': task['start'],
+        'end': task['end'],
+        'rows': task['rows'],
+        'size': size,
+    }
+
+
+def _init_worker(settings_module):
+    """子进程初始化，spawn 启动的进程需要重新加载 Django"""
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def merge_shards(shards, path):
+    """按照分片顺序合并分片文件，合并之后删除分片文件"""
+    with open(path, 'wb') as target:
+        for shard in shards:
+            with open(shard['path'], 'rb') as source:
+                shutil.copyfileobj(source, target)
+    for shard in shards:
+        os.remove(shard['path'])
+        shard['path'] = None
+    return path
+
+
+def export_sharded(
+    queryset,
+    display_fields,
+    export_format,
+    headers=None,
+    filename=None,
+    merge=True,
+    shard_size=None,
+    max_workers=None,
+    directory=None,
+    progress=None,
+):
+    """
+    分片并行导出
+
+    Params:
+        queryset 过滤之后的结果集，展开字段的查询计划在导出分片时按照 display_fields 应用
+        display_fields list 导出的字段
+        export_format str 导出格式
+        headers dict CSV 的列名映射
+        filename str 文件名称，不包含扩展名
+        merge bool 是否把分片文件合并成一个文件
+        shard_size int 每个分片的数据条数
+        max_workers int 进程数量，为 0 时在当前进程中依次导出，为 None 时使用 CPU 数量
+        directory str 文件存放的目录
+        progress function 每个分片完成时调用 progress(已完成的分片数量，分片总数，分片结果)
+
+    Returns:
+        dict 导出的结果，合并时 file 为合并之后的文件路径
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise exception.FairySpaceException(
+            error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+            error_data=f'导出格式不支持：{export_format}',
+        )
+    if merge and export_format in COLUMNAR_EXPORT_FORMATS:
+        raise exception.FairySpaceException(
+            error_code=exception.FAIRY_PARAMETER_FORMAT_ERROR,
+            error_data=f'{export_format} 格式的分片不能合并',
+        )
+
+    shard_size = shard_size or fairy_space_settings.EXPORT_SHARD_SIZE
+    if max_workers is None:
+        max_workers = fairy_space_settings.EXPORT_MAX_WORKERS
+    directory = directory or get_export_directory()
+    os.makedirs(directory, exist_ok=True)
+
+    model = queryset.model
+    extension = EXPORT_FORMATS[export_format][1]
+    name = f'{filename or model._meta.model_name}-{uuid.uuid4().hex[:8]}'
+
+    tasks = [
+        {
+            'index': index,
+            'model': model._meta.label,
+            'db': queryset.db,
+            'query': queryset.query,
+            'prefetches': queryset._prefetch_related_lookups,
+            'display_fields': display_fields,
+            'format': export_format,
+            'headers': headers,
+            'start': start,
+            'end': end,
+            'rows': rows,
+            'path': os.path.join(directory, f'{name}.{index:05d}.{extension}'),
+        }
+        for index, (start, end, rows) in enumerate(get_shard_ranges(queryset, shard_size) or [(None, None, 0)])
+    ]
+
+    shards = []
+
+    def done(shard):
+        shards.append(shard)
+        logger.info('fairyspace export %s shard %s/%s finished: %s rows', name, len(shards), len(tasks), shard['rows'])
+        if progress:
+            progress(len(shards), len(tasks), shard)
+
+    if max_workers == 0 or len(tasks) <= 1:
+        for task in tasks:
+            done(export_shard(task))
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers or None,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(django_settings.SETTINGS_MODULE,),
+        )
+        with executor:
+            for future in as_completed([executor.submit(export_shard, task) for task in tasks]):
+                done(future.result())
+
+    shards.sort(key=lambda item: item['index'])
+    result = {'rows': sum(item['rows'] for item in shards), 'shards': shards, 'file': None}
+    if merge:
+        result['file'] = merge_shards(shards, os.path.join(directory, f'{name}.{extension}'))
+    return result
@@ -0,0 +1,55 @@
+"""
+流式响应
+
+数据量很大并且不分页时，一次性把结果集序列化到内存中会让进程内存暴涨，这里按块读取结果集，
+按块序列化，然后逐块输出
+"""
+
+from rest_framework.renderers import JSONRenderer
+
+
+def iter_chunks(queryset, chunk_size):
+    """
+    按块读取结果集，使用服务端游标（数据库支持时），每次只在内存中保留一块数据
+
+    注意：使用 prefetch_related 时，每一块数据会单独进行预取
+    """
+    chunk = []
+    for item in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_success_json(chunks):
+    """
+    逐块输出成功返回的数据结构，输出结果和 success_response 渲染后的结果一致
+
+    {
+        'code': 0,
+        'message': '',
+        'result': [...],
+    }
+
+    Params:
+        chunks iterable 已经序列化好的数据块，每一块是一个列表
+    """
+    renderer = JSONRenderer()
+
+    envelope = renderer.render({'code': 0, 'message': '', 'result': []})
+    prefix, suffix = envelope.rsplit(b'[]', 1)
+    yield prefix + b'['
+
+    first = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        # 去掉列表两端的中括号，块与块之间使用逗号连接
+        content = renderer.render(chunk)[1:-1]
+        yield content if first else b',' + content
+        first = False
+
+    yield b']' + suffix
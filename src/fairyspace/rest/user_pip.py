@@ -14,28 +14,32 @@ from fairyspace.const import FAIRY_STATEMENT_USER_PIP_CONFIG
 from fairyspace.utils.meta import get_related_model_field
 
 # 对应视图处理函数的集合
-VALID_ACTION_SET = {'create', 'update', 'partial_update', 'patch_enhance'}
+VALID_ACTION_SET = {
+    'create',
+    'update',
+    'partial_update',
+    'patch_enhance',
+    'bulk_create',
+    'bulk_update',
+    'upsert',
+    'import_data',
+}
 
 
-def fairy_pip_user_add_handle(view, data):
+def fairy_get_user_pip_field(view):
     """
-    用户数据处理管道
+    获取当前动作需要自动插入的用户字段名称，不需要处理时返回 None
+
+    批量写入时只需要获取一次，然后对每一条数据进行处理
 
     Params:
         view object 视图对象
-        data dict 字典
     """
 
     # 当前只有创建和更新支持用户数据处理并且是已经通过认证的用户
     if view.action.lower() not in VALID_ACTION_SET or view.request.user.is_anonymous:
         return
 
-    # 这里注意个细节，data 可能是空数据，如果是空数据，这种场景也没有什么意义
-    # 这意味着模型可能包含两个字段，一个主键和一个用户字段，目前不知道注意的场景
-    # 有什么意义
-    if not data or not isinstance(data, dict):
-        return
-
     # 查看配置，用户是否已经配置对应的 action 是否可以处理
     config = getattr(view.fairy_instance.statement_class, FAIRY_STATEMENT_USER_PIP_CONFIG, None)
     # 如果配置为空，则不进行任何处理
@@ -58,6 +62,27 @@ def fairy_pip_user_add_handle(view, data):
     user_relation_field = get_related_model_field(view.fairy_instance.model, USER_MODEL)
     if not user_relation_field:
         return
+    return field_name
+
+
+def fairy_pip_user_add_handle(view, data):
+    """
+    用户数据处理管道
+
+    Params:
+        view object 视图对象
+        data dict 字典
+    """
+
+    # 这里注意个细节，data 可能是空数据，如果是空数据，这种场景也没有什么意义
+    # 这意味着模型可能包含两个字段，一个主键和一个用户字段，目前不知道注意的场景
+    # 有什么意义
+    if not data or not isinstance(data, dict):
+        return
+
+    field_name = fairy_get_user_pip_field(view)
+    if not field_name:
+        return
 
     if field_name not in data:
         data[field_name] = view.request.user.id
@@ -0,0 +1,166 @@
+"""
+批量校验
+
+表单逐条校验时，每一个 UniqueValidator 和每一个 PrimaryKeyRelatedField 都会为每一条数据执行一次查询，
+批量写入一千条数据就会执行几千次校验查询
+
+这里在校验一批数据之前，先收集这一批数据中所有唯一字段的值和外键的主键，每个字段（模型）只执行一次
+IN 查询，然后逐条校验时直接使用查询的结果，返回的错误信息和逐条校验完全一致
+
+- 只替换 PrimaryKeyRelatedField（包括多对多的 ManyRelatedField）和精确匹配的 UniqueValidator，
+  自定义的子类和其他校验器保持原来的逐条校验
+- 没有预取到的值（例如没有调用 prepare 就校验）回退到原来的逐条查询
+- 同一批数据中唯一字段的值重复时，后面的数据和已经存在的值一样返回 unique 错误
+"""
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, RelatedField
+from rest_framework.validators import UniqueValidator
+
+from fairyspace.utils import meta
+
+
+def _to_key(model_field, value):
+    """把传入的值转换成可以比较的值，不能转换时返回 None"""
+    if value is None or isinstance(value, (bool, dict, list)):
+        return
+    try:
+        return model_field.to_python(value)
+    except (DjangoValidationError, TypeError, ValueError):
+        return
+
+
+class BatchRelatedLookup:
+    """
+    批量获取外键的关联对象，替换 PrimaryKeyRelatedField 的 to_internal_value
+    """
+
+    def __init__(self, field_name, relation, many=False):
+        self.field_name = field_name
+        self.relation = relation
+        self.many = many
+        self.pk_field = relation.get_queryset().model._meta.pk
+        self.objects = {}
+        self.fetched = set()
+
+        self.to_internal_value = relation.to_internal_value
+        relation.to_internal_value = self
+
+    def collect(self, items):
+        keys = set()
+        for item in items:
+            if not isinstance(item, dict) or item.get(self.field_name) is None:
+                continue
+            values = item[self.field_name]
+            if not self.many:
+                values = [values]
+            elif not isinstance(values, list):
+                continue
+            keys.update(key for key in (_to_key(self.pk_field, value) for value in values) if key is not None)
+        return keys
+
+    def prepare(self, items):
+        keys = self.collect(items)
+        self.objects = self.relation.get_queryset().in_bulk(keys) if keys else {}
+        self.fetched = keys
+
+    def __call__(self, data):
+        key = _to_key(self.pk_field, data)
+        if key is None or key not in self.fetched:
+            return self.to_internal_value(data)
+        if key not in self.objects:
+            self.relation.fail('does_not_exist', pk_value=data)
+        return self.objects[key]
+
+
+class BatchUniqueValidator(UniqueValidator):
+    """
+    批量查询已经存在的唯一值，替换 UniqueValidator 的逐条查询
+    """
+
+    def __init__(self, validator, serializer_field, model_field):
+        super().__init__(validator.queryset, validator.message, validator.lookup)
+        self.serializer_field = serializer_field
+        self.model_field = model_field
+        self.existing = {}
+        self.fetched = set()
+        # 这一批数据中已经校验过的值
+        self.seen = set()
+
+    def prepare(self, items):
+        field_name = self.serializer_field.field_name
+        keys = set()
+        for item in items:
+            if not isinstance(item, dict) or item.get(field_name) is None:
+                continue
+            try:
+                value = self.serializer_field.to_internal_value(item[field_name])
+            except serializers.ValidationError:
+                continue
+            key = _to_key(self.model_field, value)
+            if key is not None:
+                keys.add(key)
+
+        self.existing = {}
+        if keys:
+            name = self.model_field.name
+            rows = self.queryset.filter(**{f'{name}__in': keys}).values_list(name, 'pk')
+            for value, pk in rows:
+                self.existing.setdefault(value, set()).add(pk)
+        self.fetched = keys
+        self.seen = set()
+
+    def __call__(self, value, serializer_field):
+        key = _to_key(self.model_field, value)
+        if key is None or key not in self.fetched:
+            return super().__call__(value, serializer_field)
+
+        instance = getattr(serializer_field.parent, 'instance', None)
+        pks = self.existing.get(key, set())
+        if instance is not None:
+            pks = pks - {instance.pk}
+        if pks or key in self.seen:
+            raise serializers.ValidationError(self.message, code='unique')
+        self.seen.add(key)
+
+
+class BatchValidation:
+    """
+    一个表单实例的批量校验，每校验一批数据之前调用 prepare
+    """
+
+    def __init__(self, form):
+        self.lookups = []
+        for name, field in form.fields.items():
+            if field.read_only:
+                continue
+
+            many = isinstance(field, ManyRelatedField)
+            relation = field.child_relation if many else field
+            if (
+                isinstance(relation, PrimaryKeyRelatedField)
+                and type(relation).to_internal_value is PrimaryKeyRelatedField.to_internal_value
+                and relation.pk_field is None
+            ):
+                self.lookups.append(BatchRelatedLookup(name, relation, many))
+                continue
+
+            if isinstance(field, (RelatedField, ManyRelatedField)) or not field.source_attrs:
+                continue
+            validators = []
+            for validator in field.validators:
+                if type(validator) is UniqueValidator and validator.lookup == 'exact':
+                    model_field = meta.get_field(validator.queryset.model, field.source_attrs[-1])
+                    if model_field is None or not model_field.concrete:
+                        validators.append(validator)
+                        continue
+                    validator = BatchUniqueValidator(validator, field, model_field)
+                    self.lookups.append(validator)
+                validators.append(validator)
+            field.validators = validators
+
+    def prepare(self, items):
+        """预取一批数据需要的外键对象和已经存在的唯一值"""
+        for lookup in self.lookups:
+            lookup.prepare(items)
@@ -1,17 +1,33 @@
 import inspect
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings as django_settings
+from django.db import transaction
+from django.shortcuts import get_object_or_404
 
 from rest_framework import viewsets
+from rest_framework.permissions import BasePermission
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
 
+from fairyspace import const
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.core import exception
 from fairyspace.rest import mixins
+from fairyspace.rest.filters import FairyFilterBackend
 from fairyspace.rest.instance import FairyInstance
 from fairyspace.rest.form import FairyFormMixin
-from fairyspace.rest.pagination import PageNumberPagination
-from fairyspace.rest.serializer import create_dynamic_serializer_class
+from fairyspace.rest.instrument import QueryRecorder
+from fairyspace.rest.pagination import KeysetPagination, PageNumberPagination
+from fairyspace.rest.plan import compile_values_plan
+from fairyspace.rest.planner import get_query_plan
+from fairyspace.rest.serializer import get_dynamic_serializer_class
 
 from fairyspace.utils import module
 
+logger = logging.getLogger(__name__)
+
 
 class FairyGenericViewSet(
     mixins.FairyMixin,
@@ -20,6 +36,8 @@ class FairyGenericViewSet(
 ):
 
     pagination_class = PageNumberPagination
+    keyset_pagination_class = KeysetPagination
+    filter_backends = [FairyFilterBackend]
 
     def _get_user_custom_config_classes(self, classes_name):
         """
@@ -68,6 +86,87 @@ class FairyGenericViewSet(
     def get_throttles(self):
         return self._get_class_instances('throttle_classes')
 
+    def dispatch(self, request, *args, **kwargs):
+        """
+        记录请求执行的 SQL，在 finalize_response 中检查查询预算和 N+1 查询
+
+        没有开启 QUERY_INSTRUMENTATION 时，动作声明了查询预算才会在 initial 中开始记录，
+        预算在加载配置声明之后才能确定，认证和权限检查的查询不计入
+        """
+        instrumentation = fairy_space_settings.QUERY_INSTRUMENTATION
+        if instrumentation is None:
+            instrumentation = django_settings.DEBUG
+
+        with ExitStack() as self.fairy_query_stack:
+            if instrumentation:
+                self.fairy_record_queries()
+            return super().dispatch(request, *args, **kwargs)
+
+    def fairy_record_queries(self):
+        """开始记录 SQL，记录到请求结束为止"""
+        self.fairy_query_recorder = QueryRecorder()
+        # 超过预算抛出异常时，需要回滚请求中的写入，事务在记录之外开启，保存点不计入查询数量
+        if fairy_space_settings.QUERY_BUDGET_ACTION == 'raise':
+            self.fairy_query_stack.enter_context(transaction.atomic())
+        self.fairy_query_stack.enter_context(self.fairy_query_recorder.record())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """检查查询预算，超过预算的异常和其他异常一样交给 handle_exception 处理"""
+        recorder = getattr(self, 'fairy_query_recorder', None)
+        if recorder is not None:
+            try:
+                self.fairy_check_queries(recorder, response)
+            except exception.FairySpaceException as exc:
+                transaction.set_rollback(True)
+                response = self.handle_exception(exc)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def fairy_get_query_budget(self):
+        """
+        获取查询预算，依次查找
+
+        - 动作处理器上通过 fairyaction 声明的 query_budget
+        - Statements 中声明的 query_budget，为字典时按照动作名称获取
+        """
+        fairy_instance = getattr(self, FairyInstance.instance_namespace, None)
+        if fairy_instance is None:
+            return
+
+        budget = getattr(fairy_instance.custom_action_handler, const.FAIRY_STATEMENT_QUERY_BUDGET, None)
+        if budget is None:
+            budget = getattr(fairy_instance.statement_class, const.FAIRY_STATEMENT_QUERY_BUDGET, None)
+        if isinstance(budget, dict):
+            budget = budget.get(getattr(self, 'action', None))
+        return budget
+
+    def fairy_check_queries(self, recorder, response):
+        """
+        检查请求执行的 SQL
+
+        - 重复执行的 SQL 指纹记录告警日志
+        - 超过查询预算时记录日志或者抛出异常
+        - 调试模式下，在返回的数据中添加 queries 汇总信息
+        """
+        threshold = fairy_space_settings.N_PLUS_ONE_THRESHOLD
+        summary = recorder.summary(threshold)
+        action = getattr(self, 'action', None)
+        view_name = f'{self.__class__.__name__}.{action}'
+
+        for item in summary['repeated']:
+            logger.warning('fairyspace possible N+1 in %s: %s queries of %s', view_name, item['count'], item['sql'])
+
+        budget = self.fairy_get_query_budget()
+        if budget is not None and recorder.count > budget:
+            if fairy_space_settings.QUERY_BUDGET_ACTION == 'raise':
+                raise exception.FairySpaceException(
+                    error_code=exception.FAIRY_QUERY_BUDGET_EXCEEDED,
+                    error_data={'budget': budget, **summary},
+                )
+            logger.warning('fairyspace query budget exceeded in %s: %s > %s', view_name, recorder.count, budget)
+
+        if django_settings.DEBUG and isinstance(getattr(response, 'data', None), dict):
+            response.data['queries'] = summary
+
     def initialize_request(self, request, *args, **kwargs):
         FairyInstance.set_namespace_instance(self)
         return super().initialize_request(request, *args, **kwargs)
@@ -95,6 +194,11 @@ class FairyGenericViewSet(
 
         # 获取配置声明
         self.fairy_get_statements()
+        # 声明了查询预算时，即使没有开启 QUERY_INSTRUMENTATION 也需要记录 SQL
+        if getattr(self, 'fairy_query_recorder', None) is None and self.fairy_get_query_budget() is not None:
+            self.fairy_record_queries()
+        # 获取导出配置
+        self.fairy_get_export_config(request, *args, **kwargs)
         # 处理扩展字段
         self.fairy_get_expand_fields(request, *args, **kwargs)
 
@@ -111,27 +215,93 @@ class FairyGenericViewSet(
     def get_queryset(self):
         """动态的计算结果集
 
-        处理扩展字段，然后 prefetch_related
+        处理扩展字段，根据关系的基数规划 select_related 和 prefetch_related，
+        读取数据的动作还会根据展示字段裁剪查询的列
 
         - 如果是展开字段，这里做好是否关联查询
         """
         queryset = self.fairy_instance.model.objects.all()
-        transform_expand_fields = self.fairy_instance.transform_expand_fields
-
-        if transform_expand_fields:
-            # 把处理后的扩展字段替换 __ 然后进行 prefetch_related 操作
-            field_list = [item.replace('.', '__') for item in transform_expand_fields]
-            queryset = queryset.prefetch_related(*field_list)
+        query_plan = self.fairy_get_query_plan()
+        if query_plan:
+            queryset = query_plan.apply(queryset)
         return queryset
 
+    def fairy_get_query_plan(self):
+        """
+        获取展开字段的查询计划，计划会保存到对象空间中，可以通过 explain() 查看
+
+        只有内置的读取动作才会裁剪查询的列，自定义的动作处理器可能会访问展示字段之外的字段
+        """
+        if self.fairy_instance.query_plan is None:
+            prune = self.action in const.FAIRY_INNER_READ_ACTIONS and not self.fairy_instance.custom_action_handler
+            self.fairy_instance.query_plan = get_query_plan(
+                self.fairy_instance.model,
+                self.fairy_instance.transform_expand_fields,
+                display_fields=self.fairy_instance.display_fields,
+                prune=prune,
+            )
+        return self.fairy_instance.query_plan
+
+    @property
+    def paginator(self):
+        """
+        分页对象，调用端命名空间或者 Statements 中指定 pagination 为 keyset 时使用游标分页
+        """
+        if not hasattr(self, '_paginator'):
+            pagination = self.fairy_instance.request_namespace.get(const.FAIRY_CALLER_PAGINATION)
+            if not pagination:
+                pagination = getattr(self.fairy_instance.statement_class, const.FAIRY_STATEMENT_PAGINATION, None)
+
+            if pagination == const.FAIRY_CALLER_PAGINATION_KEYSET:
+                pagination_class = self.keyset_pagination_class
+            else:
+                pagination_class = self.pagination_class
+            self._paginator = pagination_class() if pagination_class else None
+        return self._paginator
+
     def get_serializer_class(self):
-        """动态的获取序列化类"""
-        return create_dynamic_serializer_class(
+        """动态的获取序列化类，相同形状的请求复用同一个序列化类"""
+        return get_dynamic_serializer_class(
             model=self.fairy_instance.model,
             action=self.action,
             display_fields=self.fairy_instance.display_fields,
         )
 
+    def fairy_get_values_plan(self, detail=False):
+        """
+        获取扁平字段的执行计划
+
+        展示字段都是真实存在的列时，返回对应的执行计划，否则返回 None，走正常的序列化流程
+
+        检索单个对象时，对象级别的权限检查需要模型实例，所以只有全部权限类都没有重写
+        has_object_permission 时才能使用
+        """
+        if not fairy_space_settings.VALUES_FAST_PATH:
+            return
+
+        if detail:
+            for permission in self.get_permissions():
+                if type(permission).has_object_permission is not BasePermission.has_object_permission:
+                    return
+
+        return compile_values_plan(self.get_serializer())
+
+    def fairy_get_values_object(self, values_plan):
+        """
+        通过扁平字段的执行计划获取单个对象，逻辑和 get_object 一致，返回的是 values_list 的单行数据
+        """
+        queryset = values_plan.apply(self.filter_queryset(self.get_queryset()))
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        filter_kwargs = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        return get_object_or_404(queryset, **filter_kwargs)
+
+    def fairy_serialize(self, objects, values_plan=None, many=True):
+        """序列化数据，存在扁平字段的执行计划时，直接执行计划"""
+        if values_plan is not None:
+            return values_plan.execute_many(objects) if many else values_plan.execute(objects)
+        return self.get_serializer(objects, many=many).data
+
 
 class FairyReadOnlyModelViewSet(
     mixins.FairyRetrieveModelMixin,
@@ -151,11 +321,18 @@ class FairyModelViewSet(
     mixins.FairyRetrieveModelMixin,
     mixins.FairyPostRetrieveModelMixin,
     mixins.FairyDestroyModelMixin,
+    mixins.FairyDestroyManyModelMixin,
     mixins.FairyListModelMixin,
     mixins.FairyPostListModelMixin,
+    mixins.FairyAggregateModelMixin,
+    mixins.FairyExportModelMixin,
     mixins.FairyCreateModelMixin,
     mixins.FairyUpdateModelMixin,
     mixins.FairyPutPartialUpdateModelMixin,
+    mixins.FairyBulkModelMixin,
+    mixins.FairyImportModelMixin,
+    mixins.FairyIncrementModelMixin,
+    mixins.FairyManyToManyLinkMixin,
     mixins.FairyCloudFuncMixin,
     mixins.FairyBatchHandleMixin,
     FairyGenericViewSet,
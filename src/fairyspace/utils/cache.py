@@ -0,0 +1,90 @@
+"""
+进程内缓存工具
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    有界的 LRU 缓存，带命中、未命中和淘汰计数
+
+    主要用来缓存按"形状"构建出来的对象（例如动态序列化类），这些对象构建
+    代价高，但是同样的形状会被反复请求
+
+    cache = LRUCache(maxsize=128)
+    value = cache.get_or_create(key, lambda: build())
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """获取缓存值，命中时会把对应的键移动到最近使用的位置"""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """设置缓存值，超出容量时淘汰最久未使用的键"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_create(self, key, factory):
+        """
+        获取缓存值，不存在时调用 factory 构建并写入缓存
+
+        注意：factory 在锁外执行，并发时同一个键可能会被构建多次，但最终只会保留一份
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+
+        value = factory()
+
+        with self._lock:
+            if key in self._data:
+                return self._data[key]
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        """清空缓存以及计数"""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        """缓存统计信息"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
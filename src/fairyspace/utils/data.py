@@ -48,6 +48,56 @@ def generate_nest_dict(fields):
     return tree_dict
 
 
+# 展开关系的字典形式中，展示字段对应的键
+EXPAND_FIELDS_KEY = 'fields'
+# 展开关系的字典形式中，支持的选项
+EXPAND_OPTION_KEYS = ('limit', 'ordering', 'total')
+# 展开关系的总数输出时使用的后缀，例如 students 的总数输出为 students_total
+EXPAND_TOTAL_SUFFIX = '_total'
+
+
+class NestFieldDict(dict):
+    """
+    嵌套的字段字典，options 为展开关系的选项，例如 {'limit': 5, 'ordering': ['-id'], 'total': True}
+    """
+
+    def __init__(self, *args, options=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.options = options or {}
+
+
+class ExpandTotalField(str):
+    """
+    嵌套字段字典中，展开关系总数的叶子节点，值为输出的键，relation 为对应的关系名称
+    """
+
+    def __new__(cls, relation):
+        instance = super().__new__(cls, f'{relation}{EXPAND_TOTAL_SUFFIX}')
+        instance.relation = relation
+        return instance
+
+    def __reduce__(self):
+        return self.__class__, (self.relation,)
+
+
+def split_expand_value(value):
+    """
+    拆分展开关系的值，展开关系支持两种写法：
+
+    - 列表：{'students': ['id', 'name']}
+    - 字典：{'students': {'fields': ['id', 'name'], 'limit': 5, 'ordering': ['-id'], 'total': True}}
+
+    Returns:
+        tuple (展示字段列表，选项字典)，值不是展开关系时返回 (None, None)
+    """
+    if isinstance(value, list):
+        return value, {}
+    if isinstance(value, dict):
+        options = {key: value[key] for key in EXPAND_OPTION_KEYS if key in value}
+        return value.get(EXPAND_FIELDS_KEY) or [], options
+    return None, None
+
+
 def get_prefetch_fields(field_list=None):
     """获取 prefetch_related 字段
 
@@ -71,8 +121,12 @@ def get_prefetch_fields(field_list=None):
                 for key, value in item.items():
                     connect_key = f'{relation_key}.{key}' if relation_key else key
                     line(f'connect_key: {connect_key}')
-                    if isinstance(value, list):
-                        clean_fields(value, connect_key)
+                    fields, options = split_expand_value(value)
+                    if fields is not None:
+                        clean_fields(fields, connect_key)
+                    # 带有选项的展开关系，即使没有展示字段也需要预取
+                    if options:
+                        prefetch_keys.add(connect_key)
             elif relation_key:
                 prefetch_keys.add(relation_key)
 
@@ -98,13 +152,25 @@ def generate_nest_field_dict(data, result=None):
             }
         }
     }
+
+    展开关系使用字典的写法时，选项保存在嵌套字典的 options 中，需要返回总数时，会添加
+    ExpandTotalField 类型的叶子节点，例如 {'user': {'fields': ['ss'], 'total': True}} 处理成
+
+    {
+        'user': {'ss': 'ss'},
+        'user_total': 'user_total',
+    }
     """
     result = {} if result is None else result
     for item in data:
         if isinstance(item, dict):
             for key, value in item.items():
-                result[key] = {}
-                generate_nest_field_dict(value, result[key])
+                fields, options = split_expand_value(value)
+                result[key] = NestFieldDict(options=options)
+                generate_nest_field_dict(fields or [], result[key])
+                if options and options.get('total'):
+                    total_field = ExpandTotalField(key)
+                    result[str(total_field)] = total_field
         else:
             result[item] = item
     return result
@@ -175,3 +241,24 @@ def get_data_from_dict(out_data, key):
 
     inner_hand(out_data, 0)
     return result
+
+
+def freeze_fields(data):
+    """
+    把 display_fields 转换成可哈希的规范形式，用作缓存键
+
+    列表和元组保留顺序（顺序决定了序列化输出字段的顺序），字典按键值对保留顺序，
+    集合不保证顺序，所以转换成 frozenset
+
+    ['id', {'user': ['name']}] 会转换成 ('id', (('user', ('name',)),))
+
+    如果包含不可哈希的数据，则抛出 TypeError
+    """
+    if isinstance(data, (list, tuple)):
+        return tuple(freeze_fields(item) for item in data)
+    if isinstance(data, dict):
+        return (tuple((key, freeze_fields(value)) for key, value in data.items()),)
+    if isinstance(data, (set, frozenset)):
+        return frozenset(freeze_fields(item) for item in data)
+    hash(data)
+    return data
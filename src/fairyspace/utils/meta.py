@@ -1,7 +1,157 @@
 """
 涉及到 model._meta 相关的工具方法
+
+模型的元数据在进程启动后就不会再变化，所以每个模型的元数据只分析一次，构建成索引
+（ModelMetaIndex），后续的工具方法都从索引中读取，不再每次扫描 _meta.get_fields()
 """
 
+import inspect
+import threading
+
+from django.apps import apps
+
+
+class ModelMetaIndex:
+    """
+    单个模型的元数据索引
+
+    - 字段名称（包含 attname 和反向字段名称）和字段的映射
+    - 反向字段 accessor name 和字段的映射
+    - 各种分类的字段列表
+    - 关系字段的类型
+    - 指向其他模型的真实关系字段
+    - fairyproperty 计算属性
+    """
+
+    # 关系字段的类型
+    FORWARD_FK = 'forward_fk'
+    FORWARD_O2O = 'forward_o2o'
+    FORWARD_M2M = 'forward_m2m'
+    REVERSE_FK = 'reverse_fk'
+    REVERSE_O2O = 'reverse_o2o'
+    REVERSE_M2M = 'reverse_m2m'
+
+    def __init__(self, model):
+        self.model = model
+        opts = model._meta
+
+        fields = opts.get_fields()
+
+        # 和 _meta.get_field 一样，包含隐藏的反向字段和 attname
+        self.field_map = {}
+        for field in opts.get_fields(include_hidden=True):
+            self.field_map.setdefault(field.name, field)
+            attname = getattr(field, 'attname', None)
+            if attname:
+                self.field_map.setdefault(attname, field)
+
+        self.virtual_relation_fields = tuple(item for item in fields if is_virtual_relation_field(item))
+        self.concrete_relation_fields = tuple(item for item in fields if is_concrete_relation_field(item))
+        self.concrete_fields = tuple(item for item in fields if item.concrete)
+        self.all_relation_fields = tuple(item for item in fields if is_relation_field(item))
+
+        # 反向字段的 accessor name，例如没有指定 related_name 时的 b_set
+        self.accessor_map = {}
+        for field in self.virtual_relation_fields:
+            accessor_name = get_accessor_name(field)
+            if accessor_name:
+                self.accessor_map.setdefault(accessor_name, field)
+
+        # 关系字段的类型，键同时包含字段名称和 accessor name
+        self.relation_kinds = {}
+        for field in self.all_relation_fields:
+            self.relation_kinds[field.name] = get_relation_kind(field)
+        for accessor_name, field in self.accessor_map.items():
+            self.relation_kinds.setdefault(accessor_name, get_relation_kind(field))
+
+        # 指向其他模型的真实关系字段，同一个模型被多个字段引用时，取第一个
+        self.related_model_fields = {}
+        for field in self.concrete_relation_fields:
+            self.related_model_fields.setdefault(field.related_model, field)
+
+        self.fairy_property_fields = scan_fairy_property_fields(model)
+
+    def get_field(self, field_name):
+        """通过字段名称或者 accessor name 获取字段，找不到时返回 None"""
+        field = self.field_map.get(field_name)
+        if field is None:
+            field = self.accessor_map.get(field_name)
+        return field
+
+    def get_relation_kind(self, field_name):
+        """获取关系字段的类型，不是关系字段时返回 None"""
+        return self.relation_kinds.get(field_name)
+
+    def is_many(self, field_name):
+        """关系字段是否是多值的，即一对多或者多对多"""
+        return self.relation_kinds.get(field_name) in (self.FORWARD_M2M, self.REVERSE_FK, self.REVERSE_M2M)
+
+
+# 模型元数据索引缓存
+_model_index_cache = {}
+_model_index_lock = threading.Lock()
+
+
+def get_model_index(model):
+    """
+    获取模型的元数据索引
+
+    只有在全部应用加载完成后才会缓存，应用加载过程中获取的索引不缓存，因为此时模型的
+    反向关系可能还没有全部注册
+    """
+    index = _model_index_cache.get(model)
+    if index is not None:
+        return index
+
+    index = ModelMetaIndex(model)
+    if apps.ready:
+        with _model_index_lock:
+            index = _model_index_cache.setdefault(model, index)
+    return index
+
+
+def build_model_indexes():
+    """为全部已注册的模型构建元数据索引，在应用加载完成后调用"""
+    for model in apps.get_models():
+        get_model_index(model)
+
+
+def clear_model_indexes():
+    """清空模型元数据索引缓存"""
+    with _model_index_lock:
+        _model_index_cache.clear()
+
+
+def scan_fairy_property_fields(model):
+    """
+    扫描模型中使用 fairyproperty 装饰的方法列表
+
+    注意：这里会调用 inspect.getmembers，代价比较高，应该通过索引中的 fairy_property_fields 获取
+    """
+    result = {}
+
+    for name, method in inspect.getmembers(model, predicate=inspect.ismethoddescriptor):
+        if not name.startswith('__') and getattr(method, 'is_fairy_property_field', False):
+            result[name] = method
+    return result
+
+
+def get_relation_kind(field):
+    """
+    获取关系字段的类型
+
+    TAG: 元工具函数
+    """
+    if not field.is_relation:
+        return
+    if field.concrete:
+        if field.many_to_many:
+            return ModelMetaIndex.FORWARD_M2M
+        return ModelMetaIndex.FORWARD_O2O if field.one_to_one else ModelMetaIndex.FORWARD_FK
+    if field.many_to_many:
+        return ModelMetaIndex.REVERSE_M2M
+    return ModelMetaIndex.REVERSE_O2O if field.one_to_one else ModelMetaIndex.REVERSE_FK
+
 
 def get_accessor_name(field):
     """
@@ -78,14 +228,66 @@ def get_field(model, field_name):
 
     通过反向字段计算 accessor_name 进行比对，获取对应的字段
     """
-    try:
-        return model._meta.get_field(field_name)
-    except Exception:
-        # 如果找不到，则到反向字段中进行寻找
-        for field in get_virtual_relation_fields(model):
-            related_name = get_accessor_name(field)
-            if related_name == field_name:
-                return field
+    # 找不到时，到反向字段的 accessor name 中进行寻找
+    return get_model_index(model).get_field(field_name)
+
+
+def resolve_single_path(model, field_path):
+    """
+    解析点号连接的字段路径，路径中只能经过单值的关系（外键和一对一）
+
+    路径以关系字段结尾时，使用的是关联对象的主键
+
+    Params:
+        model 模型类
+        field_path str 点号连接的字段路径，例如 school.name
+
+    Returns:
+        tuple (ORM 查询路径，最后一段的字段)
+
+    Raises:
+        ValueError 路径不合法时抛出，异常信息为原因
+    """
+    segments = field_path.split('.') if isinstance(field_path, str) else []
+    if not segments or not all(segments):
+        raise ValueError('字段不合法')
+
+    query = []
+    for index, name in enumerate(segments):
+        field = get_field(model, name)
+        if field is None:
+            raise ValueError('字段不存在')
+
+        is_last = index == len(segments) - 1
+        if not is_relation_field(field):
+            if not is_last:
+                raise ValueError('字段不是关系字段')
+            query.append(field.name)
+            return '__'.join(query), field
+
+        if get_model_index(model).is_many(name):
+            raise ValueError('字段不能经过一对多或者多对多关系')
+
+        query.append(field.name)
+        model = field.related_model
+        if is_last:
+            pk = model._meta.pk
+            query.append(pk.name)
+            return '__'.join(query), pk
+
+
+def get_reverse_query_name(field):
+    """
+    关系字段，从关联模型反查回当前模型时使用的查询名称
+
+    - 反向外键、反向一对一和反向多对多：关联模型上真实的字段名称
+    - 正向外键、正向一对一和正向多对多：关联模型上的反向查询名称
+
+    TAG: 元工具函数
+    """
+    if is_virtual_relation_field(field):
+        return field.field.name
+    return field.related_query_name()
 
 
 def get_field_by_reverse_field(field):
@@ -104,10 +306,7 @@ def get_related_model_field(model, related_model):
 
     TODO: 如果单个模型中有两个字段同时引用了同一个模型，这里就会存在问题
     """
-    for field in model._meta.get_fields():
-        if field.is_relation and field.concrete:
-            if field.related_model is related_model:
-                return field
+    return get_model_index(model).related_model_fields.get(related_model)
 
 
 def get_concrete_relation_field_by_name(model, field_name):
@@ -124,14 +323,14 @@ def get_virtual_relation_fields(model):
     """
     获取模型所有的反向关系字段
     """
-    return [item for item in model._meta.get_fields() if is_virtual_relation_field(item)]
+    return get_model_index(model).virtual_relation_fields
 
 
 def get_concrete_relation_fields(model):
     """
     获取模型正向所有真实的关系字段
     """
-    return [item for item in model._meta.get_fields() if is_concrete_relation_field(item)]
+    return get_model_index(model).concrete_relation_fields
 
 
 def get_concrete_relation_field(model, field_name):
@@ -144,24 +343,27 @@ def get_concrete_relation_field(model, field_name):
     Returns:
         field object 字段对象
     """
-    try:
-        field = model._meta.get_field(field_name)
-
-        if is_concrete_relation_field(field):
-            return field
-    except Exception:
-        return
+    field = get_model_index(model).field_map.get(field_name)
+    if field is not None and is_concrete_relation_field(field):
+        return field
 
 
 def get_concrete_fields(model):
     """
     获取真实存在的字段，包含关系字段和非关系字段
     """
-    return [item for item in model._meta.get_fields() if item.concrete]
+    return get_model_index(model).concrete_fields
 
 
 def get_all_relation_fields(model):
     """
     获取所有的关系字段，包含真实关系字段和虚拟关系字段
     """
-    return [item for item in model._meta.get_fields() if is_relation_field(item)]
+    return get_model_index(model).all_relation_fields
+
+
+def get_fairy_property_fields(model):
+    """
+    获取模型中使用 fairyproperty 装饰的方法列表
+    """
+    return get_model_index(model).fairy_property_fields
@@ -1,7 +1,7 @@
 import factory
 from factory.django import DjangoModelFactory
 from django.utils import timezone
-from .models import School, Course, Teacher, ClassRoom, Student, StudentCard, Backpack
+from .models import School, Course, Teacher, ClassRoom, Student, StudentCard, Backpack, Notice
 
 
 class SchoolFactory(DjangoModelFactory):
@@ -72,3 +72,11 @@ class BackpackFactory(DjangoModelFactory):
     size = factory.Faker('random_element', elements=['S', 'M', 'L', 'XL'])
     purchase_date = factory.Faker('date_this_year')
     is_damaged = factory.Faker('boolean', chance_of_getting_true=10)
+
+
+class NoticeFactory(DjangoModelFactory):
+    class Meta:
+        model = Notice
+
+    school = factory.SubFactory(SchoolFactory)
+    title = factory.Faker('sentence')
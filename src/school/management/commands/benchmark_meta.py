@@ -0,0 +1,82 @@
+import inspect
+import timeit
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from fairyspace.utils import meta
+
+
+def scan_get_field(model, field_name):
+    """索引之前的实现：找不到字段时线性扫描反向字段"""
+    try:
+        return model._meta.get_field(field_name)
+    except Exception:
+        for field in model._meta.get_fields():
+            if field.is_relation and not field.concrete and field.get_accessor_name() == field_name:
+                return field
+
+
+def scan_related_model_field(model, related_model):
+    for field in model._meta.get_fields():
+        if field.is_relation and field.concrete and field.related_model is related_model:
+            return field
+
+
+def scan_concrete_relation_fields(model):
+    return [item for item in model._meta.get_fields() if item.is_relation and item.concrete]
+
+
+def scan_fairy_property_fields(model):
+    result = {}
+    for name, method in inspect.getmembers(model, predicate=inspect.ismethoddescriptor):
+        if not name.startswith('__') and getattr(method, 'is_fairy_property_field', False):
+            result[name] = method
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks model metadata lookups before and after the metadata index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=10000, help='Number of lookups per case')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        School = apps.get_model('school', 'School')
+        Student = apps.get_model('school', 'Student')
+        User = apps.get_model('auth', 'User')
+
+        cases = [
+            (
+                'get_field(School, "classroom_set")',
+                lambda: scan_get_field(School, 'classroom_set'),
+                lambda: meta.get_field(School, 'classroom_set'),
+            ),
+            (
+                'get_field(Student, "name")',
+                lambda: scan_get_field(Student, 'name'),
+                lambda: meta.get_field(Student, 'name'),
+            ),
+            (
+                'get_related_model_field(Student, User)',
+                lambda: scan_related_model_field(Student, User),
+                lambda: meta.get_related_model_field(Student, User),
+            ),
+            (
+                'get_concrete_relation_fields(Student)',
+                lambda: scan_concrete_relation_fields(Student),
+                lambda: meta.get_concrete_relation_fields(Student),
+            ),
+            (
+                'get_fairy_property_fields(School)',
+                lambda: scan_fairy_property_fields(School),
+                lambda: meta.get_fairy_property_fields(School),
+            ),
+        ]
+
+        self.stdout.write(f'{"lookup":<42}{"before (us)":>14}{"after (us)":>14}{"speedup":>10}')
+        for name, before, after in cases:
+            before_cost = min(timeit.repeat(before, number=number, repeat=3)) / number * 1e6
+            after_cost = min(timeit.repeat(after, number=number, repeat=3)) / number * 1e6
+            self.stdout.write(f'{name:<42}{before_cost:>14.3f}{after_cost:>14.3f}{before_cost / after_cost:>9.1f}x')
@@ -0,0 +1,129 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:13
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school', '0003_backpack'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='backpack',
+            options={'verbose_name': '书包', 'verbose_name_plural': '书包'},
+        ),
+        migrations.AlterModelOptions(
+            name='classroom',
+            options={'verbose_name': '班级', 'verbose_name_plural': '班级'},
+        ),
+        migrations.AlterModelOptions(
+            name='course',
+            options={'verbose_name': '课程', 'verbose_name_plural': '课程'},
+        ),
+        migrations.AlterModelOptions(
+            name='school',
+            options={'verbose_name': '学校', 'verbose_name_plural': '学校'},
+        ),
+        migrations.AlterModelOptions(
+            name='studentcard',
+            options={'verbose_name': '学生卡', 'verbose_name_plural': '学生卡'},
+        ),
+        migrations.AlterModelOptions(
+            name='teacher',
+            options={'verbose_name': '教师', 'verbose_name_plural': '教师'},
+        ),
+        migrations.AddField(
+            model_name='backpack',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='backpack',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='classroom',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='classroom',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='teacher',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='teacher',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='classroom',
+            name='name',
+            field=models.CharField(max_length=50, verbose_name='班级名称'),
+        ),
+        migrations.AlterField(
+            model_name='course',
+            name='name',
+            field=models.CharField(max_length=100, verbose_name='课程名称'),
+        ),
+        migrations.AlterField(
+            model_name='student',
+            name='name',
+            field=models.CharField(max_length=100, verbose_name='学生姓名'),
+        ),
+        migrations.AlterField(
+            model_name='teacher',
+            name='name',
+            field=models.CharField(max_length=100, verbose_name='教师姓名'),
+        ),
+        migrations.AddIndex(
+            model_name='classroom',
+            index=models.Index(fields=['school', 'name'], name='school_clas_school__641ac6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['code'], name='school_cour_code_c7f1bd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='school',
+            index=models.Index(fields=['name'], name='school_scho_name_0a7aed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teacher',
+            index=models.Index(fields=['name'], name='school_teac_name_c5c9ae_idx'),
+        ),
+    ]
@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+from fairyspace.rest.decorator import fairyproperty
+
 
 class School(models.Model):
     name = models.CharField(max_length=100)
@@ -10,6 +13,12 @@ class School(models.Model):
     def __str__(self):
         return self.name
 
+    @fairyproperty('学生数量', 'Integer', batch=True, depends=[])
+    def student_count(instances):
+        queryset = Student.objects.filter(school__in=instances).values('school').annotate(count=models.Count('id'))
+        counts = dict(queryset.values_list('school', 'count'))
+        return {item.pk: counts.get(item.pk, 0) for item in instances}
+
     class Meta:
         verbose_name = _('学校')
         verbose_name_plural = _('学校')
@@ -155,3 +164,19 @@ class Backpack(BaseModel):
     class Meta:
         verbose_name = _('书包')
         verbose_name_plural = _('书包')
+
+
+class Notice(BaseModel):
+    # ❎ 通知和学校的一对多关系，related_name 为 '+'，学校上没有反向关系
+    school = models.ForeignKey(School, on_delete=models.CASCADE, related_name='+')
+    title = models.CharField(max_length=100, verbose_name=_('通知标题'))
+    code = models.CharField(max_length=20, unique=True, null=True, blank=True)
+    # 发布通知的用户，通过 user_pip_config 自动插入
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+
+    def __str__(self):
+        return self.title
+
+    class Meta:
+        verbose_name = _('通知')
+        verbose_name_plural = _('通知')
@@ -0,0 +1,420 @@
+import csv
+import datetime
+import io
+import json
+import os
+import pickle
+import tempfile
+import unittest
+from concurrent.futures import Future
+from types import SimpleNamespace
+from unittest import mock
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from django.core.management import call_command
+from django.db import models
+from django.db.models import signals
+from django.utils import timezone
+
+from rest_framework.test import APITestCase
+
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.core import exception
+from fairyspace.rest.count import get_statement_count_strategy
+from fairyspace.rest.deletion import compile_delete_plan
+from fairyspace.rest.plan import ValuesPlan
+from fairyspace.rest.shard import export_sharded
+from school.factories import ClassRoomFactory, SchoolFactory, StudentFactory, TeacherFactory
+from school.models import Course, School, Student
+
+
+class ValuesFastPathTests(APITestCase):
+    """扁平字段通过 values_list 查询的测试"""
+
+    url = '/fairy/client/school/student/list/'
+
+    @classmethod
+    def setUpTestData(cls):
+        school = SchoolFactory()
+        classroom = ClassRoomFactory(school=school, teacher=TeacherFactory(school=school))
+        cls.students = [StudentFactory(classroom=classroom) for _ in range(3)]
+
+    def post_list(self, fields, url=None, fast_path=True):
+        with mock.patch.object(fairy_space_settings, 'VALUES_FAST_PATH', fast_path):
+            response = self.client.post(url or self.url, format='json', data={'fairyspace': {'fields': fields}})
+        self.assertEqual(response.status_code, 200)
+        return response.data['result']
+
+    def test_list_parity(self):
+        fields = ['id', 'name', 'school', 'classroom', 'enrollment_date', 'created_at']
+
+        result = self.post_list(fields)
+        self.assertEqual(result, self.post_list(fields, fast_path=False))
+        self.assertEqual(result[0]['id'], str(self.students[0].pk))
+
+        paginated = self.post_list(fields, url=f'{self.url}?size=2')
+        self.assertEqual(paginated, self.post_list(fields, url=f'{self.url}?size=2', fast_path=False))
+        self.assertEqual(len(paginated['results']), 2)
+
+    def test_retrieve_parity(self):
+        url = f'/fairy/client/school/student/{self.students[1].pk}/retrieve/'
+        fields = ['id', 'name', 'school', 'updated_at']
+        self.assertEqual(self.post_list(fields, url=url), self.post_list(fields, url=url, fast_path=False))
+
+    def test_values_plan(self):
+        from fairyspace.rest.plan import compile_values_plan
+        from fairyspace.rest.serializer import get_dynamic_serializer_class
+
+        flat = get_dynamic_serializer_class(Student, 'list', ['id', 'name', 'school'])()
+        self.assertIsInstance(compile_values_plan(flat), ValuesPlan)
+
+        # 嵌套字段和多对多字段会回退到正常的序列化流程
+        nested = get_dynamic_serializer_class(Student, 'list', ['id', {'school': ['name']}])()
+        self.assertIsNone(compile_values_plan(nested))
+        many = get_dynamic_serializer_class(Student, 'list', ['id', 'teachers'])()
+        self.assertIsNone(compile_values_plan(many))
+
+
+class StreamListTests(APITestCase):
+    """流式列表和不分页时的数据条数上限测试"""
+
+    url = '/fairy/client/school/student/list/'
+
+    @classmethod
+    def setUpTestData(cls):
+        school = SchoolFactory()
+        classroom = ClassRoomFactory(school=school, teacher=TeacherFactory(school=school))
+        for _ in range(5):
+            StudentFactory(classroom=classroom)
+
+    def post_list(self, fields, **namespace):
+        return self.client.post(self.url, format='json', data={'fairyspace': {'fields': fields, **namespace}})
+
+    def test_stream_equal_buffered(self):
+        for fields in (['id', 'name'], ['id', {'school': ['name']}, 'teachers']):
+            buffered = self.post_list(fields)
+            with mock.patch.object(fairy_space_settings, 'STREAM_CHUNK_SIZE', 2):
+                streamed = self.post_list(fields, stream=True)
+
+            self.assertTrue(streamed.streaming)
+            self.assertEqual(b''.join(streamed.streaming_content), buffered.content)
+
+    def test_max_rows(self):
+        with mock.patch.object(fairy_space_settings, 'LIST_MAX_ROWS', 5):
+            self.assertEqual(len(self.post_list(['id']).data['result']), 5)
+
+        with mock.patch.object(fairy_space_settings, 'LIST_MAX_ROWS', 4):
+            with self.assertRaises(exception.FairySpaceException):
+                self.post_list(['id'])
+
+
+class KeysetPaginationTests(APITestCase):
+    """游标分页测试"""
+
+    url = '/fairy/client/school/student/list/'
+
+    @classmethod
+    def setUpTestData(cls):
+        for _ in range(2):
+            school = SchoolFactory()
+            classroom = ClassRoomFactory(school=school, teacher=TeacherFactory(school=school))
+            for _ in range(3):
+                StudentFactory(classroom=classroom)
+
+    def fetch_all(self, fields, **namespace):
+        ids, cursor = [], None
+        while True:
+            query = f'?size=4&cursor={cursor}' if cursor else '?size=4'
+            with self.assertNumQueries(1):
+                response = self.client.post(
+                    f'{self.url}{query}',
+                    format='json',
+                    data={'fairyspace': {'fields': fields, 'pagination': 'keyset', **namespace}},
+                )
+            self.assertEqual(response.data['code'], 0)
+            ids.extend(item['id'] for item in response.data['result']['results'])
+            cursor = response.data['result']['next']
+            if cursor is None:
+                return ids
+            # 游标定位错误时会重复返回数据，避免死循环
+            self.assertLess(len(ids), Student.objects.count())
+
+    def test_pages(self):
+        expected = [str(pk) for pk in Student.objects.order_by('pk').values_list('pk', flat=True)]
+        self.assertEqual(self.fetch_all(['id', 'name']), expected)
+        self.assertEqual(self.fetch_all(['id', {'school': ['name']}]), expected)
+
+        expected = [str(pk) for pk in Student.objects.order_by('-school', '-pk').values_list('pk', flat=True)]
+        self.assertEqual(self.fetch_all(['id', 'name'], ordering=['-school']), expected)
+
+        # 关联模型声明了 Meta.ordering 时，外键仍然按照外键的值排序
+        expected = [str(pk) for pk in Student.objects.order_by('school_id', 'pk').values_list('pk', flat=True)]
+        with mock.patch.object(School._meta, 'ordering', ['-id']):
+            self.assertEqual(self.fetch_all(['id', 'name'], ordering=['school']), expected)
+
+    def test_sub_millisecond_values(self):
+        # 所有数据在同一毫秒内，只有微秒不同，游标截断到毫秒时会重复返回或者跳过数据
+        base = timezone.now().replace(microsecond=0)
+        for position, pk in enumerate(Student.objects.order_by('?').values_list('pk', flat=True)):
+            Student.objects.filter(pk=pk).update(created_at=base + datetime.timedelta(microseconds=100 + position))
+
+        indexes = [*Student._meta.indexes, models.Index(fields=['created_at'])]
+        with mock.patch.object(Student._meta, 'indexes', indexes):
+            for ordering in (['created_at'], ['-created_at']):
+                expected = [str(pk) for pk in Student.objects.order_by(*ordering, 'pk').values_list('pk', flat=True)]
+                self.assertEqual(self.fetch_all(['id'], ordering=ordering), expected)
+
+    def test_invalid(self):
+        for ordering in (['created_at'], ['not_exist'], 'school'):
+            with self.assertRaises(exception.FairySpaceException):
+                self.fetch_all(['id'], ordering=ordering)
+
+        with self.assertRaises(exception.FairySpaceException):
+            self.client.post(
+                f'{self.url}?cursor=invalid',
+                format='json',
+                data={'fairyspace': {'fields': ['id'], 'pagination': 'keyset'}},
+            )
+
+
+class CountStrategyTests(APITestCase):
+    """分页总数计算策略测试"""
+
+    url = '/fairy/client/school/student/list/?size=2'
+
+    @classmethod
+    def setUpTestData(cls):
+        school = SchoolFactory()
+        cls.classroom = ClassRoomFactory(school=school, teacher=TeacherFactory(school=school))
+        for _ in range(3):
+            StudentFactory(classroom=cls.classroom)
+
+    def post_list(self, strategy, queries, url=None):
+        with mock.patch.object(fairy_space_settings, 'COUNT_STRATEGY', strategy):
+            with self.assertNumQueries(queries):
+                response = self.client.post(url or self.url, format='json', data={'fairyspace': {'fields': ['id']}})
+        return response.data['result']
+
+    def test_exact_and_estimated(self):
+        result = self.post_list('exact', 2)
+        self.assertEqual((result['count'], result['count_strategy']), (3, 'exact'))
+
+        # SQLite 不支持估算，回退到精确计数
+        result = self.post_list('estimated', 2)
+        self.assertEqual((result['count'], result['count_strategy']), (3, 'exact'))
+
+    def test_none(self):
+        result = self.post_list('none', 1)
+        self.assertEqual((result['count'], result['count_strategy']), (None, 'none'))
+        self.assertEqual(len(result['results']), 2)
+        self.assertIn('page=2', result['next'])
+
+        result = self.post_list('none', 1, url=f'{self.url}&page=2')
+        self.assertEqual(len(result['results']), 1)
+        self.assertIsNone(result['next'])
+
+    def test_invalid(self):
+        with mock.patch.object(fairy_space_settings, 'COUNT_STRATEGY', 'unknown'):
+            with self.assertRaises(exception.FairySpaceException):
+                self.client.post(self.url, format='json', data={'fairyspace': {'fields': ['id']}})
+
+    def test_cached(self):
+        result = self.post_list('cached', 2)
+        self.assertEqual((result['count'], result['count_strategy']), (3, 'cached'))
+        self.assertEqual(self.post_list('cached', 1)['count'], 3)
+
+        # 使用 cached 策略的模型监听了写入信号，通过 ORM 写入也会使缓存失效
+        student = StudentFactory(classroom=self.classroom)
+        self.assertEqual(self.post_list('cached', 2)['count'], 4)
+        student.delete()
+        self.assertEqual(self.post_list('cached', 2)['count'], 3)
+
+        # 通过接口写入后缓存失效
+        data = {
+            'name': 'student',
+            'classroom': self.classroom.pk,
+            'school': self.classroom.school_id,
+            'enrollment_date': '2024-09-01',
+        }
+        self.client.post('/fairy/client/school/student/', format='json', data={'data': data})
+        self.assertEqual(self.post_list('cached', 2)['count'], 4)
+
+    def test_sender_scoped_signals(self):
+        with mock.patch.object(fairy_space_settings, 'COUNT_STRATEGY', 'cached'):
+            self.client.post(self.url, format='json', data={'fairyspace': {'fields': ['id']}})
+        self.assertTrue(signals.post_save.has_listeners(Student))
+        self.assertTrue(signals.post_delete.has_listeners(Student))
+
+        # 只监听使用 cached 策略的模型，不监听全局信号
+        self.assertFalse(signals.post_save.has_listeners(Course))
+        self.assertFalse(signals.post_delete.has_listeners(Course))
+
+        # 计数缓存的接收函数不影响快速删除
+        self.assertIsNotNone(compile_delete_plan(Student))
+
+    def test_statement_count_strategy(self):
+        # 启动时根据 Statements 中的声明判断哪些模型需要监听写入信号
+        statement_module = SimpleNamespace(CourseClientStatements=type('Statements', (), {'count_strategy': 'cached'}))
+        with mock.patch('fairyspace.rest.count.fairy_load_statement', return_value=(None, statement_module)):
+            self.assertEqual(get_statement_count_strategy('school', Course), {'cached'})
+            self.assertEqual(get_statement_count_strategy('school', Student), {'exact'})
+
+
+class StudentClientStatements:
+    export_config = {
+        'default': {
+            'fields': ['id', 'name', {'school': ['name']}],
+            'filename': 'students',
+            'headers': {'school.name': '学校'},
+        },
+    }
+
+
+class ExportTests(APITestCase):
+    """流式导出测试"""
+
+    url = '/fairy/client/school/student/export/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = SchoolFactory(name='alpha')
+        classroom = ClassRoomFactory(school=cls.school, teacher=TeacherFactory(school=cls.school))
+        cls.students = [StudentFactory(classroom=classroom, name=f's{index}') for index in range(5)]
+
+    def export(self, **namespace):
+        statement_module = SimpleNamespace(StudentClientStatements=StudentClientStatements)
+        with mock.patch('fairyspace.rest.mixins.fairy_load_statement', return_value=(None, statement_module)):
+            with mock.patch.object(fairy_space_settings, 'EXPORT_CHUNK_SIZE', 2):
+                response = self.client.post(self.url, format='json', data={'fairyspace': namespace})
+                if not response.streaming:
+                    return response, None
+                return response, b''.join(response.streaming_content)
+
+    def test_csv(self):
+        response, content = self.export(export='default')
+        self.assertIn('students.csv', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+        self.assertEqual(rows[0], ['id', 'name', '学校'])
+        self.assertEqual(rows[1:], [[str(item.pk), item.name, 'alpha'] for item in self.students])
+
+    def test_ndjson(self):
+        response, content = self.export(fields=['id', 'name'], format='ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(rows, [{'id': str(item.pk), 'name': item.name} for item in self.students])
+
+    def test_invalid(self):
+        for namespace in ({'export': 'missing'}, {'format': 'xml'}):
+            with self.subTest(namespace=namespace):
+                with self.assertRaises(exception.FairySpaceException):
+                    self.export(**namespace)
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow 没有安装')
+    def test_columnar(self):
+        fields = ['id', 'name', 'created_at', {'school': ['name']}]
+        _, content = self.export(fields=fields, format='arrow')
+        table = pyarrow.ipc.open_stream(content).read_all()
+        self.assertEqual(table.column_names, ['id', 'name', 'created_at', 'school.name'])
+        self.assertEqual(table.schema.field('id').type, pyarrow.int64())
+        self.assertEqual(table.num_rows, 5)
+
+        _, content = self.export(fields=fields, format='parquet')
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(content))
+        self.assertEqual(table.column('school.name').to_pylist(), ['alpha'] * 5)
+        self.assertEqual(table.column('id').to_pylist(), [item.pk for item in self.students])
+
+        with self.assertRaises(exception.FairySpaceException):
+            self.export(fields=['id', 'teachers'], format='arrow')
+
+    def test_sharded(self):
+        """分片导出合并之后和流式导出完全一致，调用端不能触发分片导出"""
+        response, content = self.export(export='default', shard=True)
+        self.assertTrue(response.streaming)
+
+        with tempfile.TemporaryDirectory() as directory:
+            settings = {'EXPORT_SHARD_SIZE': 2, 'EXPORT_MAX_WORKERS': 0, 'EXPORT_SHARD_DIR': directory}
+            for export_format in ('csv', 'ndjson'):
+                with self.subTest(export_format=export_format):
+                    _, content = self.export(export='default', format=export_format)
+                    with mock.patch.multiple(fairy_space_settings, **settings):
+                        output = io.StringIO()
+                        call_command(
+                            'fairy_export',
+                            'school.Student',
+                            fields=json.dumps(StudentClientStatements.export_config['default']['fields']),
+                            format=export_format,
+                            headers=json.dumps(StudentClientStatements.export_config['default'].get('headers')),
+                            stdout=output,
+                        )
+                    result = json.loads(output.getvalue())
+                    self.assertEqual([item['rows'] for item in result['shards']], [2, 2, 1])
+                    with open(os.path.join(directory, result['file']), 'rb') as f:
+                        self.assertEqual(f.read(), content)
+
+            progress = []
+            result = export_sharded(
+                Student.objects.all(),
+                ['id'],
+                'ndjson',
+                merge=False,
+                shard_size=3,
+                max_workers=0,
+                directory=directory,
+                progress=lambda done, total, shard: progress.append((done, total)),
+            )
+            self.assertEqual(progress, [(1, 2), (2, 2)])
+            self.assertTrue(all(os.path.exists(item['path']) for item in result['shards']))
+
+    def test_sharded_query_plan(self):
+        """分片导出应用展开字段的查询计划，每个分片的查询数量和数据条数无关"""
+        fields = ['id', {'school': ['name']}, {'teachers': ['name']}]
+        with tempfile.TemporaryDirectory() as directory:
+            # 主键范围一条查询，每个分片一条主查询和一条多对多的预取查询
+            with self.assertNumQueries(1 + 3 * 2):
+                result = export_sharded(
+                    Student.objects.all(), fields, 'ndjson', shard_size=2, max_workers=0, directory=directory
+                )
+            with open(result['file'], 'rb') as f:
+                rows = [json.loads(line) for line in f.read().splitlines()]
+        expected = [{'id': str(item.pk), 'school': {'name': 'alpha'}, 'teachers': []} for item in self.students]
+        self.assertEqual(rows, expected)
+
+    def test_sharded_pool(self):
+        """进程池导出时，分片任务需要能够被序列化传给 spawn 启动的子进程"""
+
+        class PickleExecutor:
+            """在当前进程中执行，任务和结果都经过一次序列化，测试数据库在子进程中不可见"""
+
+            def __init__(self, **kwargs):
+                self.kwargs = kwargs
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                return False
+
+            def submit(self, fn, task):
+                future = Future()
+                future.set_result(pickle.loads(pickle.dumps(fn(pickle.loads(pickle.dumps(task))))))
+                return future
+
+        fields = StudentClientStatements.export_config['default']['fields']
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch('fairyspace.rest.shard.ProcessPoolExecutor', PickleExecutor):
+                pooled = export_sharded(
+                    Student.objects.filter(school=self.school), fields, 'csv', shard_size=2, max_workers=2,
+                    directory=directory,
+                )
+            serial = export_sharded(
+                Student.objects.filter(school=self.school), fields, 'csv', shard_size=2, max_workers=0,
+                directory=directory,
+            )
+            self.assertEqual([item['index'] for item in pooled['shards']], [0, 1, 2])
+            with open(pooled['file'], 'rb') as f, open(serial['file'], 'rb') as g:
+                self.assertEqual(f.read(), g.read())
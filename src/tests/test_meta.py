@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase
+
+from fairyspace.utils import meta
+from school.models import Backpack, ClassRoom, Course, School, Student, Teacher
+
+
+class ModelMetaIndexTests(SimpleTestCase):
+    """模型元数据索引测试"""
+
+    def test_get_field(self):
+        self.assertIs(meta.get_field(School, 'classroom_set').related_model, ClassRoom)
+        self.assertIs(meta.get_field(School, 'students').related_model, Student)
+        self.assertIs(meta.get_field(Student, 'school_id'), Student._meta.get_field('school'))
+        self.assertIsNone(meta.get_field(Student, 'not_exist'))
+
+    def test_relation_kind(self):
+        index = meta.get_model_index(Student)
+        self.assertIs(index, meta.get_model_index(Student))
+
+        self.assertEqual(index.get_relation_kind('school'), meta.ModelMetaIndex.FORWARD_FK)
+        self.assertEqual(index.get_relation_kind('teachers'), meta.ModelMetaIndex.FORWARD_M2M)
+        self.assertEqual(index.get_relation_kind('card'), meta.ModelMetaIndex.REVERSE_O2O)
+        self.assertEqual(index.get_relation_kind('backpack'), meta.ModelMetaIndex.REVERSE_O2O)
+        self.assertIsNone(index.get_relation_kind('name'))
+
+        self.assertTrue(meta.get_model_index(School).is_many('classroom_set'))
+        self.assertTrue(meta.get_model_index(Course).is_many('teachers'))
+        self.assertFalse(meta.get_model_index(Backpack).is_many('student'))
+
+    def test_field_lists(self):
+        self.assertEqual(
+            [item.name for item in meta.get_concrete_relation_fields(Teacher)],
+            ['school', 'courses'],
+        )
+        self.assertIsNone(meta.get_related_model_field(Student, get_user_model()))
+        self.assertEqual(list(meta.get_fairy_property_fields(School)), ['student_count'])
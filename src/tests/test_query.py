@@ -0,0 +1,435 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from rest_framework.response import Response
+from rest_framework.test import APITestCase
+
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.core import exception
+from fairyspace.rest.filters import apply_filters, filter_plan_cache
+from fairyspace.rest.instrument import get_fingerprint
+from fairyspace.rest.planner import compile_query_plan
+from fairyspace.rest.views import FairyGenericViewSet
+from school.factories import (
+    ClassRoomFactory,
+    CourseFactory,
+    SchoolFactory,
+    StudentFactory,
+    TeacherFactory,
+)
+from school.models import ClassRoom, Course, School, Student, StudentCard, Teacher
+
+
+class FilterTests(TestCase):
+    """过滤条件编译测试"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school_a = SchoolFactory(name='alpha')
+        cls.school_b = SchoolFactory(name='beta')
+
+        cls.teacher_a = TeacherFactory(school=cls.school_a, name='allen')
+        cls.teacher_b = TeacherFactory(school=cls.school_b, name='bob')
+        cls.course = CourseFactory(code='C01')
+        cls.teacher_a.courses.set([cls.course])
+
+        classroom_a = ClassRoomFactory(school=cls.school_a, teacher=cls.teacher_a, name='one')
+        classroom_b = ClassRoomFactory(school=cls.school_b, teacher=cls.teacher_b, name='two')
+        cls.students_a = [StudentFactory(classroom=classroom_a, name=f'a{index}') for index in range(3)]
+        cls.student_b = StudentFactory(classroom=classroom_b, name='b0')
+        for student in cls.students_a:
+            student.teachers.set([cls.teacher_a])
+
+    def filter(self, model, filters):
+        # 关系路径需要声明白名单，这里允许传入的全部字段
+        allowed_fields = [item.get('field') for item in filters] if isinstance(filters, list) else None
+        return list(apply_filters(model.objects.order_by('pk'), filters, allowed_fields))
+
+    def test_concrete_fields(self):
+        self.assertEqual(self.filter(Student, [{'field': 'name', 'operator': '=', 'value': 'b0'}]), [self.student_b])
+        self.assertEqual(
+            self.filter(Student, [{'field': 'name', 'operator': 'in', 'value': ['a0', 'a1']}]),
+            self.students_a[:2],
+        )
+        self.assertEqual(
+            self.filter(Student, [{'field': 'name', 'operator': 'not_in', 'value': ['a0', 'a1', 'a2']}]),
+            [self.student_b],
+        )
+
+    def test_single_valued_path(self):
+        self.assertEqual(self.filter(Student, [{'field': 'school.name', 'value': 'beta'}]), [self.student_b])
+        self.assertEqual(self.filter(Student, [{'field': 'school', 'value': self.school_b.pk}]), [self.student_b])
+
+    def test_many_valued_path_use_exists(self):
+        queryset = apply_filters(
+            School.objects.all(),
+            [{'field': 'students.name', 'operator': 'startswith', 'value': 'a'}],
+            ['students.name'],
+        )
+        self.assertIn('EXISTS', str(queryset.query))
+        self.assertNotIn('DISTINCT', str(queryset.query))
+        # 多个学生满足条件时，学校也只返回一次
+        self.assertEqual(list(queryset), [self.school_a])
+
+        self.assertEqual(self.filter(School, [{'field': 'classroom_set.name', 'value': 'two'}]), [self.school_b])
+        self.assertEqual(self.filter(Student, [{'field': 'teachers.name', 'value': 'allen'}]), self.students_a)
+        self.assertEqual(self.filter(Course, [{'field': 'teachers.school.name', 'value': 'alpha'}]), [self.course])
+        self.assertEqual(
+            self.filter(School, [{'field': 'teachers.courses.code', 'operator': '!=', 'value': 'C01'}]),
+            [self.school_b],
+        )
+
+    def test_many_valued_isnull(self):
+        isnull = [{'field': 'courses', 'operator': 'isnull', 'value': True}]
+        self.assertEqual(self.filter(Teacher, isnull), [self.teacher_b])
+        self.assertEqual(self.filter(Teacher, [{**isnull[0], 'value': False}]), [self.teacher_a])
+        self.assertEqual(self.filter(Student, [{**isnull[0], 'field': 'teachers'}]), [self.student_b])
+        with self.assertRaises(exception.FairySpaceException):
+            self.filter(Teacher, [{'field': 'courses', 'operator': 'isnull', 'value': 'yes'}])
+
+    def test_default_local_columns(self):
+        # 没有白名单时只允许当前模型自身的列
+        queryset = Student.objects.order_by('pk')
+        self.assertEqual(list(apply_filters(queryset, [{'field': 'school', 'value': self.school_b.pk}])), [self.student_b])
+        for field in ('school.name', 'teachers', 'teachers.name', 'card'):
+            with self.assertRaises(exception.FairySpaceException):
+                apply_filters(queryset, [{'field': field, 'operator': 'isnull', 'value': True}])
+
+    def test_invalid_filters(self):
+        for filters in (
+            [{'field': 'not_exist', 'value': 1}],
+            [{'field': 'name.first', 'value': 1}],
+            [{'field': 'name', 'operator': 'like', 'value': 1}],
+            [{'field': 'name', 'operator': 'in', 'value': 1}],
+            [{'field': 'enrollment_date', 'operator': '>', 'value': 'not a date'}],
+            {'field': 'name'},
+        ):
+            with self.assertRaises(exception.FairySpaceException):
+                self.filter(Student, filters)
+
+    def test_plan_cache(self):
+        filter_plan_cache.clear()
+        self.filter(Student, [{'field': 'school.name', 'value': 'alpha'}])
+        self.filter(Student, [{'field': 'school.name', 'value': 'beta'}])
+        self.assertEqual(filter_plan_cache.info()['hits'], 1)
+
+
+class FilterEndpointTests(APITestCase):
+    """列表接口应用过滤条件测试"""
+
+    def test_list_filters(self):
+        school = SchoolFactory()
+        classroom = ClassRoomFactory(school=school, teacher=TeacherFactory(school=school))
+        students = [StudentFactory(classroom=classroom) for _ in range(3)]
+
+        response = self.client.post(
+            '/fairy/client/school/student/list/',
+            format='json',
+            data={'fairyspace': {'fields': ['id'], 'filters': [{'field': 'id', 'operator': '>', 'value': students[0].pk}]}},
+        )
+        self.assertEqual([item['id'] for item in response.data['result']], [str(item.pk) for item in students[1:]])
+
+
+class QueryPlannerTests(APITestCase):
+    """展开字段查询计划测试"""
+
+    url = '/fairy/client/school/student/list/'
+
+    @classmethod
+    def setUpTestData(cls):
+        school = SchoolFactory()
+        teacher = TeacherFactory(school=school)
+        classroom = ClassRoomFactory(school=school, teacher=teacher)
+        for _ in range(3):
+            StudentFactory(classroom=classroom).teachers.set([teacher])
+
+    def test_plan(self):
+        plan = compile_query_plan(
+            Student,
+            ['school', 'school.teachers.courses', 'classroom.teacher', 'teachers.school', 'card'],
+        )
+        self.assertEqual(
+            plan.explain(),
+            {
+                'model': 'school.Student',
+                'select_related': ['school', 'classroom__teacher', 'card'],
+                'only': None,
+                'prefetch_related': [
+                    {
+                        'lookup': 'school__teachers',
+                        'model': 'school.Teacher',
+                        'select_related': [],
+                        'only': None,
+                        'prefetch_related': [
+                            {
+                                'lookup': 'courses',
+                                'model': 'school.Course',
+                                'select_related': [],
+                                'only': None,
+                                'prefetch_related': [],
+                            },
+                        ],
+                    },
+                    {
+                        'lookup': 'teachers',
+                        'model': 'school.Teacher',
+                        'select_related': ['school'],
+                        'only': None,
+                        'prefetch_related': [],
+                    },
+                ],
+            },
+        )
+
+        # 反向外键使用 accessor name 预取，反向一对一和正向一对一使用 JOIN
+        self.assertEqual(compile_query_plan(School, ['classroom_set']).explain()['prefetch_related'][0]['lookup'], 'classroom_set')
+        self.assertEqual(compile_query_plan(StudentCard, ['student.school']).select_related, ('student__school',))
+        self.assertFalse(compile_query_plan(Student, ['name']))
+
+    def test_single_valued_expand_use_join(self):
+        fields = ['id', {'school': ['name']}, {'classroom': ['name', {'teacher': ['name']}]}]
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, format='json', data={'fairyspace': {'fields': fields}})
+        self.assertEqual(len(response.data['result']), 3)
+        self.assertEqual(response.data['result'][0]['classroom']['teacher']['name'], Student.objects.first().classroom.teacher.name)
+
+        fields = ['id', {'teachers': ['name', {'school': ['name']}]}]
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, format='json', data={'fairyspace': {'fields': fields}})
+        self.assertEqual(response.data['result'][0]['teachers'][0]['school']['name'], Student.objects.first().school.name)
+
+    def test_prune_columns(self):
+        fields = ['id', 'name', {'classroom': ['name']}, {'teachers': ['name', {'courses': ['code']}]}]
+        plan = compile_query_plan(Student, ['classroom', 'teachers.courses'], fields, prune=True)
+        self.assertEqual(plan.only, ('classroom', 'id', 'name', 'classroom__id', 'classroom__name'))
+        teacher_plan = plan.prefetches[0][1]
+        self.assertEqual(teacher_plan.only, ('id', 'name'))
+        self.assertEqual(teacher_plan.prefetches[0][1].only, ('code', 'id'))
+
+        # 反向外键预取时补充外键列，计算属性使用 depends 声明的列
+        plan = compile_query_plan(School, ['students'], ['name', 'student_count', {'students': ['name']}], prune=True)
+        self.assertEqual(plan.only, ('id', 'name'))
+        self.assertEqual(plan.prefetches[0][1].only, ('id', 'name', 'school'))
+
+        # 没有展示字段或者不裁剪时，查询全部的列
+        self.assertIsNone(compile_query_plan(Student, ['classroom'], None, prune=True).only)
+        self.assertIsNone(compile_query_plan(Student, ['classroom'], fields).only)
+
+    def test_prune_columns_response(self):
+        fields = ['id', 'name', {'classroom': ['name']}, {'teachers': ['name', {'courses': ['code']}]}]
+        with self.assertNumQueries(3) as context:
+            response = self.client.post(self.url, format='json', data={'fairyspace': {'fields': fields}})
+        self.assertNotIn('enrollment_date', context.captured_queries[0]['sql'])
+        self.assertNotIn('description', context.captured_queries[2]['sql'])
+
+        student = Student.objects.order_by('pk').first()
+        self.assertEqual(response.data['result'][0]['classroom']['name'], student.classroom.name)
+        self.assertEqual(response.data['result'][0]['teachers'][0]['name'], student.teachers.first().name)
+
+
+class LimitedExpandTests(APITestCase):
+    """展开关系限制条数和返回总数的测试"""
+
+    url = '/fairy/client/school/school/list/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.schools = [SchoolFactory() for _ in range(3)]
+        for count, school in enumerate(cls.schools):
+            classroom = ClassRoomFactory(school=school, teacher=TeacherFactory(school=school))
+            for _ in range(count * 2):
+                StudentFactory(classroom=classroom)
+
+    def post_list(self, fields, url=None):
+        response = self.client.post(url or self.url, format='json', data={'fairyspace': {'fields': fields}})
+        self.assertEqual(response.data['code'], 0)
+        return response.data['result']
+
+    def test_limit_and_total(self):
+        fields = ['id', {'students': {'fields': ['id', 'name'], 'limit': 3, 'ordering': ['-id'], 'total': True}}]
+        with self.assertNumQueries(2) as context:
+            result = self.post_list(fields)
+        self.assertIn('ROW_NUMBER', context.captured_queries[1]['sql'])
+
+        for school, item in zip(self.schools, sorted(result, key=lambda item: int(item['id']))):
+            expected = list(school.students.order_by('-id').values_list('id', flat=True)[:3])
+            self.assertEqual([int(student['id']) for student in item['students']], expected)
+            self.assertEqual(item['students_total'], school.students.count())
+
+    def test_nested_total(self):
+        # 单值关系下需要返回总数时，单值关系使用 Prefetch，在关联模型上注解总数
+        url = '/fairy/client/school/student/list/'
+        fields = ['id', {'school': ['name', {'students': {'fields': ['id'], 'limit': 1, 'total': True}}]}]
+        result = self.post_list(fields, url=url)
+        for item in result:
+            school = Student.objects.get(pk=item['id']).school
+            self.assertEqual(item['school']['students_total'], school.students.count())
+            self.assertEqual(len(item['school']['students']), 1)
+
+    def test_plan_and_invalid_options(self):
+        fields = [{'teachers': {'fields': ['name'], 'limit': 2}}]
+        plan = compile_query_plan(Student, ['teachers'], fields).prefetches[0][1]
+        self.assertEqual((plan.limit, plan.ordering), (2, ('id',)))
+
+        for options in ({'limit': 0}, {'limit': '2'}, {'ordering': ['not_exist']}, {'ordering': 'name'}):
+            with self.assertRaises(exception.FairySpaceException):
+                compile_query_plan(Student, ['teachers'], [{'teachers': {'fields': ['name'], **options}}])
+        with self.assertRaises(exception.FairySpaceException):
+            compile_query_plan(Student, ['school'], [{'school': {'fields': ['name'], 'total': True}}])
+
+
+class QueryInstrumentationTests(APITestCase):
+    """请求级别的 SQL 记录测试"""
+
+    url = '/fairy/client/school/student/list/'
+
+    @classmethod
+    def setUpTestData(cls):
+        school = SchoolFactory()
+        classroom = ClassRoomFactory(school=school, teacher=TeacherFactory(school=school))
+        for _ in range(6):
+            StudentFactory(classroom=classroom)
+
+    def post_list(self, fields):
+        return self.client.post(self.url, format='json', data={'fairyspace': {'fields': fields}})
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            get_fingerprint('SELECT "a"."id" FROM "a" WHERE "a"."id" IN (%s, %s, %s) AND "a"."n" = \'x\' LIMIT 21'),
+            'SELECT "a"."id" FROM "a" WHERE "a"."id" IN (...) AND "a"."n" = ? LIMIT ?',
+        )
+
+    @override_settings(DEBUG=True)
+    def test_debug_summary_and_n_plus_one(self):
+        response = self.post_list(['id', {'school': ['name']}])
+        self.assertEqual(response.data['queries']['count'], 1)
+        self.assertEqual(response.data['queries']['repeated'], [])
+
+        # 没有展开的多对多字段，每一行都会查询一次
+        with self.assertLogs('fairyspace.rest.views', level='WARNING') as logs:
+            response = self.post_list(['id', 'teachers'])
+        self.assertEqual(response.data['queries']['repeated'][0]['count'], 6)
+        self.assertIn('possible N+1', logs.output[0])
+
+    def test_disabled_by_default(self):
+        with mock.patch.object(FairyGenericViewSet, 'fairy_check_queries') as check_queries:
+            self.post_list(['id'])
+        check_queries.assert_not_called()
+
+    @mock.patch.object(fairy_space_settings, 'QUERY_INSTRUMENTATION', True)
+    def test_query_budget(self):
+        with mock.patch.object(FairyGenericViewSet, 'fairy_get_query_budget', return_value=1):
+            with self.assertLogs('fairyspace.rest.views', level='WARNING'):
+                self.assertEqual(self.post_list(['id', 'teachers']).data['code'], 0)
+
+            with mock.patch.object(fairy_space_settings, 'QUERY_BUDGET_ACTION', 'raise'):
+                self.assertEqual(self.post_list(['id']).data['code'], 0)
+                with self.assertRaises(exception.FairySpaceException) as context:
+                    with mock.patch.object(fairy_space_settings, 'N_PLUS_ONE_THRESHOLD', None):
+                        self.post_list(['id', 'teachers'])
+        self.assertEqual(context.exception.error_code, exception.FAIRY_QUERY_BUDGET_EXCEEDED)
+
+    @mock.patch.object(fairy_space_settings, 'QUERY_INSTRUMENTATION', False)
+    @mock.patch.object(fairy_space_settings, 'QUERY_BUDGET_ACTION', 'raise')
+    def test_query_budget_without_instrumentation(self):
+        # 没有开启记录时，声明了预算的动作仍然会检查预算
+        with mock.patch.object(FairyGenericViewSet, 'fairy_get_query_budget', return_value=1):
+            self.assertEqual(self.post_list(['id']).data['code'], 0)
+            with self.assertRaises(exception.FairySpaceException) as context:
+                self.post_list(['id', 'teachers'])
+        self.assertEqual(context.exception.error_code, exception.FAIRY_QUERY_BUDGET_EXCEEDED)
+
+    @mock.patch.object(fairy_space_settings, 'QUERY_INSTRUMENTATION', True)
+    @mock.patch.object(fairy_space_settings, 'QUERY_BUDGET_ACTION', 'raise')
+    def test_query_budget_exception_handler(self):
+        def exception_handler(exc, context):
+            return Response({'code': exc.error_code, 'message': exc.error_message, 'result': None}, status=400)
+
+        classroom = ClassRoom.objects.get()
+        data = {'name': 'new', 'classroom': classroom.pk, 'school': classroom.school_id, 'enrollment_date': '2024-09-01'}
+        with mock.patch.object(FairyGenericViewSet, 'fairy_get_query_budget', return_value=0):
+            with mock.patch.object(FairyGenericViewSet, 'get_exception_handler', return_value=exception_handler):
+                response = self.client.post('/fairy/client/school/student/', format='json', data={'data': data})
+
+        # 超过预算的异常通过 handle_exception 返回，请求中的写入回滚
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['code'], exception.FAIRY_QUERY_BUDGET_EXCEEDED)
+        self.assertFalse(Student.objects.filter(name='new').exists())
+
+
+class StudentAggregateStatements:
+    filter_fields = ['school.name']
+    aggregate_fields = ['name', 'created_at', 'school', 'school.name', 'school.established_year', 'teachers.name']
+
+
+class AggregateTests(APITestCase):
+    """分组统计测试"""
+
+    url = '/fairy/client/school/student/aggregate/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school_a = SchoolFactory(name='alpha', established_year=1990)
+        cls.school_b = SchoolFactory(name='beta', established_year=2000)
+        classroom_a = ClassRoomFactory(school=cls.school_a, teacher=TeacherFactory(school=cls.school_a))
+        classroom_b = ClassRoomFactory(school=cls.school_b, teacher=TeacherFactory(school=cls.school_b))
+        for _ in range(3):
+            StudentFactory(classroom=classroom_a)
+        StudentFactory(classroom=classroom_b)
+
+    def post_aggregate(self, statements=StudentAggregateStatements, **namespace):
+        statement_module = SimpleNamespace(StudentClientStatements=statements)
+        with mock.patch('fairyspace.rest.mixins.fairy_load_statement', return_value=(None, statement_module)):
+            return self.client.post(self.url, format='json', data={'fairyspace': namespace})
+
+    def test_group_by_relation_path(self):
+        with self.assertNumQueries(1):
+            response = self.post_aggregate(
+                group_by=['school.name'],
+                metrics=[{'func': 'count'}, {'func': 'max', 'field': 'school.established_year', 'alias': 'year'}],
+                ordering=['-count'],
+            )
+        self.assertEqual(
+            response.data['result'],
+            [{'school.name': 'alpha', 'count': 3, 'year': 1990}, {'school.name': 'beta', 'count': 1, 'year': 2000}],
+        )
+
+    def test_filters_and_without_group(self):
+        response = self.post_aggregate(
+            metrics=[{'func': 'count_distinct', 'field': 'school'}, {'func': 'avg', 'field': 'school.established_year'}],
+            filters=[{'field': 'school.name', 'operator': '=', 'value': 'alpha'}],
+        )
+        self.assertEqual(response.data['result'], [{'school_count_distinct': 1, 'school.established_year_avg': 1990}])
+
+    def test_date_trunc(self):
+        response = self.post_aggregate(group_by=[{'field': 'created_at', 'trunc': 'year', 'alias': 'year'}])
+        self.assertEqual(len(response.data['result']), 1)
+        self.assertEqual(response.data['result'][0]['count'], 4)
+
+    def test_default_local_columns(self):
+        # 没有声明 aggregate_fields 时只允许当前模型自身的非关系列
+        response = self.post_aggregate(statements=object, group_by=[{'field': 'created_at', 'trunc': 'year'}])
+        self.assertEqual(response.data['result'][0]['count'], 4)
+        for namespace in (
+            {'group_by': ['school.name']},
+            {'group_by': ['school']},
+            {'metrics': [{'func': 'max', 'field': 'school.established_year'}]},
+        ):
+            with self.subTest(namespace=namespace):
+                with self.assertRaises(exception.FairySpaceException):
+                    self.post_aggregate(statements=object, **namespace)
+
+    def test_invalid(self):
+        invalid_list = [
+            {'group_by': ['teachers.name']},
+            {'group_by': ['missing']},
+            {'group_by': [{'field': 'name', 'trunc': 'month'}]},
+            {'metrics': [{'func': 'sum', 'field': 'name'}]},
+            {'metrics': [{'func': 'median', 'field': 'id'}]},
+            {'ordering': ['name']},
+        ]
+        for namespace in invalid_list:
+            with self.subTest(namespace=namespace):
+                with self.assertRaises(exception.FairySpaceException):
+                    self.post_aggregate(**namespace)
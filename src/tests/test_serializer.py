@@ -0,0 +1,193 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from rest_framework import serializers
+
+from fairyspace.rest.plan import RowPlan
+from fairyspace.rest.serializer import (
+    ModelSerializer,
+    get_dynamic_serializer_class,
+    serializer_class_cache,
+)
+from fairyspace.utils.cache import LRUCache
+from school.factories import (
+    BackpackFactory,
+    ClassRoomFactory,
+    CourseFactory,
+    SchoolFactory,
+    StudentCardFactory,
+    StudentFactory,
+    TeacherFactory,
+)
+from school.models import Course, School, Student
+
+
+class SerializerClassCacheTests(SimpleTestCase):
+    """动态序列化类缓存测试"""
+
+    def setUp(self):
+        serializer_class_cache.clear()
+
+    def test_same_shape_reuse_class(self):
+        fields = ['id', 'name', {'school': ['name', {'teachers': ['name']}]}]
+
+        first = get_dynamic_serializer_class(Student, 'list', fields)
+        second = get_dynamic_serializer_class(
+            Student,
+            'list',
+            ['id', 'name', {'school': ['name', {'teachers': ['name']}]}],
+        )
+
+        self.assertIs(first, second)
+        self.assertEqual(serializer_class_cache.info()['hits'], 1)
+        self.assertEqual(serializer_class_cache.info()['misses'], 1)
+
+    def test_different_shape_or_action(self):
+        first = get_dynamic_serializer_class(Student, 'list', ['id', 'name'])
+        self.assertIsNot(first, get_dynamic_serializer_class(Student, 'list', ['name', 'id']))
+        self.assertIsNot(first, get_dynamic_serializer_class(Student, 'retrieve', ['id', 'name']))
+        self.assertIsNot(first, get_dynamic_serializer_class(School, 'list', ['id', 'name']))
+
+    def test_fields_prototype(self):
+        serializer_class = get_dynamic_serializer_class(Student, 'list', ['id', 'name', {'school': ['name']}])
+
+        first, second = serializer_class(), serializer_class()
+        self.assertEqual(list(first.fields), ['id', 'name', 'school'])
+        self.assertEqual(list(first.fields), list(second.fields))
+        self.assertIsNot(first.fields['school'], second.fields['school'])
+
+    def test_lru_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.info()['evictions'], 1)
+
+
+class CompiledSerializerTests(TestCase):
+    """编译模式和默认序列化流程的一致性测试"""
+
+    @classmethod
+    def setUpTestData(cls):
+        courses = [CourseFactory() for _ in range(3)]
+        for _ in range(2):
+            school = SchoolFactory()
+            teachers = [TeacherFactory(school=school) for _ in range(2)]
+            teachers[0].courses.set(courses[:2])
+            classroom = ClassRoomFactory(school=school, teacher=teachers[0])
+            for index in range(3):
+                student = StudentFactory(classroom=classroom)
+                student.teachers.set(teachers)
+                # 部分学生没有学生卡和书包，反向一对一字段不输出
+                if index:
+                    StudentCardFactory(student=student)
+                if index != 1:
+                    BackpackFactory(student=student)
+
+    def serialize(self, model, fields, compiled, prefetch=()):
+        serializer_class_cache.clear()
+        queryset = model.objects.order_by('pk').prefetch_related(*prefetch)
+        with mock.patch.object(ModelSerializer, 'fairy_compiled', compiled):
+            serializer_class = get_dynamic_serializer_class(model, 'list', fields)
+            return serializer_class(queryset, many=True).data
+
+    def assert_parity(self, model, fields, prefetch=()):
+        expected = self.serialize(model, fields, False, prefetch)
+        result = self.serialize(model, fields, True, prefetch)
+        self.assertTrue(expected)
+        self.assertEqual(result, expected)
+
+    def test_all_fields(self):
+        self.assert_parity(Student, None)
+
+    def test_flat_fields(self):
+        self.assert_parity(
+            Student,
+            ['id', 'name', 'classroom', 'school', 'enrollment_date', 'created_at', 'teachers'],
+        )
+
+    def test_nested_fields(self):
+        self.assert_parity(
+            Student,
+            [
+                'id',
+                {'school': ['name', {'teachers': ['name', {'courses': ['code']}]}]},
+                {'card': ['card_number', 'is_active']},
+                {'backpack': ['brand', 'size']},
+                {'teachers': ['name', 'hire_date']},
+            ],
+            prefetch=('school__teachers__courses', 'card', 'backpack', 'teachers'),
+        )
+
+    def test_reverse_fields(self):
+        self.assert_parity(
+            School,
+            ['id', 'name', {'students': ['name', {'classroom': ['name']}]}, 'teachers'],
+            prefetch=('students__classroom',),
+        )
+        self.assert_parity(Course, ['code', {'teachers': ['name']}], prefetch=('teachers',))
+
+    def test_plan(self):
+        serializer_class = get_dynamic_serializer_class(Student, 'list', ['id', {'school': ['name']}])
+        plan = serializer_class().fairy_plan
+
+        self.assertIsInstance(plan, RowPlan)
+        self.assertEqual([item[0] for item in plan.items], ['id', 'school'])
+        self.assertIs(plan.items[1][3].model, School)
+
+    def test_plan_cached_on_class(self):
+        serializer_class_cache.clear()
+        serializer_class = get_dynamic_serializer_class(Student, 'list', ['id', {'school': ['name']}])
+        plan = serializer_class().fairy_plan
+        with mock.patch('fairyspace.rest.plan.compile_serializer') as compile_serializer:
+            self.assertIs(serializer_class(Student.objects.all(), many=True).child.fairy_plan, plan)
+        compile_serializer.assert_not_called()
+
+        # 依赖 context 的字段每个序列化对象单独编译
+        class MethodSerializer(serializer_class):
+            label = serializers.SerializerMethodField()
+
+            class Meta(serializer_class.Meta):
+                fields = ['id', 'label']
+
+            def get_label(self, obj):
+                return self.context['label']
+
+        student = Student.objects.first()
+        for label in ('a', 'b'):
+            self.assertEqual(MethodSerializer(student, context={'label': label}).data['label'], label)
+
+
+class BatchFairyPropertyTests(TestCase):
+    """批量计算属性测试"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.schools = [SchoolFactory() for _ in range(4)]
+        for index, school in enumerate(cls.schools):
+            classroom = ClassRoomFactory(school=school, teacher=TeacherFactory(school=school))
+            for _ in range(index):
+                StudentFactory(classroom=classroom)
+
+    def test_batch_once_per_page(self):
+        serializer_class = get_dynamic_serializer_class(School, 'list', ['id', 'student_count'])
+        for compiled in (True, False):
+            with mock.patch.object(ModelSerializer, 'fairy_compiled', compiled):
+                serializer_class_cache.clear()
+                schools = list(School.objects.order_by('pk'))
+                with self.assertNumQueries(1):
+                    data = serializer_class(schools, many=True).data
+                self.assertEqual([item['student_count'] for item in data], [0, 1, 2, 3])
+
+    def test_memoized_per_instance(self):
+        school = School.objects.get(pk=self.schools[2].pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(school.student_count(), 2)
+            self.assertEqual(school.student_count(), 2)
+
+        # 描述器是类级别共享的，不会保存模型实例
+        self.assertIsNone(getattr(School.__dict__['student_count'], '_instance', None))
@@ -0,0 +1,588 @@
+import contextlib
+import json
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from rest_framework.permissions import BasePermission
+from rest_framework.test import APITestCase
+
+from fairyspace.conf.settings import fairy_space_settings
+from fairyspace.core import exception
+from fairyspace.rest.form import create_form_class
+from fairyspace.rest.views import FairyGenericViewSet
+from school.factories import (
+    ClassRoomFactory,
+    CourseFactory,
+    NoticeFactory,
+    SchoolFactory,
+    StudentCardFactory,
+    StudentFactory,
+    TeacherFactory,
+)
+from school.models import ClassRoom, Course, Notice, School, Student, StudentCard, Teacher
+
+
+class NoticeClientStatements:
+    user_pip_config = {'field': 'owner', 'action_enabled': {'upsert': True, 'import_data': True}}
+
+
+NOTICE_STATEMENTS = SimpleNamespace(NoticeClientStatements=NoticeClientStatements)
+
+
+def filter_owner(view, queryset):
+    """只能看到自己的数据"""
+    return queryset.filter(owner=view.request.user)
+
+
+class BulkWriteTests(APITestCase):
+    """批量创建和批量更新测试"""
+
+    def post(self, url, data):
+        return self.client.post(url, format='json', data={'data': data})
+
+    def test_bulk_create(self):
+        courses = [CourseFactory(), CourseFactory()]
+        school = SchoolFactory()
+        items = [
+            {'name': f'teacher{index}', 'school': school.pk, 'subject': 'math', 'hire_date': '2024-01-01'}
+            for index in range(5)
+        ]
+        items[0]['courses'] = [course.pk for course in courses]
+
+        with mock.patch.object(fairy_space_settings, 'BULK_CHUNK_SIZE', 2):
+            response = self.post('/fairy/client/school/teacher/bulk/create/', items)
+        self.assertEqual(response.data['result']['success'], 5)
+        self.assertEqual(Teacher.objects.filter(school=school).count(), 5)
+
+        teacher = Teacher.objects.get(pk=response.data['result']['results'][0]['id'])
+        self.assertEqual(set(teacher.courses.all()), set(courses))
+
+    def test_bulk_create_atomic_and_savepoint(self):
+        items = [{'name': 'a', 'code': 'A01'}, {'name': 'b'}, {'name': 'c', 'code': 'C01'}]
+        with self.assertRaises(exception.FairySpaceException) as context:
+            self.post('/fairy/client/school/course/bulk/create/', items)
+        self.assertEqual(context.exception.error_data[0]['index'], 1)
+        self.assertFalse(Course.objects.exists())
+
+        with mock.patch.object(fairy_space_settings, 'BULK_TRANSACTION', 'savepoint'):
+            response = self.post('/fairy/client/school/course/bulk/create/', items)
+        self.assertEqual(response.data['result']['success'], 2)
+        self.assertIn('code', response.data['result']['results'][1]['errors'])
+        self.assertEqual(set(Course.objects.values_list('code', flat=True)), {'A01', 'C01'})
+
+    def test_batch_validation(self):
+        schools = [SchoolFactory(), SchoolFactory()]
+        CourseFactory(code='A01')
+        items = [
+            {'name': f'teacher{index}', 'school': schools[index % 2].pk, 'subject': 'math', 'hire_date': '2024-01-01'}
+            for index in range(10)
+        ]
+        with self.assertNumQueries(4):
+            # 外键一次 IN 查询，事务的保存点，bulk_create
+            response = self.post('/fairy/client/school/teacher/bulk/create/', items)
+        self.assertEqual(response.data['result']['success'], 10)
+
+        # 错误信息和逐条校验一致
+        cases = [
+            (Course, {'name': 'a', 'code': 'A01'}),
+            (Teacher, {'name': 'a', 'school': 0, 'subject': 'math', 'hire_date': '2024-01-01', 'courses': [0]}),
+        ]
+        for model, item in cases:
+            form = create_form_class(model, 'create')(data=item)
+            self.assertFalse(form.is_valid())
+            url = f'/fairy/client/school/{model._meta.model_name}/bulk/create/'
+            with mock.patch.object(fairy_space_settings, 'BULK_TRANSACTION', 'savepoint'):
+                response = self.post(url, [item])
+            self.assertEqual(response.data['result']['results'][0]['errors'], form.errors)
+
+    def test_batch_duplicates(self):
+        # 同一批数据中唯一字段的值重复，后面的数据和已经存在的值一样返回 unique 错误
+        items = [{'name': 'a', 'code': 'A01'}, {'name': 'b', 'code': 'A01'}, {'name': 'c', 'code': 'C01'}]
+        with mock.patch.object(fairy_space_settings, 'BULK_TRANSACTION', 'savepoint'):
+            response = self.post('/fairy/client/school/course/bulk/create/', items)
+        result = response.data['result']
+        self.assertEqual(result['success'], 2)
+        self.assertEqual(result['results'][1]['errors']['code'][0].code, 'unique')
+        self.assertEqual(set(Course.objects.values_list('code', flat=True)), {'A01', 'C01'})
+
+        # 冲突更新时唯一键重复的数据只写入第一条
+        items = [{'name': 'x', 'code': 'A01'}, {'name': 'y', 'code': 'A01'}, {'name': 'z', 'code': 'Z01'}]
+        with mock.patch.object(fairy_space_settings, 'BULK_TRANSACTION', 'savepoint'):
+            response = self.client.post(
+                '/fairy/client/school/course/upsert/',
+                format='json',
+                data={'data': items, 'fairyspace': {'unique_fields': ['code']}},
+            )
+        result = response.data['result']
+        self.assertEqual((result['created'], result['updated'], result['failed']), (1, 1, 1))
+        self.assertEqual(result['results'][1]['errors']['non_field_errors'][0].code, 'unique')
+        self.assertEqual(Course.objects.get(code='A01').name, 'x')
+
+    def test_upsert(self):
+        course = CourseFactory(code='A01', name='old', description='keep')
+        items = [{'name': 'new', 'code': 'A01'}, {'name': 'b', 'code': 'B01'}]
+        with self.assertNumQueries(5):
+            # 已经存在的唯一键，结果集中已经存在的数据，事务的保存点，冲突更新
+            response = self.client.post(
+                '/fairy/client/school/course/upsert/',
+                format='json',
+                data={'data': items, 'fairyspace': {'unique_fields': ['code']}},
+            )
+        result = response.data['result']
+        self.assertEqual((result['created'], result['updated']), (1, 1))
+        self.assertEqual(result['results'][0], {'index': 0, 'id': course.pk, 'created': False})
+        self.assertEqual(result['results'][1]['id'], Course.objects.get(code='B01').pk)
+
+        course.refresh_from_db()
+        self.assertEqual((course.name, course.description), ('new', 'keep'))
+
+        # 已经存在的数据作为当前对象校验，其他唯一字段不会和自身冲突
+        card = StudentCardFactory(card_number='N01')
+        item = {'student': card.student_id, 'card_number': 'N01', 'issued_date': '2024-01-01', 'is_active': False}
+        response = self.client.post(
+            '/fairy/client/school/studentcard/upsert/',
+            format='json',
+            data={'data': [item], 'fairyspace': {'unique_fields': ['card_number']}},
+        )
+        self.assertEqual(response.data['result']['updated'], 1)
+        card.refresh_from_db()
+        self.assertFalse(card.is_active)
+
+        with self.assertRaises(exception.FairySpaceException):
+            self.post('/fairy/client/school/course/upsert/', items)
+
+    def test_upsert_scope(self):
+        """冲突更新只能更新视图结果集中并且通过对象级权限校验的数据，用户字段不会更新"""
+
+        class OwnerPermission(BasePermission):
+            def has_object_permission(self, request, view, obj):
+                return obj.owner_id == request.user.pk
+
+        owner, other = [get_user_model().objects.create_user(username=name) for name in ('a', 'b')]
+        notice = NoticeFactory(code='N01', title='old', owner=owner)
+        item = {'school': notice.school_id, 'title': 'new', 'code': 'N01'}
+        self.client.force_authenticate(other)
+
+        def upsert(permission=None, scoped=False):
+            patches = [
+                mock.patch('fairyspace.rest.mixins.fairy_load_statement', return_value=(None, NOTICE_STATEMENTS)),
+                mock.patch.object(fairy_space_settings, 'BULK_TRANSACTION', 'savepoint'),
+                mock.patch.object(FairyGenericViewSet, 'get_permissions', return_value=[permission or BasePermission()]),
+            ]
+            if scoped:
+                patches.append(mock.patch.object(FairyGenericViewSet, 'filter_queryset', filter_owner))
+            with contextlib.ExitStack() as stack:
+                for patch in patches:
+                    stack.enter_context(patch)
+                response = self.client.post(
+                    '/fairy/client/school/notice/upsert/',
+                    format='json',
+                    data={'data': [item], 'fairyspace': {'unique_fields': ['code']}},
+                )
+            return response.data['result']
+
+        for kwargs in ({'permission': OwnerPermission()}, {'scoped': True}):
+            with self.subTest(**kwargs):
+                result = upsert(**kwargs)
+                self.assertEqual(result['failed'], 1)
+                self.assertIn('non_field_errors', result['results'][0]['errors'])
+                notice.refresh_from_db()
+                self.assertEqual((notice.title, notice.owner), ('old', owner))
+
+        # 没有限制时可以更新，但是不会改变数据的归属
+        self.assertEqual(upsert()['updated'], 1)
+        notice.refresh_from_db()
+        self.assertEqual((notice.title, notice.owner), ('new', owner))
+
+    def test_bulk_update(self):
+        teachers = [TeacherFactory(subject='math') for _ in range(3)]
+        course = CourseFactory()
+        items = [{'id': teacher.pk, 'subject': 'art'} for teacher in teachers]
+        items[0]['courses'] = [course.pk]
+
+        with self.assertNumQueries(7):
+            # in_bulk，校验多对多的关联数据，bulk_update，中间表的删除和插入，事务的保存点
+            response = self.post('/fairy/client/school/teacher/bulk/update/', items)
+        self.assertEqual(response.data['result']['success'], 3)
+        self.assertEqual(set(Teacher.objects.values_list('subject', flat=True)), {'art'})
+        self.assertEqual(list(teachers[0].courses.all()), [course])
+
+        with mock.patch.object(fairy_space_settings, 'BULK_TRANSACTION', 'savepoint'):
+            response = self.post('/fairy/client/school/teacher/bulk/update/', [{'id': 0, 'subject': 'x'}])
+        self.assertEqual(response.data['result']['failed'], 1)
+
+
+class ImportTests(APITestCase):
+    """从文件导入测试"""
+
+    def upload(self, name, content, namespace=None):
+        data = {'file': SimpleUploadedFile(name, content.encode('utf-8'))}
+        if namespace is not None:
+            data['fairyspace'] = json.dumps(namespace)
+        return self.client.post('/fairy/client/school/course/import/', data, format='multipart')
+
+    def test_import_csv(self):
+        content = '\ufeffname,code,description\n语文,C01,\n数学,C02,基础\n'
+        with mock.patch.object(fairy_space_settings, 'BULK_CHUNK_SIZE', 1):
+            response = self.upload('courses.csv', content)
+        self.assertEqual(response.data['result']['success'], 2)
+        self.assertEqual(dict(Course.objects.values_list('code', 'name')), {'C01': '语文', 'C02': '数学'})
+
+    def test_import_ndjson_upsert(self):
+        CourseFactory(code='C01', name='old', description='keep')
+        content = '{"name": "new", "code": "C01"}\n\n{"name": "b", "code": "C02"}\n'
+        response = self.upload('courses.ndjson', content, {'unique_fields': ['code']})
+        self.assertEqual(response.data['result']['success'], 2)
+
+        course = Course.objects.get(code='C01')
+        self.assertEqual((course.name, course.description), ('new', 'keep'))
+        self.assertEqual(Course.objects.count(), 2)
+
+    def test_import_upsert_scope(self):
+        # 指定唯一键导入时，不能更新视图结果集之外的数据
+        owner, other = [get_user_model().objects.create_user(username=name) for name in ('a', 'b')]
+        notice = NoticeFactory(code='N01', title='old', owner=owner)
+        content = json.dumps({'school': notice.school_id, 'title': 'new', 'code': 'N01'})
+        data = {
+            'file': SimpleUploadedFile('notices.ndjson', content.encode('utf-8')),
+            'fairyspace': json.dumps({'unique_fields': ['code']}),
+        }
+        self.client.force_authenticate(other)
+        with mock.patch('fairyspace.rest.mixins.fairy_load_statement', return_value=(None, NOTICE_STATEMENTS)):
+            with mock.patch.object(FairyGenericViewSet, 'filter_queryset', filter_owner):
+                with self.assertRaises(exception.FairySpaceException) as context:
+                    self.client.post('/fairy/client/school/notice/import/', data, format='multipart')
+        self.assertEqual(context.exception.error_data['errors'][0]['line'], 1)
+        notice.refresh_from_db()
+        self.assertEqual((notice.title, notice.owner), ('old', owner))
+
+    def test_import_errors(self):
+        content = '{"name": "a", "code": "A01"}\nnot json\n{"name": "b"}\n'
+        with self.assertRaises(exception.FairySpaceException) as context:
+            self.upload('courses.jsonl', content)
+        self.assertEqual([item['line'] for item in context.exception.error_data['errors']], [2, 3])
+        self.assertFalse(Course.objects.exists())
+
+        with mock.patch.multiple(fairy_space_settings, BULK_TRANSACTION='savepoint', IMPORT_MAX_ERRORS=1):
+            response = self.upload('courses.txt', content, {'format': 'ndjson'})
+        result = response.data['result']
+        self.assertEqual((result['rows'], result['success'], result['failed']), (3, 1, 2))
+        self.assertTrue(result['errors_truncated'])
+        self.assertEqual(list(Course.objects.values_list('code', flat=True)), ['A01'])
+
+
+class StudentNestedStatements:
+    nested_fields = ['classroom', 'card', 'backpack', 'teachers']
+
+
+class ClassRoomNestedStatements:
+    nested_fields = ['students']
+
+
+class NestedWriteTests(APITestCase):
+    """嵌套写入测试"""
+
+    def write(self, method, url, data, statements=True):
+        statement_module = SimpleNamespace(
+            StudentClientStatements=StudentNestedStatements,
+            ClassRoomClientStatements=ClassRoomNestedStatements,
+        )
+        if not statements:
+            statement_module = None
+        with mock.patch('fairyspace.rest.mixins.fairy_load_statement', return_value=(None, statement_module)):
+            return getattr(self.client, method)(url, format='json', data={'data': data})
+
+    def test_nested_create(self):
+        school = SchoolFactory()
+        teacher = TeacherFactory(school=school)
+        data = {
+            'name': 'student',
+            'school': school.pk,
+            'enrollment_date': '2024-09-01',
+            'classroom': {'name': 'class', 'school': school.pk, 'grade': 1},
+            'card': {'card_number': 'N01', 'issued_date': '2024-09-01'},
+            'backpack': {'brand': 'b', 'color': 'RED', 'size': 'M', 'purchase_date': '2024-09-01'},
+            'teachers': [
+                teacher.pk,
+                {'name': 'new', 'school': school.pk, 'subject': 'art', 'hire_date': '2024-01-01'},
+            ],
+        }
+        response = self.write('post', '/fairy/client/school/student/', data)
+        student = Student.objects.get(pk=response.data['result']['id'])
+
+        self.assertEqual(student.classroom.name, 'class')
+        self.assertEqual(student.card.card_number, 'N01')
+        self.assertEqual(student.backpack.brand, 'b')
+        self.assertEqual(set(student.teachers.values_list('name', flat=True)), {teacher.name, 'new'})
+
+    def test_nested_not_allowed(self):
+        school = SchoolFactory()
+        data = {
+            'name': 'student',
+            'school': school.pk,
+            'enrollment_date': '2024-09-01',
+            'classroom': {'name': 'class', 'school': school.pk, 'grade': 1},
+        }
+        # 没有声明 nested_fields 时不允许嵌套写入
+        with self.assertRaises(exception.FairySpaceException):
+            self.write('post', '/fairy/client/school/student/', data, statements=False)
+
+        # 嵌套的关联数据中的关系需要声明完整的路径
+        data = {**data, 'classroom': {**data['classroom'], 'teacher': {'name': 't', 'school': school.pk}}}
+        with self.assertRaises(exception.FairySpaceException):
+            self.write('post', '/fairy/client/school/student/', data)
+        self.assertFalse(ClassRoom.objects.exists())
+
+    def test_nested_reverse_fk_and_errors(self):
+        school = SchoolFactory()
+        classroom = ClassRoomFactory(school=school)
+        student = {'name': 's', 'school': school.pk, 'enrollment_date': '2024-09-01'}
+        data = {'name': 'class', 'school': school.pk, 'grade': 1, 'students': [student, student]}
+        response = self.write('post', '/fairy/client/school/classroom/', data)
+        self.assertEqual(Student.objects.filter(classroom_id=response.data['result']['id']).count(), 2)
+
+        # 关联数据的错误按照嵌套的结构返回，整个请求回滚
+        data = {**data, 'students': [student, {'name': 's'}]}
+        response = self.write('post', '/fairy/client/school/classroom/', data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['students'][0], {})
+        self.assertIn('enrollment_date', response.data['students'][1])
+        self.assertEqual(ClassRoom.objects.count(), 2)
+
+        # 更新时反向外键的关联数据只追加，不删除原来的数据
+        classroom_id = ClassRoom.objects.exclude(pk=classroom.pk).get().pk
+        data = {'students': [student]}
+        self.write('patch', f'/fairy/client/school/classroom/{classroom_id}/', data)
+        self.assertEqual(Student.objects.filter(classroom_id=classroom_id).count(), 3)
+
+        # 更新时多对多的嵌套数据替换原来的关系
+        existing = StudentFactory(classroom=classroom, school=school)
+        existing.teachers.add(TeacherFactory(school=school))
+        data = {'teachers': [{'name': 't', 'school': school.pk, 'subject': 'art', 'hire_date': '2024-01-01'}]}
+        self.write('patch', f'/fairy/client/school/student/{existing.pk}/', data)
+        self.assertEqual(list(existing.teachers.values_list('name', flat=True)), ['t'])
+        self.assertFalse(StudentCard.objects.exists())
+
+        # 多对多的错误信息和反向外键一样，是和传入的列表一一对应的列表
+        data = {'teachers': [0, {'name': 't'}]}
+        response = self.write('patch', f'/fairy/client/school/student/{existing.pk}/', data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data['teachers']), 2)
+        self.assertIn('0', response.data['teachers'][0][0])
+        self.assertIn('school', response.data['teachers'][1])
+
+
+class ManyToManyLinkTests(APITestCase):
+    """多对多关系批量关联测试"""
+
+    def link(self, model, mode, relation, pairs):
+        return self.client.post(
+            f'/fairy/client/school/{model}/m2m/{mode}/',
+            format='json',
+            data={'data': pairs, 'fairyspace': {'relation': relation}},
+        )
+
+    def test_link(self):
+        teachers = [TeacherFactory() for _ in range(3)]
+        courses = [CourseFactory() for _ in range(3)]
+        teachers[0].courses.add(courses[0])
+        pairs = [[teacher.pk, course.pk] for teacher in teachers[:2] for course in courses]
+
+        with self.assertNumQueries(7):
+            # 当前数据和关联数据的主键校验，插入前后的数量，事务的保存点，插入
+            response = self.link('teacher', 'add', 'courses', pairs)
+        self.assertEqual(response.data['result'], {'added': 5, 'removed': 0})
+        self.assertEqual(teachers[1].courses.count(), 3)
+
+        response = self.link('teacher', 'remove', 'courses', [[teachers[0].pk, courses[0].pk]])
+        self.assertEqual(response.data['result']['removed'], 1)
+
+        response = self.link('teacher', 'set', 'courses', [[teachers[1].pk, courses[2].pk]])
+        self.assertEqual(response.data['result'], {'added': 0, 'removed': 2})
+        self.assertEqual(list(teachers[1].courses.all()), [courses[2]])
+
+        # 反向多对多
+        student = StudentFactory()
+        self.link('teacher', 'add', 'student_set', [[teachers[2].pk, student.pk]])
+        self.assertEqual(list(student.teachers.all()), [teachers[2]])
+
+        with self.assertRaises(exception.FairySpaceException):
+            self.link('teacher', 'add', 'courses', [[teachers[0].pk, 0]])
+        with self.assertRaises(exception.FairySpaceException):
+            self.link('teacher', 'add', 'school', [[teachers[0].pk, 1]])
+
+
+    def test_link_object_permissions(self):
+        class DenyObjectPermission(BasePermission):
+            def has_object_permission(self, request, view, obj):
+                return obj.name != 'protected'
+
+        teachers = [TeacherFactory(name='a'), TeacherFactory(name='protected')]
+        course = CourseFactory()
+        with mock.patch.object(FairyGenericViewSet, 'get_permissions', return_value=[DenyObjectPermission()]):
+            for mode in ('add', 'set', 'remove'):
+                response = self.link('teacher', mode, 'courses', [[teacher.pk, course.pk] for teacher in teachers])
+                self.assertEqual(response.status_code, 403)
+            self.assertFalse(Teacher.courses.through.objects.exists())
+
+            response = self.link('teacher', 'add', 'courses', [[teachers[0].pk, course.pk]])
+            self.assertEqual(response.data['result'], {'added': 1, 'removed': 0})
+
+
+class DeleteTests(APITestCase):
+    """批量删除测试"""
+
+    def create_school(self, size):
+        school = SchoolFactory()
+        teacher = TeacherFactory(school=school)
+        teacher.courses.add(CourseFactory())
+        for _ in range(size):
+            student = StudentFactory(classroom=ClassRoomFactory(school=school, teacher=teacher), school=school)
+            student.teachers.add(teacher)
+            StudentCardFactory(student=student)
+        return school
+
+    def destroy_many(self, ids, namespace=None):
+        return self.client.post(
+            '/fairy/client/school/school/destroy_many/',
+            format='json',
+            data={'data': ids, 'fairyspace': namespace or {}},
+        )
+
+    def test_destroy_many(self):
+        schools = [self.create_school(1), self.create_school(3)]
+        other_teacher = TeacherFactory()
+        other_teacher.courses.add(CourseFactory())
+        course_count = Course.objects.count()
+
+        # 删除的查询数量和级联的数据量无关：主键，保存点，每个中间表、置空和级联的模型各一条
+        with self.assertNumQueries(18):
+            response = self.destroy_many([school.pk for school in schools])
+        rows = response.data['result']['rows']
+        self.assertEqual(rows['school.School'], 2)
+        self.assertEqual(rows['school.Student'], 4)
+        self.assertEqual(rows['school.StudentCard'], 4)
+        self.assertEqual(list(Teacher.objects.all()), [other_teacher])
+        self.assertEqual(other_teacher.courses.count(), 1)
+        self.assertEqual(Teacher.courses.through.objects.count(), 1)
+        self.assertFalse(Student.teachers.through.objects.exists())
+        self.assertEqual(Course.objects.count(), course_count)
+
+    def test_destroy_hidden_relation(self):
+        # related_name 为 '+' 的外键没有反向关系，删除计划仍然需要级联删除
+        school = self.create_school(1)
+        NoticeFactory(school=school)
+        other = NoticeFactory()
+
+        response = self.destroy_many([school.pk])
+        self.assertEqual(response.data['result']['rows']['school.Notice'], 1)
+        self.assertEqual(list(Notice.objects.all()), [other])
+
+    def test_destroy_fallback_and_background(self):
+        school = self.create_school(2)
+        with mock.patch('fairyspace.rest.deletion.has_delete_receivers', return_value=True):
+            response = self.client.delete(f'/fairy/client/school/school/{school.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Student.objects.exists())
+
+        school = self.create_school(3)
+        with mock.patch('fairyspace.rest.deletion.threading.Thread') as thread:
+            # 后台线程在测试中直接执行
+            thread.side_effect = lambda target, args, daemon: mock.Mock(start=lambda: target(*args))
+            with mock.patch.object(fairy_space_settings, 'DELETE_CHUNK_SIZE', 1):
+                response = self.destroy_many([school.pk], {'background': True})
+        job = response.data['result']['job']
+
+        response = self.client.post(
+            '/fairy/client/school/school/destroy_many/status/', format='json', data={'fairyspace': {'job': job}}
+        )
+        result = response.data['result']
+        self.assertEqual((result['status'], result['total'], result['done']), ('finished', 1, 1))
+        self.assertEqual(result['rows']['school.Student'], 3)
+        self.assertFalse(Student.objects.exists())
+
+        # 任务的进度按照模型和用户隔离
+        with self.assertRaises(exception.FairySpaceException):
+            self.client.post(
+                '/fairy/client/school/student/destroy_many/status/', format='json', data={'fairyspace': {'job': job}}
+            )
+
+    def test_destroy_many_object_permissions(self):
+        class DenyObjectPermission(BasePermission):
+            def has_object_permission(self, request, view, obj):
+                return obj.name != 'protected'
+
+        schools = [self.create_school(1), SchoolFactory(name='protected')]
+        with mock.patch.object(FairyGenericViewSet, 'get_permissions', return_value=[DenyObjectPermission()]):
+            response = self.destroy_many([school.pk for school in schools])
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(School.objects.count(), 2)
+
+            response = self.destroy_many([schools[0].pk])
+        self.assertEqual(response.data['result']['rows']['school.School'], 1)
+
+
+class SchoolClientStatements:
+    increment_fields = ['established_year']
+
+
+class IncrementTests(APITestCase):
+    """原子增减测试"""
+
+    def increment(self, url_path, data, statements=SchoolClientStatements):
+        statement_module = SimpleNamespace(SchoolClientStatements=statements)
+        with mock.patch('fairyspace.rest.mixins.fairy_load_statement', return_value=(None, statement_module)):
+            return self.client.post(f'/fairy/client/school/school/{url_path}', format='json', data={'data': data})
+
+    def test_increment(self):
+        school = SchoolFactory(established_year=1990)
+        with self.assertNumQueries(3):
+            # 保存点，一条 UPDATE ... RETURNING，释放保存点
+            response = self.increment(f'{school.pk}/increment/', {'established_year': 5})
+        self.assertEqual(response.data['result'], {'id': school.pk, 'established_year': 1995})
+        school.refresh_from_db()
+        self.assertEqual(school.established_year, 1995)
+
+        for pk in ('0', 'abc'):
+            with self.assertRaises(exception.FairySpaceException) as context:
+                self.increment(f'{pk}/increment/', {'established_year': 1})
+            self.assertEqual(context.exception.error_code, exception.FAIRY_OBJECT_NOT_FOUND)
+
+    def test_increment_many(self):
+        schools = [SchoolFactory(established_year=2000), SchoolFactory(established_year=2010)]
+        response = self.increment(
+            'increment/',
+            [{'id': schools[1].pk, 'established_year': -10}, {'id': schools[0].pk, 'established_year': 3}],
+        )
+        self.assertEqual(
+            response.data['result'],
+            [{'id': schools[1].pk, 'established_year': 2000}, {'id': schools[0].pk, 'established_year': 2003}],
+        )
+
+    def test_increment_object_permissions(self):
+        class DenyObjectPermission(BasePermission):
+            def has_object_permission(self, request, view, obj):
+                return obj.name != 'protected'
+
+        schools = [SchoolFactory(established_year=2000), SchoolFactory(name='protected', established_year=2010)]
+        with mock.patch.object(FairyGenericViewSet, 'get_permissions', return_value=[DenyObjectPermission()]):
+            response = self.increment('increment/', [{'id': school.pk, 'established_year': 1} for school in schools])
+            self.assertEqual(response.status_code, 403)
+            response = self.increment(f'{schools[1].pk}/increment/', {'established_year': 1})
+            self.assertEqual(response.status_code, 403)
+            # 全部通过校验时正常增减
+            response = self.increment('increment/', [{'id': schools[0].pk, 'established_year': 1}])
+            self.assertEqual(response.data['result'], [{'id': schools[0].pk, 'established_year': 2001}])
+        self.assertEqual(list(School.objects.order_by('pk').values_list('established_year', flat=True)), [2001, 2010])
+
+    def test_increment_not_allowed(self):
+        school = SchoolFactory()
+        with self.assertRaises(exception.FairySpaceException):
+            self.increment(f'{school.pk}/increment/', {'name': 1})
+        with self.assertRaises(exception.FairySpaceException):
+            self.increment(f'{school.pk}/increment/', {'established_year': 1.5})
+        with self.assertRaises(exception.FairySpaceException):
+            self.increment(f'{school.pk}/increment/', {'established_year': 1}, statements=object)